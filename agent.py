@@ -1,6 +1,5 @@
 from dotenv import load_dotenv
 import os
-from livekit.agents import BackgroundAudioPlayer, AudioConfig, BuiltinAudioClip
 from livekit import agents, rtc, api
 from livekit.agents import Agent, RoomInputOptions, AgentSession  # <-- this line is key
 from livekit.plugins.turn_detector.english import EnglishModel
@@ -14,78 +13,75 @@ from livekit.plugins import (
 )
 from livekit.agents import get_job_context
 import json
+import time
 import asyncio
 import logging
-import csv
-import datetime
-import atexit
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
-# -------- CSV Logging Setup --------
-
-csv_file = open('call_log.csv', mode='a', newline='', encoding='utf-8')
-csv_writer = csv.writer(csv_file)
-
-# Write header if file is empty
-if os.stat('call_log.csv').st_size == 0:
-    csv_writer.writerow(['timestamp', 'event_type', 'speaker', 'text'])
-
-def log_event(event_type, speaker, text):
-    timestamp = datetime.datetime.now().isoformat()
-    csv_writer.writerow([timestamp, event_type, speaker, text])
-    csv_file.flush()  # write immediately
-
-atexit.register(csv_file.close)
-
-# -------- End CSV Logging Setup --------
+# Before the project modules below, which read their settings from the environment at import
+load_dotenv()
 
+from call_log import bind_call, flush_call_log, log_event
+from sheets_client import get_sheets_client, load_sheets_client, spreadsheets_resource
+from sheet_writer import get_sheet_writer
+from customer_index import get_customer_index
+from row_snapshots import RowSnapshot
+from prompts import (AGENT_INSTRUCTIONS, INBOUND_GREETING_INSTRUCTIONS, VOICEMAIL_INSTRUCTIONS,
+                     outbound_greeting_instructions)
+from greeting import GREETING_READY_TIMEOUT, PreparedGreeting, wait_for_answer
+from voice_metrics import CallMetrics, timed_tool, worker_metrics_options
+from answering_machine import AMD_ENABLED, MACHINE, detect_answering_machine
+from teardown import CALL_WRAPUP_TIMEOUT, WORKER_DRAIN_TIMEOUT, Teardown
+from model_routing import ModelRouter, RoutingConfig, get_route_latency
+from background_clips import background_audio_player, preload_background_clips
+from loop_watchdog import AGENT_PROFILE, LoopWatchdog, get_profiler, install_profile_signal
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-# -------- Google Sheets Setup --------
-SPREADSHEET_ID = "1QBTDOqKoPFuHFMordHVgNRt3S20zVnQgPigzk1kIzdQ"
-
-def get_sheets_service():
-    """Gets Google Sheets service instance"""
-    try:
-        creds = Credentials.from_authorized_user_file("token.json", ["https://www.googleapis.com/auth/spreadsheets"])
-        service = build("sheets", "v4", credentials=creds)
-        return service.spreadsheets()
-    except Exception as e:
-        logger.error(f"Error getting sheets service: {e}")
-        return None
+# Set PREWARM_MODELS=0 to load models inside every job instead (for comparison)
+PREWARM_MODELS = os.getenv("PREWARM_MODELS", "1") != "0"
+# Import this module once in the worker's forkserver (Linux) so job processes start with it loaded
+# instead of each importing it again; set to 0 to compare
+WORKER_PRELOAD_MAIN = os.getenv("WORKER_PRELOAD_MAIN", "1") != "0"
+
+# Work that is the same in every job process and safe to fork (no threads, sockets or event loop)
+# is done here at import, so with WORKER_PRELOAD_MAIN the forkserver does it once for all of them
+spreadsheets_resource()
+# Background sounds are decoded once here and their PCM pages shared by every job process
+preload_background_clips()
+
+def load_models() -> dict:
+    """Loads the models a session needs. They are read-only, so sessions can share them.
+
+    The turn detector is not included: its model already runs once per worker in
+    the shared inference process, and the EnglishModel handle is bound to the
+    job's inference executor, so it is created in each job.
+    """
+    return {
+        "vad": silero.VAD.load(),
+        "noise_cancellation": noise_cancellation.BVC(),
+    }
+
+def prewarm(proc: agents.JobProcess):
+    """Runs once per worker process, before it is given any job"""
+    if PREWARM_MODELS:
+        start = time.monotonic()
+        proc.userdata.update(load_models())
+        logger.info(f"Prewarmed models in {(time.monotonic() - start) * 1000:.0f}ms")
+    # Build the shared Sheets client now rather than during the first call
+    get_sheets_client()
+    # SIGUSR2 starts/stops the sampling profiler in this process
+    install_profile_signal()
 
 class Assistant(Agent):
     def __init__(self) -> None:
-        super().__init__(
-            instructions="""
-            You are a professional call agent. Your task is to:
-            1. Confirm the customer details I provide
-            2. If the user says ANY information is incorrect:
-               - Ask them for the correct information
-               - Use the update_customer_details function to update it
-               - Confirm the update was successful
-               - Read back the updated information to verify
-            3. Be polite and professional
-            4. Keep responses brief and to the point
-            5. End the call if the user requests
-            6. Detect and handle voicemail systems appropriately
-            7. If the user says anything like "goodbye", "hang up", "bye", or "end the call", you MUST call the `end_call` function tool.
-            
-            When updating details:
-            - For name updates, use field="name"
-            - For address updates, use field="address"
-            - Always confirm the update was successful before proceeding
-            """
-        )
+        # The same text for every call, so providers can serve it from their prompt cache
+        super().__init__(instructions=AGENT_INSTRUCTIONS)
+        self.hung_up = False
 
     @agents.function_tool
+    @timed_tool
     async def update_customer_details(self, ctx: agents.RunContext, field: str, value: str):
         """Update customer details in Google Sheets. Use field='name' or field='address'."""
         try:
@@ -103,7 +99,8 @@ class Assistant(Agent):
                 logger.error(error_msg)
                 return {"error": error_msg}
 
-            row_number = int(customer_data['index']) + 1  # Add 1 because sheet is 1-indexed
+            # The sheet row the customer was read from; older dispatches only carry the index
+            row_number = int(customer_data.get('row') or int(customer_data['index']) + 1)
             logger.info(f"Updating row {row_number}, field {field} to value {value}")
 
             # Map fields to columns
@@ -121,21 +118,12 @@ class Assistant(Agent):
             logger.info(f"Updating range: {range_name}")
 
             try:
-                # Get sheets service
-                sheets = get_sheets_service()
-                if not sheets:
-                    error_msg = "Failed to initialize Google Sheets service"
-                    logger.error(error_msg)
-                    return {"error": error_msg}
-
-                result = sheets.values().update(
-                    spreadsheetId=SPREADSHEET_ID,
-                    range=range_name,
-                    valueInputOption="USER_ENTERED",
-                    body={"values": [[value]]}
-                ).execute()
-                
-                logger.info(f"Update result: {result}")
+                # Queue the write; the shared writer batches it with other sessions' updates
+                # Carries who the row belonged to, so the write follows them if rows are moved before it is sent
+                identity = RowSnapshot.from_customer({**customer_data, "row": row_number})
+                await get_sheet_writer().record(range_name, [[value]], identity=identity)
+
+                logger.info(f"Queued update of {range_name}")
                 log_event('sheet_update', 'agent', f"Updated {field} to {value} in row {row_number}")
                 
                 # Update the session's customer data
@@ -144,12 +132,12 @@ class Assistant(Agent):
                 elif field == "address":
                     customer_data['address'] = value
                 ctx.session.customer_data = customer_data
+                await get_customer_index().update_field(row_number, field, value)
                 logger.info(f"Updated session customer data: {customer_data}")
                 
                 return {
                     "status": "success", 
                     "message": f"Updated {field} to: {value}",
-                    "updated_cells": result.get('updatedCells', 0)
                 }
 
             except Exception as e:
@@ -163,31 +151,60 @@ class Assistant(Agent):
             return {"error": error_msg}
 
     @agents.function_tool
+    @timed_tool
+    async def lookup_customer(self, ctx: agents.RunContext, phone_number: str, name: str = ""):
+        """Look up a caller's record by the phone number they give. Pass their name too if they said it."""
+        index = get_customer_index()
+        index.start()
+        if not index.ready and not await index.wait_ready(timeout=5):
+            error_msg = "Customer records are still loading, please try again shortly"
+            logger.error(error_msg)
+            return {"error": error_msg}
+
+        matches = await index.lookup(phone_number=phone_number, name=name or None)
+        log_event('function_call', 'agent', f"lookup_customer found {len(matches)} match(es)")
+        if not matches:
+            return {"status": "not_found", "message": "No customer record matches that phone number and name"}
+
+        customer = matches[0]
+        customer_data = {key: customer[key] for key in ("index", "name", "number", "address",
+                                                         "row", "phone_number", "row_hash")}
+        ctx.session.customer_data = customer_data
+        logger.info(f"Stored looked-up customer data in session: {customer_data}")
+        return {"status": "found", "name": customer["name"], "address": customer["address"]}
+
+    @agents.function_tool
+    @timed_tool
     async def end_call(self, ctx: agents.RunContext):
+        """Called when the user wants to end the call"""
         logger.info("🔔 end_call function_tool triggered")
         log_event('function_call', 'agent', 'end_call triggered')
-
-        """Called when the user wants to end the call"""
-        # let the agent finish speaking
-        current_speech = ctx.session.current_speech
-        if current_speech:
-            await current_speech.wait_for_playout()
         await self.hangup_call(ctx)
 
     @agents.function_tool
+    @timed_tool
     async def detected_answering_machine(self, ctx: agents.RunContext):
         """Call this tool if you have detected a voicemail system, AFTER hearing the voicemail greeting"""
         logger.info("Detected answering machine")
         log_event('event', 'agent', 'Detected answering machine')
+        await self.leave_voicemail(ctx.session)
 
-        await ctx.session.generate_reply(
-            instructions="Leave a voicemail message letting the user know you'll call back later."
-        )
+    async def leave_voicemail(self, session: AgentSession):
+        """Leave the voicemail message, then hang up"""
+        await session.generate_reply(instructions=VOICEMAIL_INSTRUCTIONS)
         await asyncio.sleep(0.5)  # Add a natural gap to the end of the voicemail message
-        await self.hangup_call(ctx)
-
-    async def hangup_call(self, ctx: agents.RunContext):
-        """Utility method to hang up the call"""
+        await self.hangup_call()
+
+    async def hangup_call(self, ctx: agents.RunContext = None):
+        """Utility method to hang up the call, once the agent's reply before `ctx`'s tool call has played out"""
+        if self.hung_up:
+            return
+        self.hung_up = True
+        if ctx is not None:
+            try:
+                await asyncio.wait_for(ctx.wait_for_playout(), CALL_WRAPUP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Agent still speaking after {CALL_WRAPUP_TIMEOUT}s, hanging up anyway")
         try:
             job_ctx = get_job_context()  # This should get the JobContext from RunContext
             log_event('event', 'agent', f'Hanging up call, deleting room {job_ctx.room.name}')
@@ -210,7 +227,43 @@ class Assistant(Agent):
     #     log_event('agent_reply', 'agent', text)
 
 
+async def screen_answering_machine(session: AgentSession, agent: Assistant, participant: rtc.RemoteParticipant,
+                                   vad, call_metrics: CallMetrics):
+    """Listens to the first seconds after answer. On an answering machine, cuts the
+    greeting short, waits for the beep and leaves the voicemail, without waiting
+    for the LLM to recognise the machine."""
+    def on_decision(decision):
+        call_metrics.record_amd_decision(decision.at, decision.label)
+        logger.info(f"Answering machine detection: {decision.label} ({decision.reason}) "
+                    f"after {decision.at * 1000:.0f}ms")
+        log_event('event', 'system', 'answering machine detection', result=decision.label,
+                  reason=decision.reason, decided_after_ms=round(decision.at * 1000))
+        if decision.label == MACHINE:
+            # Stop talking over the machine and keep its greeting away from the LLM
+            session.input.set_audio_enabled(False)
+            session.interrupt()
+
+    try:
+        detector = await detect_answering_machine(participant, vad, on_decision=on_decision)
+    except Exception as e:
+        logger.error(f"Answering machine detection failed: {e}")
+        return
+    if detector.decision and detector.decision.label == MACHINE:
+        log_event('event', 'system', 'Leaving voicemail', after_beep=detector.heard_beep)
+        session.clear_user_turn()
+        await agent.leave_voicemail(session)
+
+
 async def entrypoint(ctx: agents.JobContext):
+    job_started = time.monotonic()
+    bind_call(room_name=ctx.job.room.name, call_id=ctx.job.id)
+    # Anything holding up this job's event loop is logged with its stack
+    watchdog = LoopWatchdog()
+    watchdog.start()
+    profiler = get_profiler()
+    profiler.label = ctx.job.room.name
+    if AGENT_PROFILE:
+        profiler.start()
     logger.info("Starting agent session")
     log_event('event', 'system', 'Starting agent session')
 
@@ -218,10 +271,12 @@ async def entrypoint(ctx: agents.JobContext):
     logger.info(f"Raw job metadata: {ctx.job.metadata}")
     
     customer_data = None
+    routing = None
     try:
         if ctx.job.metadata:
             metadata = json.loads(ctx.job.metadata)
             customer_data = metadata.get("customer_data", {})
+            routing = metadata.get("routing")
             logger.info(f"Parsed customer data: {customer_data}")
         else:
             logger.warning("No metadata provided in job context")
@@ -229,37 +284,105 @@ async def entrypoint(ctx: agents.JobContext):
         logger.error(f"Error parsing metadata: {e}")
 
     await ctx.connect()
+
+    # Build the shared Sheets client in the background so the first tool call finds it warm
+    asyncio.create_task(load_sheets_client())
+
+    # Inbound callers are looked up in the customer index: have it fresh before they give their number.
+    # Outbound calls come with their customer and leave the shared index to others
+    if not customer_data:
+        get_customer_index().start()
+
+    # Start the shared sheet writer (replays any spooled updates) and push this call's
+    # updates out when the job ends instead of waiting for the next flush interval
+    sheet_writer = get_sheet_writer()
+    await sheet_writer.start()
     
     # Create the agent instance
     agent = Assistant()
 
+    # Models are loaded once per process in prewarm(); fall back to loading them here
+    prewarmed = "vad" in ctx.proc.userdata
+    models_start = time.monotonic()
+    models = ctx.proc.userdata if prewarmed else load_models()
+    model_load_ms = (time.monotonic() - models_start) * 1000
+
+    # Per-campaign model routes; start from the latencies the worker's other calls measured
+    route_latency = get_route_latency()
+    await route_latency.start()
+    call_metrics = CallMetrics()
+    router = ModelRouter(RoutingConfig.from_metadata(routing), route_latency, call_metrics)
+
+    tts = router.build_tts()
+
+    # Outbound calls: synthesise the greeting now so it is ready the moment the callee answers
+    greeting = PreparedGreeting(tts, customer_data) if customer_data else None
+
     # Create and start the session
     session = AgentSession(
         turn_detection=EnglishModel(),
-        stt=deepgram.STT(model="nova-3", language="en"),
-        llm=openai.LLM(model="gpt-4o"),
-        tts=cartesia.TTS(),
-        vad=silero.VAD.load(),
+        stt=router.build_stt(vad=models["vad"]),
+        llm=router.build_llm(),
+        tts=tts,
+        vad=models["vad"],
         min_interruption_duration=0.5,
     )
 
+    # Per-turn pipeline latencies, exported on the worker's /metrics endpoint
+    call_metrics.attach(session)
+    router.attach(session)
+
+    def log_call_metrics():
+        log_event('metric', 'system', 'call pipeline summary', pipeline=call_metrics.summary())
+
+    # When the job ends: make sure the callee's line is dropped, then push this call's sheet
+    # updates out instead of waiting for the next flush interval, then its metrics and log
+    teardown = Teardown(f"Call {ctx.job.room.name}")
+    teardown.add("hang up", agent.hangup_call, timeout=3)
+    teardown.add("sheet writes", sheet_writer.flush, timeout=5)
+    teardown.add("call metrics", log_call_metrics, timeout=1)
+    teardown.add("route latencies", route_latency.sync, timeout=2)
+    teardown.add("loop watchdog", watchdog.stop, timeout=1)
+    teardown.add("profile", profiler.stop, timeout=1)
+    teardown.add("call log", flush_call_log, timeout=2)
+    ctx.add_shutdown_callback(teardown.run)
+
+    first_audio_logged = False
+    answered_at = None
+    greeting_path = "llm"
+
+    @session.on("agent_state_changed")
+    def _on_agent_state_changed(ev: agents.AgentStateChangedEvent):
+        # Cold-start cost: time from the job starting to the callee hearing the agent
+        nonlocal first_audio_logged
+        if ev.new_state == "speaking" and not first_audio_logged:
+            first_audio_logged = True
+            now = time.monotonic()
+            job_to_first_audio_ms = (now - job_started) * 1000
+            answer_to_first_audio_ms = None
+            if answered_at is not None:
+                call_metrics.record_first_audio(now - answered_at, greeting_path)
+                answer_to_first_audio_ms = round((now - answered_at) * 1000)
+            logger.info(f"First agent audio {job_to_first_audio_ms:.0f}ms after job start, "
+                        f"{answer_to_first_audio_ms}ms after answer ({greeting_path} greeting)")
+            log_event('metric', 'system', 'first agent audio',
+                      job_to_first_audio_ms=round(job_to_first_audio_ms),
+                      answer_to_first_audio_ms=answer_to_first_audio_ms,
+                      greeting=greeting_path,
+                      model_load_ms=round(model_load_ms),
+                      prewarmed=prewarmed)
+
     # Start the session
     await session.start(
         room=ctx.room,
         agent=agent,
         room_input_options=RoomInputOptions(
-            noise_cancellation=noise_cancellation.BVC(),
+            noise_cancellation=models["noise_cancellation"],
         ),
     )
 
-    background_audio = BackgroundAudioPlayer(
-        ambient_sound=AudioConfig(BuiltinAudioClip.OFFICE_AMBIENCE, volume=0.8),
-        thinking_sound=[
-            AudioConfig(BuiltinAudioClip.KEYBOARD_TYPING, volume=0.8),
-            AudioConfig(BuiltinAudioClip.KEYBOARD_TYPING2, volume=0.7),
-        ],
-    )
-
+    # Plays from the worker's decoded clips (background_clips.py)
+    background_audio = background_audio_player()
     await background_audio.start(room=ctx.room, agent_session=session)
 
     try:
@@ -268,25 +391,37 @@ async def entrypoint(ctx: agents.JobContext):
             session.customer_data = customer_data
             logger.info(f"Stored customer data in session: {customer_data}")
             
-            # This is an outbound call with customer data
-            await session.generate_reply(
-                instructions=f"""
-                Greet the person warmly, introduce yourself as an AI assistant.
-                Say you're calling to confirm their details.
-                According to the records:
-                - Their name is: {customer_data.get('name', 'not found')}
-                - Their address is: {customer_data.get('address', 'not found')}
-                Ask them if these details are correct.
-                If they say any detail is incorrect, use the update_customer_details function to update it.
-                Keep it brief and professional.
-                """
-            )
+            # This is an outbound call with customer data: greet as soon as the callee picks up
+            participant = await ctx.wait_for_participant()
+            if not await wait_for_answer(ctx.room, participant):
+                greeting.cancel()
+                logger.warning("Call was not answered")
+                log_event('event', 'system', 'Call was not answered')
+                ctx.shutdown(reason="not answered")
+                return
+            answered_at = time.monotonic()
+
+            # Decide human or machine from the callee's audio while the greeting plays
+            if AMD_ENABLED:
+                asyncio.create_task(
+                    screen_answering_machine(session, agent, participant, models["vad"], call_metrics)
+                )
+
+            if await greeting.wait(timeout=GREETING_READY_TIMEOUT):
+                # Pre-synthesised greeting; the LLM takes over from the callee's first reply
+                greeting_path = "cached"
+                session.say(greeting.text, audio=greeting.frames())
+                log_event('agent_reply', 'agent', greeting.text)
+                return
+
+            # Greeting audio is not ready, let the LLM greet instead
+            greeting.cancel()
+            # The customer's details go last so the rest of the request matches other calls'
+            await session.generate_reply(instructions=outbound_greeting_instructions(customer_data))
             log_event('agent_reply', 'agent', "Initial greeting sent for outbound call")
         else:
             logger.warning("No customer data found in metadata")
-            await session.generate_reply(
-                instructions="Greet the user warmly, introduce yourself as an AI assistant, and ask for their name and phone number to look up their details."
-            )
+            await session.generate_reply(instructions=INBOUND_GREETING_INSTRUCTIONS)
     except Exception as e:
         logger.error(f"Error handling call: {e}")
         log_event('error', 'system', f"Error handling call: {e}")
@@ -294,5 +429,13 @@ async def entrypoint(ctx: agents.JobContext):
 if __name__ == "__main__":
     agents.cli.run_app(agents.WorkerOptions(
         entrypoint_fnc=entrypoint,
+        prewarm_fnc=prewarm,
         agent_name="outbound-caller",
+        # On SIGTERM the worker stops taking new calls and lets these finish before exiting
+        drain_timeout=WORKER_DRAIN_TIMEOUT,
+        # By module name: multiprocessing does not preload "__main__" on Python < 3.13. Job processes
+        # still run this file as __mp_main__, but every import in it is then already loaded
+        preload_modules=[os.path.splitext(os.path.basename(__file__))[0]] if WORKER_PRELOAD_MAIN else None,
+        # One /metrics endpoint on the worker, adding up the samples of every job process
+        **worker_metrics_options(),
     ))
@@ -0,0 +1,207 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import vad as agents_vad
+
+logger = logging.getLogger(__name__)
+
+# -------- Answering Machine Detection Setup --------
+AMD_ENABLED = os.getenv("AMD_ENABLED", "1") != "0"
+# Seconds of callee audio after which the detector gives up and treats the call as unknown
+AMD_DECISION_BUDGET = float(os.getenv("AMD_DECISION_BUDGET", "4"))
+# A greeting longer than this is recorded rather than "Hello?"
+AMD_MAX_GREETING = float(os.getenv("AMD_MAX_GREETING", "1.8"))
+# Silence after a short greeting that means a person is waiting for an answer
+AMD_HUMAN_SILENCE = float(os.getenv("AMD_HUMAN_SILENCE", "0.8"))
+# More bursts of speech than this before a decision means a machine
+AMD_MAX_BURSTS = int(os.getenv("AMD_MAX_BURSTS", "3"))
+# Longest wait for the beep or the end of a machine's greeting before leaving the message
+AMD_MESSAGE_WAIT = float(os.getenv("AMD_MESSAGE_WAIT", "20"))
+
+SPEECH_THRESHOLD = 0.5
+WORD_GAP = 0.3               # shorter pauses are between words of one burst
+MACHINE_END_SILENCE = 1.0    # silence that ends a machine's greeting when no beep is heard
+BEEP_FREQUENCIES = np.arange(400, 2050, 50)
+BEEP_MIN_DURATION = 0.12
+BEEP_PURITY = 0.6            # share of a window's energy in a single frequency
+
+HUMAN = "human"
+MACHINE = "machine"
+UNKNOWN = "unknown"
+
+
+@dataclass
+class Decision:
+    label: str
+    reason: str
+    at: float  # seconds of callee audio heard when the decision was made
+
+
+class AnsweringMachineDetector:
+    """Tells a person from an answering machine by the first seconds of audio.
+
+    Fed one VAD inference window at a time, with its speech probability and
+    samples. The first rule that matches decides:
+
+    - a pure tone lasting BEEP_MIN_DURATION (the record beep): machine
+    - a greeting longer than `max_greeting`, from the first speech to the
+      latest, with no pause long enough to be a person waiting: machine
+    - more than `max_bursts` bursts of speech: machine
+    - a short greeting followed by `human_silence` of silence: human
+    - `budget` seconds of audio without any of the above: unknown
+
+    After a machine decision it keeps listening until the beep, or until the
+    greeting has ended, and then sets `message_ready_at`.
+    """
+
+    def __init__(self, budget: float = AMD_DECISION_BUDGET, max_greeting: float = AMD_MAX_GREETING,
+                 human_silence: float = AMD_HUMAN_SILENCE, max_bursts: int = AMD_MAX_BURSTS):
+        self.budget = budget
+        self.max_greeting = max_greeting
+        self.human_silence = human_silence
+        self.max_bursts = max_bursts
+        self.decision: Decision = None
+        self.message_ready_at: float = None
+        self.bursts = 0
+        self._first_speech = None
+        self._last_speech = None
+        self.heard_beep = False
+        self._tone_bin = None
+        self._tone_run = 0.0
+        # (samples per window, sample rate) -> complex basis for BEEP_FREQUENCIES
+        self._bases: dict[tuple, np.ndarray] = {}
+
+    def _find_tone(self, samples: np.ndarray, sample_rate: int):
+        """Index into BEEP_FREQUENCIES of the pure tone in this window, or None.
+
+        Each candidate frequency is one DFT bin (what a Goertzel filter computes),
+        evaluated for all candidates at once as a matrix product.
+        """
+        n = len(samples)
+        energy = float(np.dot(samples, samples))
+        if n == 0 or energy < n * 100.0 ** 2:  # too quiet to be a beep
+            return None
+        basis = self._bases.get((n, sample_rate))
+        if basis is None:
+            t = np.arange(n) / sample_rate
+            basis = self._bases[(n, sample_rate)] = np.exp(-2j * np.pi * np.outer(BEEP_FREQUENCIES, t))
+        power = np.abs(basis @ samples) ** 2 * 2 / (n * energy)
+        best = int(np.argmax(power))
+        return best if power[best] >= BEEP_PURITY else None
+
+    def update(self, t: float, duration: float, speech_probability: float,
+               samples: np.ndarray, sample_rate: int):
+        """Add one window of audio ending `t` seconds after answer; returns the decision once made"""
+        samples = samples.astype(np.float64)
+        tone = self._find_tone(samples, sample_rate)
+        if tone is not None and self._tone_bin is not None and abs(tone - self._tone_bin) <= 1:
+            self._tone_run += duration
+        else:
+            self._tone_run = duration if tone is not None else 0.0
+        self._tone_bin = tone
+        beep = self._tone_run >= BEEP_MIN_DURATION
+
+        if speech_probability >= SPEECH_THRESHOLD and tone is None:
+            if self._first_speech is None:
+                self._first_speech = t - duration
+            if self._last_speech is None or t - duration - self._last_speech > WORD_GAP:
+                self.bursts += 1
+            self._last_speech = t
+
+        if self.decision is None:
+            self.decision = self._decide(t, beep)
+            if self.decision:
+                self.heard_beep = beep
+                if beep:
+                    self.message_ready_at = t
+                return self.decision
+        elif self.decision.label == MACHINE and self.message_ready_at is None:
+            if beep or (self._last_speech is not None and t - self._last_speech >= MACHINE_END_SILENCE):
+                self.heard_beep = beep
+                self.message_ready_at = t
+        return None
+
+    def _decide(self, t: float, beep: bool):
+        if beep:
+            return Decision(MACHINE, "beep", t)
+        if self._first_speech is not None and self._last_speech - self._first_speech > self.max_greeting:
+            return Decision(MACHINE, f"greeting longer than {self.max_greeting}s", t)
+        if self.bursts > self.max_bursts:
+            return Decision(MACHINE, f"{self.bursts} bursts of speech", t)
+        if self.bursts and t - self._last_speech >= self.human_silence:
+            return Decision(HUMAN, "short greeting, then silence", t)
+        if t >= self.budget:
+            return Decision(UNKNOWN, "no decision within budget" if self.bursts else "no speech", t)
+        return None
+
+
+async def classify_audio(frames, vad: agents_vad.VAD, detector: AnsweringMachineDetector = None,
+                         wait_for_message: bool = False, on_decision=None) -> AnsweringMachineDetector:
+    """Run the detector over an async iterable of audio frames, using the VAD's inference windows.
+
+    `frames` may yield rtc.AudioFrames or, as an rtc.AudioStream does,
+    rtc.AudioFrameEvents; the VAD only takes the frames. Returns once a decision is made, or, with `wait_for_message`, once a
+    machine's greeting is over. `on_decision(decision)` is called as soon as
+    the decision is made. Works the same on live and recorded audio.
+    """
+    detector = detector or AnsweringMachineDetector()
+    stream = vad.stream()
+
+    async def forward():
+        async for frame in frames:
+            if isinstance(frame, rtc.AudioFrameEvent):
+                frame = frame.frame
+            stream.push_frame(frame)
+        stream.end_input()
+
+    forward_task = asyncio.create_task(forward())
+    try:
+        async for ev in stream:
+            if ev.type != agents_vad.VADEventType.INFERENCE_DONE or not ev.frames:
+                continue
+            samples = np.concatenate([np.frombuffer(f.data, dtype=np.int16) for f in ev.frames])
+            sample_rate = ev.frames[0].sample_rate
+            decision = detector.update(ev.samples_index / sample_rate, len(samples) / sample_rate,
+                                       ev.probability, samples, sample_rate)
+            if decision and on_decision:
+                on_decision(decision)
+            if detector.decision and (detector.decision.label != MACHINE or not wait_for_message
+                                      or detector.message_ready_at is not None):
+                break
+    finally:
+        forward_task.cancel()
+        await stream.aclose()
+    return detector
+
+
+async def classify_stream(audio: rtc.AudioStream, vad: agents_vad.VAD, on_decision=None,
+                          wait_for_message: bool = True) -> AnsweringMachineDetector:
+    """Run the detector over live audio, giving up after AMD_DECISION_BUDGET + AMD_MESSAGE_WAIT seconds"""
+    detector = AnsweringMachineDetector()
+    try:
+        await asyncio.wait_for(
+            classify_audio(audio, vad, detector, wait_for_message=wait_for_message, on_decision=on_decision),
+            AMD_DECISION_BUDGET + AMD_MESSAGE_WAIT,
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Answering machine greeting did not end in time")
+    return detector
+
+
+async def detect_answering_machine(participant: rtc.RemoteParticipant, vad: agents_vad.VAD,
+                                   on_decision=None) -> AnsweringMachineDetector:
+    """Listen to a callee who has just answered. See classify_audio()."""
+    audio = rtc.AudioStream.from_participant(
+        participant=participant,
+        track_source=rtc.TrackSource.SOURCE_MICROPHONE,
+        sample_rate=16000,
+        num_channels=1,
+    )
+    try:
+        return await classify_stream(audio, vad, on_decision=on_decision)
+    finally:
+        await audio.aclose()
@@ -0,0 +1,100 @@
+import time
+import logging
+import threading
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import AudioConfig, BackgroundAudioPlayer, BuiltinAudioClip
+
+logger = logging.getLogger(__name__)
+
+# -------- Background Audio Setup --------
+# BackgroundAudioPlayer mixes and publishes mono audio at this rate
+BACKGROUND_SAMPLE_RATE = 48000
+# Samples per frame handed to the player's mixer: its block size, 100ms
+FRAME_SAMPLES = 4800
+# (clip, volume) of the ambient loop, and of the sounds one of which plays while the agent thinks
+AMBIENT_SOUND = (BuiltinAudioClip.OFFICE_AMBIENCE, 0.8)
+THINKING_SOUNDS = [(BuiltinAudioClip.KEYBOARD_TYPING, 0.8), (BuiltinAudioClip.KEYBOARD_TYPING2, 0.7)]
+
+# (clip, volume) -> PCM with the volume applied, shared read-only by every session in the process
+_pcm: dict[tuple, bytes] = {}
+_pcm_lock = threading.Lock()
+
+
+def decode_clip(path: str) -> bytes:
+    """Decode an audio file to 16-bit mono PCM at BACKGROUND_SAMPLE_RATE.
+
+    Runs in the calling thread and leaves none behind, so it is safe before the
+    forkserver forks job processes.
+    """
+    import av
+
+    chunks = []
+    with av.open(path) as container:
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=BACKGROUND_SAMPLE_RATE)
+        for frame in container.decode(audio=0):
+            chunks.extend(out.to_ndarray().tobytes() for out in resampler.resample(frame))
+        chunks.extend(out.to_ndarray().tobytes() for out in resampler.resample(None))
+    return b"".join(chunks)
+
+
+def clip_pcm(clip: BuiltinAudioClip, volume: float = 1.0) -> bytes:
+    """The clip's PCM at `volume`, decoded and scaled on first use"""
+    key = (clip, round(volume, 3))
+    pcm = _pcm.get(key)
+    if pcm is not None:
+        return pcm
+    with _pcm_lock:
+        if key not in _pcm:
+            start = time.monotonic()
+            pcm = decode_clip(clip.path())
+            if key[1] != 1.0:
+                samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) * key[1]
+                pcm = np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+            _pcm[key] = pcm
+            logger.debug(f"Decoded {clip.name} at volume {key[1]:g} in {(time.monotonic() - start) * 1000:.0f}ms "
+                         f"({len(pcm) / 1e6:.1f} MB)")
+    return _pcm[key]
+
+
+class CachedClip:
+    """A background sound played from shared, already decoded PCM.
+
+    Every `async for` over it is a new playback from the start of the clip,
+    so one instance serves all the plays of a thinking sound; a looped one
+    never ends, as the player expects of an ambient iterator. The volume is
+    already in the PCM, so the player passes frames through untouched.
+    """
+
+    def __init__(self, pcm: bytes, loop: bool = False):
+        self.pcm = pcm
+        self.loop = loop
+
+    def __aiter__(self):
+        return self._frames()
+
+    async def _frames(self):
+        view = memoryview(self.pcm)
+        step = FRAME_SAMPLES * 2
+        while True:
+            for offset in range(0, len(view), step):
+                chunk = view[offset:offset + step]
+                yield rtc.AudioFrame(chunk, BACKGROUND_SAMPLE_RATE, 1, len(chunk) // 2)
+            if not self.loop:
+                return
+
+
+def preload_background_clips():
+    """Decode the ambient and thinking sounds so sessions start playing them straight away"""
+    for clip, volume in [AMBIENT_SOUND] + THINKING_SOUNDS:
+        clip_pcm(clip, volume)
+
+
+def background_audio_player() -> BackgroundAudioPlayer:
+    """A session's background audio: office ambience, keyboard typing while the agent thinks"""
+    clip, volume = AMBIENT_SOUND
+    return BackgroundAudioPlayer(
+        ambient_sound=AudioConfig(CachedClip(clip_pcm(clip, volume), loop=True)),
+        thinking_sound=[AudioConfig(CachedClip(clip_pcm(clip, volume))) for clip, volume in THINKING_SOUNDS],
+    )
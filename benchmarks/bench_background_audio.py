@@ -0,0 +1,175 @@
+"""Background audio for many sessions in one process: decoded per play vs shared clips.
+
+Starts --sessions BackgroundAudioPlayers, as agent.py does for each call,
+against a stand-in room, and runs them for --duration seconds with the agent
+"thinking" every --think-every seconds (which plays a keyboard sound).
+
+  decode   clips given as BuiltinAudioClip, as before background_clips.py:
+           every play decodes and resamples the file, and applies the volume
+           to every frame
+  cached   background_audio_player(): clips decoded once per process at the
+           mixer's rate with the volume applied, played from shared PCM
+
+Each mode runs in its own process. Reports the time from start() to the first
+mixed frame, CPU used (share of one core), and RSS growth per session over
+the process after setup (for cached, the shared PCM is reported on its own:
+with WORKER_PRELOAD_MAIN it is decoded once in the forkserver and its pages
+are shared by every job process).
+
+    python benchmarks/bench_background_audio.py
+    python benchmarks/bench_background_audio.py --sessions 50 --duration 30
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import statistics
+import multiprocessing
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_dispatch import percentile, rss_mb  # noqa: E402
+
+MODES = ("decode", "cached")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--think-every", type=float, default=4.0, help="seconds between thinking sounds")
+    return parser.parse_args(argv)
+
+
+class FakeRoom:
+    """Accepts the background track without publishing it anywhere"""
+
+    def __init__(self):
+        self.local_participant = SimpleNamespace(publish_track=self._publish_track, track_publications={},
+                                                 unpublish_track=self._unpublish_track)
+
+    async def _publish_track(self, track, options):
+        return SimpleNamespace(sid="TR_background", name=track.name)
+
+    async def _unpublish_track(self, sid):
+        pass
+
+
+class FakeSession:
+    """Just enough of AgentSession for the player's thinking sounds"""
+
+    def __init__(self):
+        self._handlers = []
+
+    def on(self, event, handler):
+        self._handlers.append(handler)
+
+    def off(self, event, handler):
+        self._handlers.remove(handler)
+
+    def set_state(self, state: str):
+        for handler in list(self._handlers):
+            handler(SimpleNamespace(new_state=state))
+
+
+def make_player(mode: str):
+    from livekit.agents import AudioConfig, BackgroundAudioPlayer, BuiltinAudioClip
+
+    from background_clips import background_audio_player
+
+    if mode == "cached":
+        return background_audio_player()
+    return BackgroundAudioPlayer(
+        ambient_sound=AudioConfig(BuiltinAudioClip.OFFICE_AMBIENCE, volume=0.8),
+        thinking_sound=[
+            AudioConfig(BuiltinAudioClip.KEYBOARD_TYPING, volume=0.8),
+            AudioConfig(BuiltinAudioClip.KEYBOARD_TYPING2, volume=0.7),
+        ],
+    )
+
+
+async def run_session(args, mode: str, first_frame: list, deadline: float):
+    player = make_player(mode)
+    session = FakeSession()
+    capture_frame = player._audio_source.capture_frame
+    started = False
+    start = time.monotonic()
+
+    async def timed_capture(frame):
+        nonlocal started
+        if not started:
+            started = True
+            first_frame.append(time.monotonic() - start)
+        await capture_frame(frame)
+
+    player._audio_source.capture_frame = timed_capture
+    await player.start(room=FakeRoom(), agent_session=session)
+    await asyncio.sleep(random.uniform(0, args.think_every))
+    while time.monotonic() < deadline:
+        session.set_state("thinking")
+        await asyncio.sleep(1.5)
+        session.set_state("listening")
+        await asyncio.sleep(args.think_every - 1.5)
+    await player.aclose()
+
+
+def _worker(args, mode: str, conn):
+    logging.disable(logging.CRITICAL)
+
+    async def main():
+        shared_mb = 0.0
+        if mode == "cached":
+            from background_clips import _pcm, preload_background_clips
+            preload_background_clips()
+            shared_mb = sum(len(pcm) for pcm in _pcm.values()) / 1e6
+        # Load livekit's audio code and warm it up with one session, so it is not counted per session
+        await run_session(args, mode, [], time.monotonic() + 1)
+        baseline = rss_mb()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_start, wall_start = usage.ru_utime + usage.ru_stime, time.monotonic()
+
+        first_frames: list = []
+        deadline = time.monotonic() + args.duration
+        sessions = [asyncio.create_task(run_session(args, mode, first_frames, deadline))
+                    for _ in range(args.sessions)]
+        await asyncio.sleep(args.duration / 2)
+        rss = rss_mb()
+        await asyncio.gather(*sessions)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = (usage.ru_utime + usage.ru_stime - cpu_start) / (time.monotonic() - wall_start)
+        return {
+            "first_frame_ms": {"p50": round(statistics.median(first_frames) * 1000, 1),
+                               "max": round(percentile(first_frames, 100) * 1000, 1)},
+            "cpu": round(cpu, 3),
+            "rss_per_session_mb": round((rss - baseline) / args.sessions, 2),
+            "shared_pcm_mb": round(shared_mb, 1),
+        }
+
+    conn.send(asyncio.run(main()))
+    conn.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{args.sessions} sessions for {args.duration:g}s, a thinking sound every {args.think_every:g}s")
+    ctx = multiprocessing.get_context("spawn")
+    for mode in args.modes.split(","):
+        parent, child = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_worker, args=(args, mode, child))
+        proc.start()
+        child.close()
+        result = parent.recv()
+        proc.join()
+        print(f"  {mode:7s} {result}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
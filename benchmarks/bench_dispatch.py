@@ -0,0 +1,147 @@
+"""Offline throughput benchmark for dispatch_calls().
+
+Runs a synthetic campaign through the real dispatcher against in-process
+fakes of LiveKit and Google Sheets, then reports calls/sec, time from agent
+dispatch to SIP dial, memory use and event-loop lag.
+
+    python benchmarks/bench_dispatch.py --customers 10000 --concurrency 50 --cps 20
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fakes import FakeLiveKitAPI, FakeSheetsClient, Latency  # noqa: E402
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def measure_loop_lag(samples: list, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50, help="MAX_CONCURRENT_CALLS")
+    parser.add_argument("--cps", type=float, default=50.0, help="CALLS_PER_SECOND per trunk")
+    parser.add_argument("--dispatch-latency", type=float, default=0.05, help="create_dispatch latency (s)")
+    parser.add_argument("--sip-latency", type=float, default=0.1, help="create_sip_participant latency (s)")
+    parser.add_argument("--answer-delay", type=float, default=0.5, help="ring time before answer (s)")
+    parser.add_argument("--agent-join-delay", type=float, default=0.3, help="dispatch to agent joining (s)")
+    parser.add_argument("--call-duration", type=float, default=1.0, help="answered call length (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--trunk-capacity", type=int, default=0,
+                        help="simultaneous calls the fake trunk accepts before answering 503 (0 = unlimited)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="MAX_CALL_ATTEMPTS")
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="RETRY_BASE_DELAY (s)")
+    parser.add_argument("--sheet-latency", type=float, default=0.2, help="Sheets read latency (s)")
+    parser.add_argument("--duplicate-every", type=int, default=0,
+                        help="make every Nth row repeat the previous row's number")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="ROOM_POLL_INTERVAL (s)")
+    parser.add_argument("--verbose", action="store_true", help="keep dispatcher logging")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> dict:
+    import dispatch_calls
+
+    if not args.verbose:
+        # Simulated call failures are expected; keep per-call logging out of the report
+        logging.disable(logging.ERROR)
+
+    jitter = 0.5
+    lk_api = FakeLiveKitAPI(
+        dispatch_latency=Latency(args.dispatch_latency, args.dispatch_latency * jitter),
+        sip_latency=Latency(args.sip_latency, args.sip_latency * jitter),
+        answer_delay=Latency(args.answer_delay, args.answer_delay * jitter),
+        agent_join_delay=Latency(args.agent_join_delay, args.agent_join_delay * jitter),
+        call_duration=Latency(args.call_duration, args.call_duration * jitter),
+        failure_rate=args.failure_rate,
+        trunk_capacity=args.trunk_capacity,
+    )
+    sheet = FakeSheetsClient(args.customers, latency=Latency(args.sheet_latency),
+                             duplicate_every=args.duplicate_every)
+
+    lag_samples: list = []
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples))
+    rss_before = rss_mb()
+    start = time.monotonic()
+    try:
+        await dispatch_calls.dispatch_calls(restart=True, sheet=sheet, lk_api=lk_api)
+    finally:
+        lag_task.cancel()
+    elapsed = time.monotonic() - start
+
+    dialed = len(lk_api.dialed_numbers)
+    return {
+        "customers": args.customers,
+        "dialed": dialed,
+        "unique_numbers": len(set(lk_api.dialed_numbers)),
+        "failed": lk_api.failures,
+        "trunk_rejections": lk_api.rejections,
+        "elapsed_s": elapsed,
+        "calls_per_s": dialed / elapsed if elapsed else 0.0,
+        "dial_p50_ms": percentile(lk_api.dial_times, 50) * 1000,
+        "dial_p99_ms": percentile(lk_api.dial_times, 99) * 1000,
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_before,
+        "loop_lag_p50_ms": percentile(lag_samples, 50) * 1000,
+        "loop_lag_p99_ms": percentile(lag_samples, 99) * 1000,
+        "loop_lag_max_ms": max(lag_samples, default=0.0) * 1000,
+        "sheet_reads": sheet.reads,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="bench_dispatch_")
+    os.environ.update({
+        "MAX_CONCURRENT_CALLS": str(args.concurrency),
+        "CALLS_PER_SECOND": str(args.cps),
+        "ROOM_POLL_INTERVAL": str(args.poll_interval),
+        "STATS_INTERVAL": "3600",
+        "MAX_CALL_ATTEMPTS": str(args.max_attempts),
+        "RETRY_BASE_DELAY": str(args.retry_delay),
+        "RETRY_MAX_DELAY": str(args.retry_delay * 8),
+        "CALLING_HOURS": "",
+        "SIP_OUTBOUND_TRUNK_ID": os.getenv("SIP_OUTBOUND_TRUNK_ID") or "ST_bench",
+        "CAMPAIGN_DB_FILE": os.path.join(workdir, "campaign_state.db"),
+    })
+    os.chdir(workdir)
+
+    result = asyncio.run(run(args))
+    width = max(len(key) for key in result)
+    for key, value in result.items():
+        print(f"{key:<{width}}  {value:.2f}" if isinstance(value, float) else f"{key:<{width}}  {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Offline estimate of LLM prompt caching over a campaign.
+
+Builds the chat requests the agent sends during N synthetic outbound calls
+(the LLM greeting turn plus a few conversation turns each), once with the
+prompt layout used before prompts.py ("legacy": indented instructions,
+customer details inside the greeting instructions) and once with the
+current one, and replays them in order against a model of provider prefix
+caching: a request's leading blocks of --block tokens that some earlier
+request also started with are served from cache, once at least
+--min-cached tokens match (OpenAI's rules for gpt-4o). Reports prompt,
+cached and uncached tokens per request and the input cost per 1,000 calls.
+
+Token counts use tiktoken when it is installed and a word/punctuation
+approximation otherwise. Uncached prompt tokens are what the provider must
+process before the first token, so they stand in for TTFT here; in
+production, compare agent_llm_ttft_seconds{prompt_cache="hit"|"miss"}.
+
+    python benchmarks/bench_prompt_cache.py --calls 1000
+    python benchmarks/bench_prompt_cache.py --turns 8 --min-cached 0
+"""
+import os
+import re
+import sys
+import json
+import random
+import hashlib
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+LEGACY_INSTRUCTIONS = """
+            You are a professional call agent. Your task is to:
+            1. Confirm the customer details I provide
+            2. If the user says ANY information is incorrect:
+               - Ask them for the correct information
+               - Use the update_customer_details function to update it
+               - Confirm the update was successful
+               - Read back the updated information to verify
+            3. Be polite and professional
+            4. Keep responses brief and to the point
+            5. End the call if the user requests
+            6. Detect and handle voicemail systems appropriately
+            7. If the user says anything like "goodbye", "hang up", "bye", or "end the call", you MUST call the `end_call` function tool.
+            8. If you have no customer details yet, ask for their phone number and name and use the `lookup_customer` function tool to find their record
+
+            When updating details:
+            - For name updates, use field="name"
+            - For address updates, use field="address"
+            - Always confirm the update was successful before proceeding
+            """
+
+LEGACY_GREETING = """
+                Greet the person warmly, introduce yourself as an AI assistant.
+                Say you're calling to confirm their details.
+                According to the records:
+                - Their name is: {name}
+                - Their address is: {address}
+                Ask them if these details are correct.
+                If they say any detail is incorrect, use the update_customer_details function to update it.
+                Keep it brief and professional.
+                """
+
+FIRST_NAMES = ["Asha", "Ravi", "Meera", "Arjun", "Priya", "Karan", "Divya", "Sanjay", "Neha", "Vikram"]
+LAST_NAMES = ["Sharma", "Iyer", "Patel", "Reddy", "Nair", "Gupta", "Das", "Menon", "Rao", "Singh"]
+STREETS = ["MG Road", "Park Street", "Brigade Road", "Linking Road", "Anna Salai", "Church Street"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=4, help="LLM requests per call after the greeting")
+    parser.add_argument("--block", type=int, default=128, help="cache block size in tokens")
+    parser.add_argument("--min-cached", type=int, default=1024, help="shortest prefix the provider caches")
+    parser.add_argument("--input-price", type=float, default=2.50, help="$ per 1M uncached prompt tokens")
+    parser.add_argument("--cached-price", type=float, default=1.25, help="$ per 1M cached prompt tokens")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def load_tokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base").encode, "tiktoken o200k_base"
+    except ImportError:
+        pattern = re.compile(r"\w+|[^\w\s]|\s+")
+        return pattern.findall, "approximate (words and punctuation)"
+
+
+def synthetic_customer(rng: random.Random, i: int) -> dict:
+    # Distinct per call, so requests only share what the prompt layout makes them share
+    return {
+        "index": str(i),
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}-{i}",
+        "address": f"Flat {i}, {rng.randint(1, 999)} {rng.choice(STREETS)}, Bengaluru",
+    }
+
+
+def conversation(rng: random.Random, customer: dict, turns: int) -> list:
+    """(user, assistant) exchanges after the greeting"""
+    exchanges = [
+        (f"Hi, yes, this is {customer['name']}. Who is this?",
+         "I'm an AI assistant confirming your details. Are they correct?"),
+        (f"The address is wrong, it's {rng.randint(1, 999)} {rng.choice(STREETS)} now.",
+         "Thanks, I've updated your address. Is there anything else to correct?"),
+        ("No, the name is fine.", "Great, your details are confirmed."),
+        ("Okay, thanks, bye.", "Goodbye, have a nice day."),
+    ]
+    return [exchanges[i % len(exchanges)] for i in range(turns)]
+
+
+def call_requests(layout: str, customer: dict, exchanges: list, tools: list) -> list:
+    """The serialised chat requests sent during one call, in order"""
+    from livekit.agents import llm
+    from livekit.agents.voice.generation import update_instructions
+    import prompts
+
+    ctx = llm.ChatContext.empty()
+    if layout == "legacy":
+        update_instructions(ctx, instructions=LEGACY_INSTRUCTIONS, add_if_missing=True)
+        greeting = LEGACY_GREETING.format(name=customer["name"], address=customer["address"])
+    else:
+        update_instructions(ctx, instructions=prompts.AGENT_INSTRUCTIONS, add_if_missing=True)
+        greeting = prompts.outbound_greeting_instructions(customer)
+
+    def serialise(chat_ctx) -> str:
+        messages, _ = chat_ctx.to_provider_format("openai")
+        return json.dumps({"tools": tools, "messages": messages})
+
+    # Per-turn instructions go on a copy of the history, as in AgentActivity
+    turn = ctx.copy()
+    turn.add_message(role="system", content=[greeting])
+    requests = [serialise(turn)]
+    ctx.add_message(role="assistant", content=[f"Hello, I'm calling to confirm your details, {customer['name']}."])
+    for user, assistant in exchanges:
+        ctx.add_message(role="user", content=[user])
+        requests.append(serialise(ctx))
+        ctx.add_message(role="assistant", content=[assistant])
+    return requests
+
+
+class PrefixCache:
+    """Provider prefix cache: remembers hashes of every request's leading blocks"""
+
+    def __init__(self, block: int, min_cached: int):
+        self.block = block
+        self.min_cached = min_cached
+        self.blocks: set = set()
+
+    def request(self, tokens: list) -> int:
+        """Replays one request; returns how many of its prompt tokens were cached"""
+        digest = hashlib.blake2b(digest_size=16)
+        cached, hit = 0, True
+        for end in range(self.block, len(tokens) + 1, self.block):
+            digest.update(json.dumps(tokens[end - self.block:end]).encode())
+            key = digest.copy().hexdigest()
+            if hit and key in self.blocks:
+                cached = end
+            else:
+                hit = False
+                self.blocks.add(key)
+        return cached if cached >= self.min_cached else 0
+
+
+def simulate(layout: str, args, tools: list, tokenize) -> dict:
+    rng = random.Random(args.seed)
+    cache = PrefixCache(args.block, args.min_cached)
+    prompt = cached = requests = 0
+    for i in range(args.calls):
+        customer = synthetic_customer(rng, i)
+        for text in call_requests(layout, customer, conversation(rng, customer, args.turns), tools):
+            tokens = tokenize(text)
+            prompt += len(tokens)
+            cached += cache.request(tokens)
+            requests += 1
+    uncached = prompt - cached
+    cost = (uncached * args.input_price + cached * args.cached_price) / 1e6
+    return {
+        "requests": requests,
+        "prompt_per_request": round(prompt / requests),
+        "cached_per_request": round(cached / requests),
+        "uncached_per_request": round(uncached / requests),
+        "cache_hit_ratio": round(cached / prompt, 3) if prompt else 0.0,
+        "input_cost_per_1000_calls": round(cost * 1000 / args.calls, 2),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from livekit.agents import llm
+    from agent import Assistant
+
+    tools = llm.ToolContext(Assistant().tools).parse_function_tools("openai")
+    tokenize, tokenizer = load_tokenizer()
+    print(f"{args.calls} calls, {args.turns + 1} LLM requests each, tokens: {tokenizer}")
+    results = {layout: simulate(layout, args, tools, tokenize) for layout in ("legacy", "current")}
+    for layout, result in results.items():
+        print(f"  {layout:8s} {json.dumps(result)}")
+    legacy, current = results["legacy"], results["current"]
+    if legacy["uncached_per_request"]:
+        change = 1 - current["uncached_per_request"] / legacy["uncached_per_request"]
+        print(f"  uncached prompt tokens per request: {abs(change):.0%} {'fewer' if change >= 0 else 'more'} than legacy")
+
+
+if __name__ == "__main__":
+    main()
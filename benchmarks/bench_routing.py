@@ -0,0 +1,110 @@
+"""Simulated campaign through an LLM latency spike, with and without routing.
+
+Calls start every --interval seconds for --hours and each makes --turns LLM
+requests --turn-gap seconds apart. TTFT of each route is drawn from a
+log-normal distribution around its median; between --spike-start and
+--spike-end minutes the first route's median is multiplied by --spike
+(peak-hour load). "fixed" always uses the first route, as the agent did
+before model_routing; "routed" picks the route with ModelRouter.order() from
+the latencies measured so far, as every call does, with all calls sharing one
+RouteLatency (the job processes share theirs through ROUTE_LATENCY_DB, a few
+seconds behind). A failed request is not modelled.
+
+Reports TTFT percentiles, the share of turns over the budget and which
+route served the turns.
+
+    python benchmarks/bench_routing.py
+    python benchmarks/bench_routing.py --routes openai:gpt-4o,openai:gpt-4o-mini --medians 0.55,0.4 --spike 4
+"""
+import os
+import sys
+import math
+import random
+import argparse
+import tempfile
+import statistics
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+# Route switches are logged as call events; keep them out of the real call log
+os.environ.setdefault("CALL_LOG_FILE", os.path.join(tempfile.gettempdir(), "bench_routing_call_log.jsonl"))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", default="openai:gpt-4o,openai:gpt-4o-mini", help="LLM route chain")
+    parser.add_argument("--medians", default="0.55,0.4", help="median TTFT of each route (seconds)")
+    parser.add_argument("--sigma", type=float, default=0.35, help="log-normal spread of TTFT")
+    parser.add_argument("--budget", type=float, default=1.0, help="LLM TTFT budget (seconds)")
+    parser.add_argument("--spike", type=float, default=3.0, help="first route's median multiplier during the spike")
+    parser.add_argument("--spike-start", type=float, default=40, help="minutes")
+    parser.add_argument("--spike-end", type=float, default=80, help="minutes")
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between call starts")
+    parser.add_argument("--turns", type=int, default=6, help="LLM requests per call")
+    parser.add_argument("--turn-gap", type=float, default=15.0, help="seconds between a call's requests")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def simulate(args, routed: bool) -> dict:
+    from model_routing import ModelRouter, RouteLatency, RoutingConfig
+
+    rng = random.Random(args.seed)
+    routes = [route.strip() for route in args.routes.split(",")]
+    medians = [float(median) for median in args.medians.split(",")]
+    spike = (args.spike_start * 60, args.spike_end * 60)
+
+    def ttft(route_index: int, at: float) -> float:
+        median = medians[route_index]
+        if route_index == 0 and spike[0] <= at < spike[1]:
+            median *= args.spike
+        return median * math.exp(rng.gauss(0, args.sigma))
+
+    now = 0.0
+    latency = RouteLatency(path="", clock=lambda: now)
+    config = RoutingConfig(llm=routes, budgets={"stt": 1.0, "llm": args.budget, "tts": 1.0})
+    # Every request of the campaign in time order: (at, call)
+    requests = sorted((start + turn * args.turn_gap, call)
+                      for call, start in enumerate(x * args.interval
+                                                   for x in range(int(args.hours * 3600 / args.interval)))
+                      for turn in range(args.turns))
+    routers = {}
+    samples, served = [], Counter()
+    for now, call in requests:
+        if call not in routers:
+            routers[call] = ModelRouter(config, latency)
+            # Only the route names matter to order(); no clients are built
+            routers[call].routes["llm"] = [(route, None) for route in routes]
+        index = routers[call].order("llm")[0] if routed else 0
+        seconds = ttft(index, now)
+        latency.record("llm", routes[index], seconds)
+        samples.append(seconds)
+        served[routes[index]] += 1
+    ordered = sorted(samples)
+    return {
+        "requests": len(samples),
+        "p50_ms": round(statistics.median(ordered) * 1000),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000),
+        "over_budget": round(sum(s > args.budget for s in samples) / len(samples), 3),
+        "served": {route: round(count / len(samples), 3) for route, count in served.items()},
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{args.hours}h campaign, a call every {args.interval}s, {args.turns} LLM requests each, "
+          f"{args.routes} with medians {args.medians}s, first route x{args.spike} "
+          f"from {args.spike_start:g} to {args.spike_end:g} min, budget {args.budget * 1000:.0f}ms")
+    for label, routed in (("fixed", False), ("routed", True)):
+        print(f"  {label:7s} {simulate(args, routed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Offline scaling test for dispatching one campaign from several nodes.
+
+Runs the same synthetic campaign with 1, 2, 4... dispatcher processes that
+share a coordinator database (row_leases.py), each with its own fake
+LiveKit and a per-node dial rate cap, and reports aggregate calls/sec over
+the span from first to last dial, scaling efficiency and whether any number
+was dialed by more than one node.
+With --kill-after, the first node is killed part-way through to show its
+rows being taken over once its lease expires.
+
+    python benchmarks/bench_sharding.py --customers 600 --nodes 1,2,4
+    python benchmarks/bench_sharding.py --nodes 3 --kill-after 5 --lease-ttl 3
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=600)
+    parser.add_argument("--nodes", default="1,2,4", help="comma-separated node counts to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="MAX_CONCURRENT_CALLS per node")
+    parser.add_argument("--cps", type=float, default=10.0, help="CALLS_PER_SECOND per node")
+    parser.add_argument("--chunk-size", type=int, default=50, help="DISPATCH_CHUNK_SIZE")
+    parser.add_argument("--lease-ttl", type=float, default=3.0, help="DISPATCH_LEASE_TTL (s)")
+    parser.add_argument("--answer-delay", type=float, default=0.5, help="ring time before answer (s)")
+    parser.add_argument("--call-duration", type=float, default=1.0, help="answered call length (s)")
+    parser.add_argument("--sheet-latency", type=float, default=0.2, help="Sheets read latency (s)")
+    parser.add_argument("--kill-after", type=float, default=0, help="kill the first node after this many seconds")
+    parser.add_argument("--verbose", action="store_true", help="keep dispatcher logging")
+    return parser.parse_args(argv)
+
+
+def run_node(node_id: str, args, workdir: str):
+    os.environ.update({
+        "MAX_CONCURRENT_CALLS": str(args.concurrency),
+        "CALLS_PER_SECOND": str(args.cps),
+        "ROOM_POLL_INTERVAL": "0.2",
+        "STATS_INTERVAL": "3600",
+        "CALLING_HOURS": "",
+        "SIP_OUTBOUND_TRUNK_ID": os.getenv("SIP_OUTBOUND_TRUNK_ID") or "ST_bench",
+        "CAMPAIGN_DB_FILE": os.path.join(workdir, f"campaign_{node_id}.db"),
+        "DISPATCH_COORDINATOR_DB": os.path.join(workdir, "coordinator.db"),
+        "DISPATCH_NODE_ID": node_id,
+        "DISPATCH_LEASE_TTL": str(args.lease_ttl),
+        "DISPATCH_CHUNK_SIZE": str(args.chunk_size),
+    })
+    from fakes import FakeLiveKitAPI, FakeSheetsClient, Latency
+    import dispatch_calls
+
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+    lk_api = FakeLiveKitAPI(
+        dispatch_latency=Latency(0.05, 0.025),
+        sip_latency=Latency(0.1, 0.05),
+        answer_delay=Latency(args.answer_delay, args.answer_delay / 2),
+        agent_join_delay=Latency(0.3, 0.15),
+        call_duration=Latency(args.call_duration, args.call_duration / 2),
+        dial_log=os.path.join(workdir, f"dials_{node_id}.txt"),
+    )
+    sheet = FakeSheetsClient(args.customers, latency=Latency(args.sheet_latency))
+    asyncio.run(dispatch_calls.dispatch_calls(sheet=sheet, lk_api=lk_api))
+
+
+def run_campaign(args, nodes: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench_sharding_{nodes}_")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=run_node, args=(f"node{i}", args, workdir)) for i in range(nodes)]
+    start = time.monotonic()
+    for proc in procs:
+        proc.start()
+    if args.kill_after:
+        procs[0].join(args.kill_after)
+        if procs[0].is_alive():
+            procs[0].kill()
+    for proc in procs:
+        proc.join()
+    elapsed = time.monotonic() - start
+
+    per_node, dial_times = {}, []
+    for i in range(nodes):
+        per_node[f"node{i}"] = []
+        try:
+            with open(os.path.join(workdir, f"dials_node{i}.txt")) as f:
+                for line in f:
+                    dialed_at, number = line.split()
+                    dial_times.append(float(dialed_at))
+                    per_node[f"node{i}"].append(number)
+        except FileNotFoundError:
+            pass
+    dial_counts = Counter(number for dials in per_node.values() for number in dials)
+    nodes_per_number = Counter(number for dials in per_node.values() for number in set(dials))
+    dialed = sum(dial_counts.values())
+    # Dials per second from first to last dial, leaving out process start-up and the last calls' length
+    window = max(dial_times) - min(dial_times) if len(dial_times) > 1 else 0.0
+    return {
+        "nodes": nodes,
+        "elapsed_s": elapsed,
+        "dialed": dialed,
+        "unique_numbers": len(dial_counts),
+        "dialed_twice": sum(1 for count in dial_counts.values() if count > 1),
+        "dialed_by_two_nodes": sum(1 for count in nodes_per_number.values() if count > 1),
+        "calls_per_s": dialed / window if window else 0.0,
+        "per_node": " ".join(str(len(dials)) for dials in per_node.values()),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = [run_campaign(args, int(n)) for n in args.nodes.split(",")]
+    baseline = results[0]["calls_per_s"] / results[0]["nodes"]
+    for result in results:
+        result["efficiency"] = result["calls_per_s"] / (baseline * result["nodes"]) if baseline else 0.0
+        print("  ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                        for key, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
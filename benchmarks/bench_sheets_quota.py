@@ -0,0 +1,211 @@
+"""Sheets API quota under a campaign's load, with and without the shared limiter.
+
+Starts a dispatcher process that reads customer pages as fast as it can
+(bulk reads) and several agent processes whose calls each make an update
+every --update-every seconds: a verification read and a write, both in-call
+(interactive). All of them go through SheetsClient.run() to a fake Sheets API
+that answers 429 once more than the quota of reads or writes arrived in the
+last --period seconds (the real quotas are per minute; the period is
+shortened so a run takes seconds).
+
+  unlimited   no shared limiter and 429s not retried, as before sheets_quota.py
+  shared      one token bucket per kind for all processes, 429s backed off and retried
+  priority    as shared, with in-call requests ahead of bulk reads
+
+Reports requests per period against the quota, 429s, failed requests, and
+the latency of in-call updates (read + write) and of bulk reads.
+
+    python benchmarks/bench_sheets_quota.py
+    python benchmarks/bench_sheets_quota.py --agents 8 --calls 10 --duration 60
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.normpath(os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, ROOT_DIR)
+
+MODES = ("unlimited", "shared", "priority")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--agents", type=int, default=4, help="agent processes")
+    parser.add_argument("--calls", type=int, default=5, help="concurrent calls per agent process")
+    parser.add_argument("--update-every", type=float, default=5.0, help="seconds between a call's updates")
+    parser.add_argument("--bulk-readers", type=int, default=2, help="concurrent page reads in the dispatcher")
+    parser.add_argument("--read-quota", type=int, default=60, help="reads per period")
+    parser.add_argument("--write-quota", type=int, default=60, help="writes per period")
+    parser.add_argument("--period", type=float, default=10.0, help="seconds the quota applies to")
+    parser.add_argument("--latency", type=float, default=0.08, help="mean API latency (seconds)")
+    parser.add_argument("--duration", type=float, default=30.0)
+    return parser.parse_args(argv)
+
+
+class FakeSheetsAPI:
+    """Sliding-window quota shared by every process through a locked file"""
+
+    def __init__(self, path: str, quotas: dict, period: float, latency: float):
+        self.path = path
+        self.quotas = quotas
+        self.period = period
+        self.latency = latency
+
+    def request(self, kind: str):
+        from googleapiclient.errors import HttpError
+        import httplib2
+
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        now = time.time()
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            raw = f.read()
+            state = json.loads(raw) if raw else {}
+            recent = [t for t in state.get(kind, []) if t > now - self.period]
+            allowed = len(recent) < self.quotas[kind]
+            if allowed:
+                recent.append(now)
+            state[kind] = recent
+            state.setdefault("429", {}).setdefault(kind, 0)
+            state["429"][kind] += 0 if allowed else 1
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+        if not allowed:
+            raise HttpError(httplib2.Response({"status": "429"}),
+                            b'{"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}}')
+        return {"values": [], "valueRanges": [{"values": []}]}
+
+
+def _client(api: FakeSheetsAPI, quota, token_file: str):
+    import sheets_client
+
+    class FakeSheetsClient(sheets_client.SheetsClient):
+        def _execute(self, make_request):
+            request = make_request(self.spreadsheets)
+            return api.request("read" if request.method == "GET" else "write")
+
+    client = FakeSheetsClient(token_file=token_file)
+    client.quota = quota
+    return client
+
+
+def _worker(role: str, args, mode: str, files: dict, conn):
+    import sheets_client
+    from sheets_quota import BACKGROUND, BULK, INTERACTIVE, SheetsQuota
+
+    logging.disable(logging.CRITICAL)
+    api = FakeSheetsAPI(files["api"], {"read": args.read_quota, "write": args.write_quota},
+                        args.period, args.latency)
+    if mode == "unlimited":
+        quota = SheetsQuota(path="", read_quota=1e9, write_quota=1e9, burst=1e9)
+        sheets_client.SHEETS_RATE_LIMIT_RETRIES = 0
+    else:
+        quota = SheetsQuota(path=files["quota"], read_quota=args.read_quota, write_quota=args.write_quota,
+                            period=args.period)
+    interactive = INTERACTIVE if mode == "priority" else BACKGROUND
+    bulk = BULK if mode == "priority" else BACKGROUND
+
+    async def main():
+        client = _client(api, quota, files["token"])
+        result = {"role": role, "latencies": [], "failed": 0, "done": 0}
+        deadline = time.monotonic() + args.duration
+
+        async def call():
+            await asyncio.sleep(random.uniform(0, args.update_every))
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    await client.batch_get_values(["Sheet1!A2:D2"], priority=interactive)
+                    await client.batch_update_values([{"range": "Sheet1!B2", "values": [["x"]]}],
+                                                     priority=interactive)
+                    result["latencies"].append(time.monotonic() - start)
+                    result["done"] += 1
+                except Exception:
+                    result["failed"] += 1
+                await asyncio.sleep(max(0.0, args.update_every - (time.monotonic() - start)))
+
+        async def bulk_reader():
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    await client.get_values("Sheet1!A2:D501", priority=bulk)
+                    result["latencies"].append(time.monotonic() - start)
+                    result["done"] += 1
+                except Exception:
+                    result["failed"] += 1
+                    # The dispatcher waits before reading a page again after an error
+                    await asyncio.sleep(1.0)
+
+        tasks = [call() for _ in range(args.calls)] if role == "agent" else \
+            [bulk_reader() for _ in range(args.bulk_readers)]
+        await asyncio.gather(*tasks)
+        client.close()
+        return result
+
+    conn.send(asyncio.run(main()))
+    conn.close()
+
+
+def run_mode(args, mode: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench_sheets_quota_")
+    files = {name: os.path.join(workdir, name) for name in ("api", "quota", "token")}
+    with open(files["token"], "w") as f:
+        json.dump({"token": "x", "refresh_token": "x", "client_id": "x", "client_secret": "x"}, f)
+
+    ctx = multiprocessing.get_context("spawn")
+    procs, conns = [], []
+    for role in ["dispatcher"] + ["agent"] * args.agents:
+        parent, child = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_worker, args=(role, args, mode, files, child))
+        proc.start()
+        child.close()
+        procs.append(proc)
+        conns.append(parent)
+    results = [conn.recv() for conn in conns]
+    for proc in procs:
+        proc.join()
+
+    with open(files["api"]) as f:
+        throttled = json.load(f).get("429", {})
+    summary = {"429s": sum(throttled.values())}
+    for role in ("agent", "dispatcher"):
+        latencies = sorted(l for r in results if r["role"] == role for l in r["latencies"])
+        done = sum(r["done"] for r in results if r["role"] == role)
+        summary[role] = {
+            "done": done,
+            "failed": sum(r["failed"] for r in results if r["role"] == role),
+            "p50_ms": round(statistics.median(latencies) * 1000) if latencies else None,
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000)
+            if latencies else None,
+        }
+    # Each agent update is a read and a write; each dispatcher page is a read
+    reads = summary["agent"]["done"] + summary["dispatcher"]["done"]
+    summary["reads_per_period"] = round(reads / args.duration * args.period, 1)
+    summary["writes_per_period"] = round(summary["agent"]["done"] / args.duration * args.period, 1)
+    return summary
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{args.agents} agent processes x {args.calls} calls (an update every {args.update_every:g}s), "
+          f"{args.bulk_readers} bulk readers; quota {args.read_quota} reads and {args.write_quota} writes "
+          f"per {args.period:g}s, {args.duration:g}s per mode")
+    for mode in args.modes.split(","):
+        print(f"  {mode:10s} {json.dumps(run_mode(args, mode))}")
+
+
+if __name__ == "__main__":
+    main()
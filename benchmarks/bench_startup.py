@@ -0,0 +1,145 @@
+"""Startup cost of the agent worker: module import and job process spawn.
+
+--import: imports agent.py in fresh interpreters and reports the wall time,
+plus the modules that take longest (from python -X importtime).
+
+--spawn: starts job processes the way the LiveKit worker does and reports
+the time from Process.start() to the process being ready for a job (agent
+module imported and prewarm() done), split into the two parts. The
+forkserver preloads the registered plugin packages, as the worker does;
+"forkserver+main" also preloads the agent module itself, as
+WORKER_PRELOAD_MAIN does. "spawn" is what macOS and Windows use. Each job
+process runs agent.py as __mp_main__, as LiveKit's do.
+
+    python benchmarks/bench_startup.py --import --runs 5
+    python benchmarks/bench_startup.py --spawn --processes 8
+"""
+import os
+import re
+import sys
+import time
+import runpy
+import argparse
+import subprocess
+import statistics
+import multiprocessing
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.normpath(os.path.join(BENCH_DIR, ".."))
+AGENT_PATH = os.path.join(ROOT_DIR, "agent.py")
+sys.path.insert(0, ROOT_DIR)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import", dest="imports", action="store_true", help="measure importing agent.py")
+    parser.add_argument("--spawn", action="store_true", help="measure job process start to ready")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters for --import")
+    parser.add_argument("--processes", type=int, default=4, help="job processes per start method for --spawn")
+    parser.add_argument("--top", type=int, default=12, help="slowest modules to list")
+    args = parser.parse_args(argv)
+    if not (args.imports or args.spawn):
+        args.imports = args.spawn = True
+    return args
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms"
+
+
+# -------- import time --------
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def bench_import(args):
+    code = "import time; t = time.perf_counter(); import agent; print(time.perf_counter() - t)"
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "0"}
+    times = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, env=env,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    print(f"import agent: median {_ms(statistics.median(times))}, min {_ms(min(times))} over {args.runs} runs")
+
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import agent"], cwd=ROOT_DIR, env=env,
+                         capture_output=True, text=True, check=True)
+    # Modules imported directly by agent.py, with everything they pulled in
+    direct = []
+    for line in out.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match and len(match[3]) == 3:
+            direct.append((int(match[2]), match[4]))
+    print("slowest imports from agent.py (cumulative):")
+    for micros, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {micros / 1000:8.0f}ms  {name}")
+
+
+# -------- process spawn --------
+
+def _job_process(conn, started_at: float):
+    """Stand-in for a LiveKit job process: load the agent script, run prewarm, report when ready"""
+    entered = time.time()
+    # The worker runs agent.py as __main__, so job processes run it again as __mp_main__
+    agent = runpy.run_path(AGENT_PATH, run_name="__mp_main__")
+    imported = time.time()
+    agent["prewarm"](SimpleNamespace(userdata={}))
+    ready = time.time()
+    conn.send({"start": entered - started_at, "import": imported - entered,
+               "prewarm": ready - imported, "ready": ready - started_at})
+    conn.close()
+
+
+def _plugin_packages() -> list:
+    import agent  # noqa: F401  registers the plugins, as it does in the worker process
+    from livekit.agents import Plugin
+    return list(dict.fromkeys(p.package for p in Plugin.registered_plugins))
+
+
+def bench_spawn(args):
+    plugins = _plugin_packages()
+    methods = [
+        ("spawn", "spawn", []),
+        ("forkserver", "forkserver", plugins + ["livekit.agents.ipc._preload"]),
+        ("forkserver+main", "forkserver", plugins + ["agent", "livekit.agents.ipc._preload"]),
+    ]
+    for label, method, preload in methods:
+        ctx = multiprocessing.get_context(method)
+        if method == "forkserver":
+            ctx.set_forkserver_preload(preload)
+        results = []
+        for i in range(args.processes):
+            parent, child = ctx.Pipe(duplex=False)
+            started_at = time.time()
+            proc = ctx.Process(target=_job_process, args=(child, started_at), daemon=True)
+            proc.start()
+            child.close()
+            results.append(parent.recv())
+            proc.join()
+            if method == "forkserver" and i == 0:
+                # The first process also paid for starting the forkserver and its preloads
+                first = results.pop()
+                print(f"{label:16s} first process {_ms(first['ready'])} (includes starting the forkserver)")
+        if not results:
+            continue
+        summary = {key: statistics.median(r[key] for r in results) for key in ("start", "import", "prewarm", "ready")}
+        print(f"{label:16s} ready {_ms(summary['ready'])}: process start {_ms(summary['start'])}, "
+              f"import {_ms(summary['import'])}, prewarm {_ms(summary['prewarm'])} "
+              f"(median of {len(results)})")
+        if method == "forkserver":
+            # Each preload list needs its own forkserver
+            from multiprocessing import forkserver
+            forkserver._forkserver._stop()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.imports:
+        bench_import(args)
+    if args.spawn:
+        bench_spawn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Offline evaluation of the answering machine detector (answering_machine.py).
+
+Runs the detector with the agent's Silero VAD over labelled recordings of
+the first seconds after a call is answered, laid out as
+
+    FIXTURES/human/*.wav
+    FIXTURES/machine/*.wav
+
+(16-bit PCM, any sample rate; stereo is mixed down), and reports precision
+and recall for machines, how many calls ended undecided, and how long the
+decisions took. An undecided call is treated as a person, as in the agent.
+
+With --audio-stream, each recording is played into a local audio track and
+read back through rtc.AudioStream in real time, the path the agent uses on
+a live call (its AudioFrameEvents, the stream's resampling to 16kHz,
+classify_stream()'s time limit), instead of being handed to the detector
+as frames.
+
+With --synthesize N, first writes N synthetic calls of each kind into
+FIXTURES (formant-synthesised speech, ring silence, line noise, beeps), for
+trying out thresholds on a machine without real recordings.
+
+    python benchmarks/eval_amd.py recordings/amd
+    python benchmarks/eval_amd.py /tmp/amd_fixtures --synthesize 50 --verbose
+    python benchmarks/eval_amd.py /tmp/amd_fixtures --synthesize 5 --audio-stream
+"""
+import os
+import sys
+import wave
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from livekit import rtc  # noqa: E402
+from livekit.plugins import silero  # noqa: E402
+
+from answering_machine import (  # noqa: E402
+    HUMAN, MACHINE, UNKNOWN, AMD_DECISION_BUDGET, AnsweringMachineDetector, classify_audio, classify_stream,
+)
+
+LABELS = (HUMAN, MACHINE)
+FRAME_MS = 10
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def read_wav(path: str) -> tuple:
+    """(int16 mono samples, sample rate)"""
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM is supported")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        channels, sample_rate = f.getnchannels(), f.getframerate()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples, sample_rate
+
+
+def write_wav(path: str, samples: np.ndarray, sample_rate: int):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype(np.int16).tobytes())
+
+
+async def wav_frames(samples: np.ndarray, sample_rate: int):
+    step = sample_rate * FRAME_MS // 1000
+    for i in range(0, len(samples) - step + 1, step):
+        yield rtc.AudioFrame(samples[i:i + step].tobytes(), sample_rate, 1, step)
+
+
+async def classify_through_audio_stream(samples: np.ndarray, sample_rate: int, vad) -> AnsweringMachineDetector:
+    """Play the recording into a local track and run the detector on an rtc.AudioStream of it"""
+    source = rtc.AudioSource(sample_rate, 1)
+    track = rtc.LocalAudioTrack.create_audio_track("callee", source)
+    audio = rtc.AudioStream(track, sample_rate=16000, num_channels=1)
+
+    async def play():
+        # capture_frame() waits while the source's buffer is full, so this runs in real time
+        async for frame in wav_frames(samples, sample_rate):
+            await source.capture_frame(frame)
+
+    player = asyncio.create_task(play())
+    try:
+        return await classify_stream(audio, vad, wait_for_message=False)
+    finally:
+        player.cancel()
+        await audio.aclose()
+        await source.aclose()
+
+
+# -------- synthetic fixtures --------
+
+SYNTH_RATE = 16000
+# First three formants of a few vowels (Hz)
+VOWELS = ((730, 1090, 2440), (270, 2290, 3010), (300, 870, 2240),
+          (530, 1840, 2480), (570, 840, 2410), (660, 1720, 2410))
+
+
+def _resonator(x: np.ndarray, freq: float, bandwidth: float) -> np.ndarray:
+    r = np.exp(-np.pi * bandwidth / SYNTH_RATE)
+    b, c = 2 * r * np.cos(2 * np.pi * freq / SYNTH_RATE), -r * r
+    a = 1 - b - c
+    y = np.empty_like(x)
+    y1 = y2 = 0.0
+    for i, v in enumerate(x):
+        y1, y2 = a * v + b * y1 + c * y2, y1
+        y[i] = y1
+    return y
+
+
+def synth_speech(seconds: float, rng, pitch: float) -> np.ndarray:
+    """Voiced syllables: a glottal pulse train through vowel formants"""
+    parts, total = [], int(seconds * SYNTH_RATE)
+    while sum(map(len, parts)) < total:
+        n = int(rng.uniform(0.15, 0.3) * SYNTH_RATE)
+        t = np.arange(n) / SYNTH_RATE
+        f0 = pitch * rng.uniform(0.85, 1.25) * (1 + 0.2 * rng.choice((-1, 1)) * t / t[-1])
+        pulses = (np.diff(np.floor(np.cumsum(f0) / SYNTH_RATE), prepend=0) > 0).astype(float)
+        source = np.convolve(pulses, np.hanning(40), "same") + 0.01 * rng.standard_normal(n)
+        f1, f2, f3 = VOWELS[rng.integers(len(VOWELS))]
+        y = (_resonator(source, f1, 90) + 0.5 * _resonator(source, f2, 110)
+             + 0.25 * _resonator(source, f3, 160))
+        ramp = np.minimum(1, np.minimum(np.arange(n), n - np.arange(n)) / (0.03 * SYNTH_RATE))
+        y *= ramp
+        parts += [y, rng.standard_normal(int(0.02 * SYNTH_RATE)) * 0.05 * np.abs(y).max()]
+    x = np.concatenate(parts)[:total]
+    return x / np.abs(x).max() * rng.uniform(5000, 12000)
+
+
+def synth_phrase(words: int, rng, pitch: float) -> np.ndarray:
+    """Words of speech separated by short pauses"""
+    parts = []
+    for _ in range(words):
+        parts += [synth_speech(rng.uniform(0.25, 0.5), rng, pitch), np.zeros(int(rng.uniform(0.05, 0.2) * SYNTH_RATE))]
+    return np.concatenate(parts)
+
+
+def synth_call(label: str, rng) -> np.ndarray:
+    pitch = rng.uniform(90, 220)
+    silence = lambda seconds: np.zeros(int(seconds * SYNTH_RATE))  # noqa: E731
+    parts = [silence(rng.uniform(0.2, 1.2))]
+    if label == HUMAN:
+        # "Hello?" / "Yes, who is this?", then waiting for an answer, maybe asking again
+        parts += [synth_phrase(rng.integers(1, 4), rng, pitch), silence(rng.uniform(1.5, 2.5))]
+        if rng.random() < 0.3:
+            parts += [synth_phrase(1, rng, pitch), silence(1.5)]
+    else:
+        # A recorded greeting of a few sentences, usually ending with a beep
+        for _ in range(rng.integers(1, 4)):
+            parts += [synth_phrase(rng.integers(3, 9), rng, pitch), silence(rng.uniform(0.3, 0.6))]
+        if rng.random() < 0.8:
+            t = np.arange(int(rng.uniform(0.2, 0.6) * SYNTH_RATE)) / SYNTH_RATE
+            parts += [np.sin(2 * np.pi * rng.choice((440, 850, 1000, 1400)) * t) * 8000]
+        parts += [silence(1.5)]
+    x = np.concatenate(parts)
+    return x + rng.standard_normal(len(x)) * rng.uniform(20, 150)  # line noise
+
+
+def synthesize(folder: str, count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for label in LABELS:
+        os.makedirs(os.path.join(folder, label), exist_ok=True)
+        for i in range(count):
+            write_wav(os.path.join(folder, label, f"synthetic_{i:03d}.wav"), synth_call(label, rng), SYNTH_RATE)
+
+
+# -------- evaluation --------
+
+async def evaluate(folder: str, verbose: bool = False, audio_stream: bool = False) -> dict:
+    vad = silero.VAD.load()
+    results = []
+    for label in LABELS:
+        directory = os.path.join(folder, label)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".wav"):
+                continue
+            samples, sample_rate = read_wav(os.path.join(directory, name))
+            if audio_stream:
+                detector = await classify_through_audio_stream(samples, sample_rate, vad)
+            else:
+                detector = await classify_audio(wav_frames(samples, sample_rate), vad, AnsweringMachineDetector())
+            decision = detector.decision
+            predicted = decision.label if decision else UNKNOWN
+            results.append((label, predicted, decision.at if decision else None))
+            if verbose or (predicted == MACHINE) != (label == MACHINE):
+                reason = decision.reason if decision else "audio ended"
+                at = f"{decision.at:.2f}s" if decision else "-"
+                print(f"{label:8} {predicted:8} {at:>7}  {reason:35} {label}/{name}")
+
+    tp = sum(1 for label, predicted, _ in results if label == MACHINE and predicted == MACHINE)
+    fp = sum(1 for label, predicted, _ in results if label == HUMAN and predicted == MACHINE)
+    fn = sum(1 for label, predicted, _ in results if label == MACHINE and predicted != MACHINE)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    summary = {
+        "calls": len(results),
+        "machine_precision": precision,
+        "machine_recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "humans_hung_up_on": fp,
+        "undecided": sum(1 for _, predicted, _ in results if predicted == UNKNOWN),
+    }
+    for label in (HUMAN, MACHINE):
+        times = [at for truth, predicted, at in results if predicted == label and at is not None]
+        summary[f"{label}_decision_p50_s"] = percentile(times, 50)
+        summary[f"{label}_decision_p95_s"] = percentile(times, 95)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", help="folder with human/ and machine/ subfolders of WAV files")
+    parser.add_argument("--synthesize", type=int, default=0, metavar="N",
+                        help="first write N synthetic calls of each kind into the folder")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--audio-stream", action="store_true",
+                        help="feed the detector through a real rtc.AudioStream, in real time")
+    parser.add_argument("--verbose", action="store_true", help="print every call, not only the misclassified ones")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.synthesize:
+        synthesize(args.fixtures, args.synthesize, args.seed)
+    summary = asyncio.run(evaluate(args.fixtures, args.verbose, args.audio_stream))
+    print(f"decision budget {AMD_DECISION_BUDGET}s")
+    print("  ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in summary.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""In-process stand-ins for LiveKit and Google Sheets used by the benchmarks."""
+import re
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+from livekit import api
+
+
+class Latency:
+    """Random delay drawn uniformly from mean +/- jitter (seconds)"""
+
+    def __init__(self, mean: float = 0.0, jitter: float = 0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        return max(0.0, random.uniform(self.mean - self.jitter, self.mean + self.jitter))
+
+    async def wait(self):
+        delay = self.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeLiveKitAPI:
+    """Stand-in for api.LiveKitAPI covering the calls the dispatcher makes.
+
+    Rooms come into existence when an agent dispatch is created and close
+    `call_duration` seconds after the callee answers. `failure_rate` is the
+    chance that dialing fails with a SIP error, as a busy or unreachable
+    number would. With `trunk_capacity` set, dials beyond that many
+    simultaneous calls are rejected with SIP 503, like a saturated trunk.
+    With `dial_log` set, the time and number of every dial are also appended
+    to that file, so dials survive the process being killed.
+    """
+
+    def __init__(self, dispatch_latency: Latency = None, sip_latency: Latency = None,
+                 answer_delay: Latency = None, call_duration: Latency = None,
+                 agent_join_delay: Latency = None, failure_rate: float = 0.0,
+                 trunk_capacity: int = 0, dial_log: str = None):
+        self.dispatch_latency = dispatch_latency or Latency()
+        self.sip_latency = sip_latency or Latency()
+        self.answer_delay = answer_delay or Latency()
+        self.call_duration = call_duration or Latency()
+        self.agent_join_delay = agent_join_delay or Latency()
+        self.failure_rate = failure_rate
+        self.trunk_capacity = trunk_capacity
+        self.dial_log = open(dial_log, "a", buffering=1) if dial_log else None
+
+        # room name -> {"dispatched": t, "agent_joined": t, "dialed": t, "closes": t}
+        self.rooms: dict[str, dict] = {}
+        self.dial_times: list[float] = []
+        self.dialed_numbers: list[str] = []
+        self.failures = 0
+        self.rejections = 0
+
+        self.agent_dispatch = SimpleNamespace(create_dispatch=self._create_dispatch)
+        self.sip = SimpleNamespace(create_sip_participant=self._create_sip_participant)
+        self.room = SimpleNamespace(
+            list_rooms=self._list_rooms,
+            list_participants=self._list_participants,
+            delete_room=self._delete_room,
+        )
+
+    async def _create_dispatch(self, req: api.CreateAgentDispatchRequest):
+        await self.dispatch_latency.wait()
+        now = time.monotonic()
+        self.rooms[req.room] = {
+            "dispatched": now,
+            "agent_joined": now + self.agent_join_delay.sample(),
+            "closes": None,
+        }
+        return api.AgentDispatch(id=f"AD_{len(self.rooms)}", agent_name=req.agent_name,
+                                 room=req.room, metadata=req.metadata)
+
+    async def _create_sip_participant(self, req: api.CreateSIPParticipantRequest):
+        room = self.rooms.setdefault(req.room_name, {"dispatched": None, "agent_joined": None, "closes": None})
+        now = time.monotonic()
+        room["dialed"] = now
+        if room["dispatched"] is not None:
+            self.dial_times.append(now - room["dispatched"])
+        self.dialed_numbers.append(req.sip_call_to)
+        if self.dial_log:
+            self.dial_log.write(f"{time.time():.3f} {req.sip_call_to}\n")
+        if self.trunk_capacity and self._active_trunk_calls() >= self.trunk_capacity:
+            self.rejections += 1
+            room["closes"] = now
+            raise api.TwirpError("unavailable", "Service Unavailable", status=503,
+                                 metadata={"sip_status_code": "503", "sip_status": "Service Unavailable"})
+        await self.sip_latency.wait()
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            room["closes"] = time.monotonic()
+            raise api.TwirpError("unavailable", "Temporarily Unavailable", status=503,
+                                 metadata={"sip_status_code": "480", "sip_status": "Temporarily Unavailable"})
+        if req.wait_until_answered:
+            await self.answer_delay.wait()
+        room["closes"] = time.monotonic() + self.call_duration.sample()
+        return api.SIPParticipantInfo(participant_identity=req.participant_identity,
+                                      room_name=req.room_name)
+
+    def _active_trunk_calls(self) -> int:
+        now = time.monotonic()
+        return sum(1 for room in self.rooms.values()
+                   if room.get("dialed") is not None and (room["closes"] is None or room["closes"] > now))
+
+    def _room_open(self, name: str) -> bool:
+        room = self.rooms.get(name)
+        if room is None:
+            return False
+        return room["closes"] is None or room["closes"] > time.monotonic()
+
+    async def _list_rooms(self, req: api.ListRoomsRequest):
+        names = req.names or list(self.rooms)
+        return api.ListRoomsResponse(rooms=[api.Room(name=n) for n in names if self._room_open(n)])
+
+    async def _list_participants(self, req: api.ListParticipantsRequest):
+        room = self.rooms.get(req.room)
+        participants = []
+        if room and room["agent_joined"] is not None and room["agent_joined"] <= time.monotonic():
+            participants.append(api.ParticipantInfo(identity=f"agent-{req.room}",
+                                                    kind=api.ParticipantInfo.Kind.AGENT))
+        return api.ListParticipantsResponse(participants=participants)
+
+    async def _delete_room(self, req: api.DeleteRoomRequest):
+        room = self.rooms.get(req.room)
+        if room:
+            room["closes"] = time.monotonic()
+        return api.DeleteRoomResponse()
+
+    async def aclose(self):
+        pass
+
+
+class FakeSheetsClient:
+    """Stand-in for sheets_client.SheetsClient backed by a synthetic campaign.
+
+    Rows are generated on demand, so campaigns of any size take no memory
+    until they are read. Columns are index, name, phone number and address.
+    """
+
+    def __init__(self, customers: int, latency: Latency = None, duplicate_every: int = 0):
+        self.customers = customers
+        self.latency = latency or Latency()
+        self.duplicate_every = duplicate_every
+        self.reads = 0
+        self.writes: list = []
+        self.overrides: dict[int, list] = {}
+
+    def row(self, row_number: int) -> list:
+        """Values of a sheet row (row 2 is the first customer)"""
+        if row_number in self.overrides:
+            return self.overrides[row_number]
+        index = row_number - 1
+        number_id = index
+        if self.duplicate_every and index % self.duplicate_every == 0 and index > 0:
+            number_id = index - 1
+        return [str(index), f"Customer {index}", f"9{number_id:09d}", f"{index} Example Street"]
+
+    def _parse_range(self, range_name: str):
+        cells = range_name.split("!")[-1]
+        numbers = [int(n) for n in re.findall(r"\d+", cells)]
+        first = numbers[0] if numbers else 1
+        last = numbers[1] if len(numbers) > 1 else (first if numbers and ":" not in cells else self.customers + 1)
+        return first, last
+
+    async def get_values(self, range_name: str, spreadsheet_id: str = "", priority: str = None) -> list:
+        await self.latency.wait()
+        self.reads += 1
+        first, last = self._parse_range(range_name)
+        last = min(last, self.customers + 1)
+        return [self.row(r) for r in range(max(first, 2), last + 1)]
+
+    async def batch_get_values(self, ranges: list, spreadsheet_id: str = "", priority: str = None) -> list:
+        await self.latency.wait()
+        self.reads += 1
+        result = []
+        for range_name in ranges:
+            first, last = self._parse_range(range_name)
+            last = min(last, self.customers + 1)
+            result.append([self.row(r) for r in range(max(first, 2), last + 1)])
+        return result
+
+    async def update_values(self, range_name: str, values: list, spreadsheet_id: str = "",
+                            priority: str = None) -> dict:
+        await self.latency.wait()
+        self.writes.append((range_name, values))
+        return {"updatedCells": sum(len(row) for row in values)}
+
+    async def batch_update_values(self, data: list, spreadsheet_id: str = "", priority: str = None) -> dict:
+        await self.latency.wait()
+        self.writes.extend((entry["range"], entry["values"]) for entry in data)
+        return {"totalUpdatedCells": sum(len(row) for entry in data for row in entry["values"])}
+
+
+# -------- voice pipeline --------
+
+VOICE_SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.02
+# Speaking rate of the fake callee and of the fake TTS
+SECONDS_PER_WORD = 0.3
+
+
+def _frame(level: int, sample_rate: int = VOICE_SAMPLE_RATE, seconds: float = FRAME_SECONDS):
+    from livekit import rtc
+    import numpy as np
+
+    samples = int(sample_rate * seconds)
+    data = (np.random.default_rng(level).standard_normal(samples) * level).astype(np.int16) if level else \
+        np.zeros(samples, dtype=np.int16)
+    return rtc.AudioFrame(data.tobytes(), sample_rate, 1, samples)
+
+
+class FakeCallee:
+    """The person (or answering machine) on a simulated call.
+
+    Speaks each line of `script` once the agent has finished its turn: the
+    audio input yields noise frames while it speaks and silence otherwise,
+    and the fake STT reports the line as a final transcript when it stops.
+    `end_of_speech` keeps when each line ended, to time the agent's reply.
+    """
+
+    def __init__(self, script: list, pause: float = 0.4):
+        self.script = list(script)
+        self.pause = pause
+        self.speaking = False
+        self.finished = asyncio.Event()
+        self.transcripts: asyncio.Queue = asyncio.Queue()
+        self.end_of_speech: list = []
+        self._agent_done = asyncio.Event()
+
+    def agent_state_changed(self, state: str):
+        if state == "listening":
+            self._agent_done.set()
+        else:
+            self._agent_done.clear()
+
+    async def run(self):
+        """Speak the script; start once the agent's greeting has played out"""
+        self._agent_done.set()
+        for line in self.script:
+            await self._agent_done.wait()
+            await asyncio.sleep(self.pause)
+            self.transcripts.put_nowait(("start", line))
+            self.speaking = True
+            await asyncio.sleep(len(line.split()) * SECONDS_PER_WORD)
+            self.speaking = False
+            self.end_of_speech.append(time.monotonic())
+            self.transcripts.put_nowait(("end", line))
+            self._agent_done.clear()
+        self.finished.set()
+
+
+def fake_audio_input(callee: FakeCallee):
+    """Room audio of the callee as 20ms frames, paced in real time"""
+    from livekit.agents.voice import io
+
+    class FakeAudioInput(io.AudioInput):
+        def __init__(self):
+            super().__init__(label="fake-callee")
+            self._silence = _frame(0)
+            self._speech = _frame(3000)
+            self._next = None
+
+        async def __anext__(self):
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            self._next = now if self._next is None or self._next < now - 1 else self._next + FRAME_SECONDS
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            return self._speech if callee.speaking else self._silence
+
+    return FakeAudioInput()
+
+
+def fake_audio_output(on_first_frame=None):
+    """Plays agent audio out in real time, like a room track would"""
+    from livekit.agents.voice import io
+
+    class FakeAudioOutput(io.AudioOutput):
+        def __init__(self):
+            super().__init__(label="fake-room", capabilities=io.AudioOutputCapabilities(pause=False),
+                             sample_rate=None)
+            self._pushed = 0.0
+            self._started_at = None
+            self._playout = None
+
+        async def capture_frame(self, frame):
+            await super().capture_frame(frame)
+            if self._started_at is None:
+                self._started_at = time.monotonic()
+                self.on_playback_started(created_at=time.time())
+                if on_first_frame is not None:
+                    on_first_frame()
+            self._pushed += frame.duration
+
+        def flush(self):
+            super().flush()
+            if self._started_at is None:
+                return
+            remaining = self._started_at + self._pushed - time.monotonic()
+            pushed = self._pushed
+            self._reset()
+            self._playout = asyncio.get_running_loop().call_later(
+                max(0.0, remaining), lambda: self.on_playback_finished(playback_position=pushed, interrupted=False))
+
+        def clear_buffer(self):
+            if self._started_at is None:
+                return
+            played = min(self._pushed, time.monotonic() - self._started_at)
+            self._reset()
+            self.on_playback_finished(playback_position=played, interrupted=True)
+
+        def _reset(self):
+            self._pushed = 0.0
+            self._started_at = None
+
+    return FakeAudioOutput()
+
+
+def fake_stt(callee: FakeCallee, latency: Latency = None):
+    """Streaming STT that transcribes exactly what the callee said, after `latency`"""
+    from livekit.agents import stt
+    from livekit.agents.utils import shortuuid
+
+    latency = latency or Latency()
+
+    class FakeSpeechStream(stt.RecognizeStream):
+        async def _run(self):
+            async def drain():
+                async for _ in self._input_ch:
+                    pass
+
+            drainer = asyncio.create_task(drain())
+            try:
+                while True:
+                    kind, line = await callee.transcripts.get()
+                    if kind == "start":
+                        self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.START_OF_SPEECH))
+                        continue
+                    await latency.wait()
+                    data = stt.SpeechData(language="en", text=line, confidence=1.0)
+                    self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+                                                               request_id=shortuuid(), alternatives=[data]))
+                    self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.END_OF_SPEECH))
+            finally:
+                drainer.cancel()
+
+    class FakeSTT(stt.STT):
+        def __init__(self):
+            super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=False))
+
+        async def _recognize_impl(self, buffer, *, language=None, conn_options=None):
+            raise NotImplementedError
+
+        def stream(self, *, language=None, conn_options=None):
+            from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS
+            return FakeSpeechStream(stt=self, conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS,
+                                    sample_rate=VOICE_SAMPLE_RATE)
+
+    return FakeSTT()
+
+
+def fake_llm(ttft: Latency = None, token_delay: float = 0.01):
+    """LLM that follows the outbound script: greets, calls update_customer_details when
+    told a detail is wrong, end_call on goodbye and detected_answering_machine on a
+    voicemail greeting"""
+    import json
+    from livekit.agents import llm
+    from livekit.agents.utils import shortuuid
+
+    ttft = ttft or Latency()
+
+    def respond(chat_ctx) -> tuple:
+        """(text, tool call) for the conversation so far"""
+        last = chat_ctx.items[-1] if chat_ctx.items else None
+        if last is not None and last.type == "function_call_output":
+            if last.name == "update_customer_details":
+                return "Thanks, I've updated that. Is everything else correct?", None
+            return "", None
+        if last is not None and last.type == "message" and last.role == "system":
+            if "voicemail" in last.text_content.lower():
+                return "Hello, this is a call to confirm your details. We will call you back later.", None
+            return ("Hello, I'm an AI assistant calling to confirm your details. "
+                    "Is your name and address still correct?"), None
+        said = (last.text_content or "").lower() if last is not None and last.type == "message" else ""
+        if "after the beep" in said:
+            return "", ("detected_answering_machine", {})
+        if "address is wrong" in said:
+            return "", ("update_customer_details", {"field": "address", "value": said.split("it is ")[-1].strip(". ")})
+        if "bye" in said:
+            return "Goodbye, have a nice day.", ("end_call", {})
+        return "Great, thank you.", None
+
+    class FakeLLMStream(llm.LLMStream):
+        async def _run(self):
+            text, tool_call = respond(self._chat_ctx)
+            await ttft.wait()
+            request_id = shortuuid()
+            for word in text.split(" ") if text else ():
+                self._event_ch.send_nowait(llm.ChatChunk(id=request_id, delta=llm.ChoiceDelta(
+                    role="assistant", content=word + " ")))
+                await asyncio.sleep(token_delay)
+            if tool_call:
+                name, arguments = tool_call
+                self._event_ch.send_nowait(llm.ChatChunk(id=request_id, delta=llm.ChoiceDelta(
+                    role="assistant", tool_calls=[llm.FunctionToolCall(
+                        name=name, arguments=json.dumps(arguments), call_id=shortuuid())])))
+            self._event_ch.send_nowait(llm.ChatChunk(id=request_id, usage=llm.CompletionUsage(
+                completion_tokens=len(text.split()) + 5, prompt_tokens=1200, total_tokens=1205)))
+
+    class FakeLLM(llm.LLM):
+        def chat(self, *, chat_ctx, tools=None, conn_options=None, **kwargs):
+            from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS
+            return FakeLLMStream(self, chat_ctx=chat_ctx, tools=tools or [],
+                                 conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS)
+
+    return FakeLLM()
+
+
+def fake_tts(ttfb: Latency = None, sample_rate: int = 24000):
+    """TTS that returns silence as long as the text would take to say, after `ttfb`"""
+    from livekit.agents import tts
+    from livekit.agents.utils import shortuuid
+
+    ttfb = ttfb or Latency()
+    chunk = bytes(int(sample_rate * 0.1) * 2)
+
+    class FakeChunkedStream(tts.ChunkedStream):
+        async def _run(self, output_emitter):
+            output_emitter.initialize(request_id=shortuuid(), sample_rate=sample_rate, num_channels=1,
+                                      mime_type="audio/pcm")
+            await ttfb.wait()
+            for _ in range(max(1, round(len(self._input_text.split()) * SECONDS_PER_WORD / 0.1))):
+                output_emitter.push(chunk)
+            output_emitter.flush()
+
+    class FakeTTS(tts.TTS):
+        def __init__(self):
+            super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=sample_rate,
+                             num_channels=1)
+
+        def synthesize(self, text, *, conn_options=None):
+            from livekit.agents.types import DEFAULT_API_CONNECT_OPTIONS
+            return FakeChunkedStream(tts=self, input_text=text,
+                                     conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS)
+
+    return FakeTTS()
@@ -0,0 +1,242 @@
+"""Soak test of one agent worker process: many simultaneous calls, rising in steps.
+
+Each call is a real AgentSession running the Assistant from agent.py with
+scripted stand-ins for the rest (benchmarks/fakes.py): a callee whose audio
+arrives as 20ms frames in real time, an STT that transcribes what the callee
+said after --stt-delay, an LLM that follows the outbound script after
+--llm-ttft, a TTS that returns audio as long as the text after --tts-ttfb,
+an audio output that plays it out in real time, and a Google Sheets backend
+answering after --sheets-latency. A human callee confirms their name, gives
+a new address (update_customer_details) and says goodbye (end_call);
+--voicemail-rate of the calls reach an answering machine instead
+(detected_answering_machine). The call then ends and its slot starts the
+next one, so each level holds its concurrency for --duration seconds.
+
+The room deletion at hang-up has no LiveKit server here and is logged as
+failed; the call still ends where it would. AMD screening of the callee's
+audio is not run.
+
+For each level reports:
+  rss_per_session_mb   growth of the process RSS over the idle baseline, per call
+  loop_lag_ms          event loop lag p50/p95/p99, sampled every 10ms
+  response_ms          end of callee speech to the agent's first audio, p50/p95
+  tools_ms             p95 of each function tool's execution time
+  cpu                  share of one core used (user + system time / wall time)
+  sessions_per_core    concurrency divided by cpu
+and the highest level that kept loop lag p99 under --lag-slo and response
+p95 within --response-margin of the first level's (so the first level should
+be light). The times of end_call and detected_answering_machine include the
+agent's last words playing out.
+
+    python benchmarks/soak_agent.py
+    python benchmarks/soak_agent.py --levels 25,50,100,200,400 --duration 120 --vad
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+# Keep the calls' log events, sheet spool and customer index out of the real ones
+_WORKDIR = tempfile.mkdtemp(prefix="soak_agent_")
+os.environ.setdefault("CALL_LOG_FILE", os.path.join(_WORKDIR, "call_log.jsonl"))
+os.environ.setdefault("SHEET_SPOOL_DIR", os.path.join(_WORKDIR, "sheet_spool"))
+os.environ.setdefault("CUSTOMER_INDEX_DB", os.path.join(_WORKDIR, "customer_index.db"))
+
+from bench_dispatch import measure_loop_lag, percentile, rss_mb  # noqa: E402
+from fakes import (FakeCallee, FakeSheetsClient, Latency, fake_audio_input, fake_audio_output,  # noqa: E402
+                   fake_llm, fake_stt, fake_tts)
+
+HUMAN_SCRIPT = [
+    "Yes, that's me.",
+    "The name is right but my address is wrong, it is 12 New Road.",
+    "No, that's everything. Bye.",
+]
+VOICEMAIL_SCRIPT = ["Hi, you've reached Sam. Please leave a message after the beep."]
+# Longest a call may run before it is counted as stuck and closed
+CALL_TIMEOUT = 120.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="10,25,50,100", help="concurrent calls at each step")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds at each level")
+    parser.add_argument("--voicemail-rate", type=float, default=0.2)
+    parser.add_argument("--stt-delay", type=float, default=0.2, help="end of speech to final transcript (s)")
+    parser.add_argument("--llm-ttft", type=float, default=0.4, help="LLM time to first token (s)")
+    parser.add_argument("--tts-ttfb", type=float, default=0.2, help="TTS time to first byte (s)")
+    parser.add_argument("--sheets-latency", type=float, default=0.15, help="Sheets API latency (s)")
+    parser.add_argument("--vad", action="store_true", help="run Silero VAD on every call's audio, as the worker does")
+    parser.add_argument("--lag-slo", type=float, default=0.05, help="loop lag p99 limit (s)")
+    parser.add_argument("--response-margin", type=float, default=0.3,
+                        help="response latency p95 allowed over the first level's (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+class LevelStats:
+    def __init__(self):
+        self.calls = 0
+        self.stuck = 0
+        self.errors = 0
+        self.response: list = []
+        self.tools: dict[str, list] = {}
+        self.loop_lag: list = []
+
+
+async def run_call(args, number: int, sheets: FakeSheetsClient, vad, stats: LevelStats):
+    from livekit.agents import AgentSession
+
+    from agent import Assistant
+    from customer_source import parse_customer_row
+    from prompts import outbound_greeting_instructions
+    from voice_metrics import CallMetrics
+
+    voicemail = random.random() < args.voicemail_rate
+    row = 2 + number % sheets.customers
+    customer = parse_customer_row(sheets.row(row), row)
+    callee = FakeCallee(VOICEMAIL_SCRIPT if voicemail else HUMAN_SCRIPT)
+    first_audio: list = []
+
+    session = AgentSession(
+        stt=fake_stt(callee, Latency(args.stt_delay, args.stt_delay / 4)),
+        llm=fake_llm(Latency(args.llm_ttft, args.llm_ttft / 4)),
+        tts=fake_tts(Latency(args.tts_ttfb, args.tts_ttfb / 4)),
+        vad=vad,
+        turn_detection="stt",
+    )
+    session.input.audio = fake_audio_input(callee)
+    session.output.audio = fake_audio_output(lambda: first_audio.append(time.monotonic()))
+    session.on("agent_state_changed", lambda ev: callee.agent_state_changed(ev.new_state))
+    call_metrics = CallMetrics()
+    call_metrics.attach(session)
+    agent = Assistant()
+
+    callee_task = None
+    try:
+        await session.start(agent=agent, record=False)
+        session.customer_data = customer
+        await session.generate_reply(instructions=outbound_greeting_instructions(customer))
+        callee_task = asyncio.create_task(callee.run())
+        deadline = time.monotonic() + CALL_TIMEOUT
+        while not agent.hung_up and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if not agent.hung_up:
+            stats.stuck += 1
+    except Exception:
+        stats.errors += 1
+    finally:
+        if callee_task is not None:
+            callee_task.cancel()
+        await session.aclose()
+
+    stats.calls += 1
+    for ended in callee.end_of_speech:
+        reply = next((t for t in first_audio if t > ended), None)
+        if reply is not None:
+            stats.response.append(reply - ended)
+    for key, values in call_metrics.samples.items():
+        if key.startswith("tool."):
+            stats.tools.setdefault(key[5:], []).extend(values)
+
+
+async def run_level(args, level: int, sheets, vad, numbers, baseline_rss: float) -> dict:
+    stats = LevelStats()
+    deadline = time.monotonic() + args.duration
+
+    async def slot():
+        # Spread the first calls over a second so the level does not start in lockstep
+        await asyncio.sleep(random.uniform(0, 1.0))
+        while time.monotonic() < deadline:
+            await run_call(args, next(numbers), sheets, vad, stats)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    wall_start = time.monotonic()
+    slots = [asyncio.create_task(slot()) for _ in range(level)]
+    lag_task = asyncio.create_task(measure_loop_lag(stats.loop_lag))
+
+    # RSS with every slot busy, halfway through the level
+    await asyncio.sleep(args.duration / 2)
+    rss = rss_mb()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage.ru_utime + usage.ru_stime - cpu_start) / (time.monotonic() - wall_start)
+
+    await asyncio.gather(*slots)
+    lag_task.cancel()
+
+    lag = stats.loop_lag
+    return {
+        "calls": stats.calls,
+        "stuck": stats.stuck,
+        "errors": stats.errors,
+        "rss_mb": round(rss),
+        "rss_per_session_mb": round((rss - baseline_rss) / level, 2),
+        "loop_lag_ms": [round(percentile(lag, p) * 1000, 1) for p in (50, 95, 99)],
+        "response_ms": [round(percentile(stats.response, p) * 1000) for p in (50, 95)],
+        "tools_ms": {tool: round(percentile(values, 95) * 1000) for tool, values in sorted(stats.tools.items())},
+        "cpu": round(cpu, 2),
+        "sessions_per_core": round(level / cpu) if cpu else None,
+    }
+
+
+async def main_async(args):
+    import itertools
+
+    import sheets_client
+    from sheet_writer import get_sheet_writer
+
+    random.seed(args.seed)
+    sheets = FakeSheetsClient(customers=10000, latency=Latency(args.sheets_latency, args.sheets_latency / 2))
+    sheets_client._client = sheets
+    vad = None
+    if args.vad:
+        from livekit.plugins import silero
+        vad = silero.VAD.load()
+    numbers = itertools.count()
+
+    # One call first, so imports and first-use setup are not counted as per-session memory
+    await run_call(args, next(numbers), sheets, vad, LevelStats())
+    baseline_rss = rss_mb()
+    print(f"Baseline RSS {baseline_rss:.0f} MB; {args.duration:g}s per level, "
+          f"voicemail rate {args.voicemail_rate:g}, VAD {'on' if vad else 'off'}")
+
+    capacity = None
+    response_slo_ms = None
+    for level in (int(x) for x in args.levels.split(",")):
+        result = await run_level(args, level, sheets, vad, numbers, baseline_rss)
+        if response_slo_ms is None:
+            response_slo_ms = result["response_ms"][1] + args.response_margin * 1000
+        within_slo = (result["loop_lag_ms"][2] <= args.lag_slo * 1000
+                      and result["response_ms"][1] <= response_slo_ms
+                      and not result["stuck"] and not result["errors"])
+        print(f"  {level:4d} calls {'ok  ' if within_slo else 'SLO!'} {result}", flush=True)
+        if not within_slo:
+            break
+        capacity = (level, result["cpu"])
+
+    await get_sheet_writer().aclose()
+    print(f"Sheet writes sent: {len(sheets.writes)}")
+    if capacity is None:
+        print("No level met the SLOs")
+    else:
+        level, cpu = capacity
+        print(f"Capacity: {level} concurrent calls within SLO (loop lag p99 <= {args.lag_slo * 1000:.0f}ms, "
+              f"response p95 <= {response_slo_ms:.0f}ms) using {cpu:.2f} cores")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.disable(logging.CRITICAL)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import fcntl
+import queue
+import atexit
+import datetime
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+# -------- Call Log Setup --------
+CALL_LOG_FILE = os.getenv("CALL_LOG_FILE", "call_log.jsonl")
+CALL_LOG_FSYNC_INTERVAL = float(os.getenv("CALL_LOG_FSYNC_INTERVAL", "1"))
+CALL_LOG_MAX_BYTES = int(os.getenv("CALL_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+# Rotate at least this often (seconds); 0 disables time-based rotation
+CALL_LOG_ROTATE_INTERVAL = float(os.getenv("CALL_LOG_ROTATE_INTERVAL", "0"))
+CALL_LOG_BATCH_SIZE = 512
+# Records held for the writer thread; past this, log() drops records rather than use unbounded memory
+CALL_LOG_QUEUE_SIZE = int(os.getenv("CALL_LOG_QUEUE_SIZE", "100000"))
+# Longest wait between attempts to open the file while it cannot be opened (seconds)
+CALL_LOG_OPEN_RETRY_MAX = 30.0
+
+# Room and call ID of the job the current task belongs to
+_call_context = contextvars.ContextVar("call_context", default={})
+
+
+def bind_call(room_name: str, call_id: str):
+    """Tag every record logged from the current task (and tasks it creates) with this call"""
+    _call_context.set({"room": room_name, "call_id": call_id})
+
+
+def current_call() -> dict:
+    """Room and call ID bound to the current task, if any"""
+    return _call_context.get()
+
+
+class CallLogWriter:
+    """Structured call-event log written by a background thread.
+
+    `log()` only puts the record on a queue. The writer thread drains the
+    queue in batches, appends them to a JSONL file with a single write, fsyncs
+    at most every `fsync_interval` seconds and rotates the file once it grows
+    past `max_bytes` or is older than `rotate_interval` seconds. Several
+    processes may share the same file: writes use O_APPEND, rotation is done
+    under a file lock, and writers reopen the file when it has been rotated.
+    If the file cannot be opened the writer keeps retrying with backoff; the
+    queue holds at most `queue_size` records meanwhile and further records are
+    dropped and counted in `dropped`.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str = CALL_LOG_FILE,
+                 fsync_interval: float = CALL_LOG_FSYNC_INTERVAL,
+                 max_bytes: int = CALL_LOG_MAX_BYTES,
+                 rotate_interval: float = CALL_LOG_ROTATE_INTERVAL,
+                 queue_size: int = CALL_LOG_QUEUE_SIZE):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Records dropped because the queue was full or their write failed
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._fd = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="call-log", daemon=True)
+        self._thread.start()
+
+    def log(self, event_type: str, speaker: str, text: str, **fields):
+        """Queue a record; never blocks"""
+        record = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "monotonic": time.monotonic(),
+            **_call_context.get(),
+            "event_type": event_type,
+            "speaker": speaker,
+            "text": text,
+        }
+        record.update(fields)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # -------- writer thread --------
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._opened_at = time.time()
+
+    def _reopen(self):
+        """Open the file, retrying with backoff until it can be opened"""
+        self._close_fd()
+        delay = 0.5
+        while True:
+            try:
+                self._open()
+                return
+            except OSError as e:
+                logger.error(f"Could not open call log {self.path}: {e}; retrying in {delay:g}s")
+                time.sleep(delay)
+                delay = min(delay * 2, CALL_LOG_OPEN_RETRY_MAX)
+
+    def _close_fd(self):
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _rotated_by_other(self) -> bool:
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _maybe_rotate(self):
+        size = os.fstat(self._fd).st_size
+        too_old = self.rotate_interval > 0 and time.time() - self._opened_at >= self.rotate_interval
+        if size < self.max_bytes and not (too_old and size > 0):
+            return
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited for the lock
+            if not self._rotated_by_other():
+                suffix = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+                os.rename(self.path, f"{self.path}.{suffix}")
+        self._close_fd()
+        self._open()
+
+    def _drain(self, first) -> tuple[list, bool, list]:
+        batch, stop = [first], False
+        while len(batch) < CALL_LOG_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if any(record is self._STOP for record in batch):
+            batch = [record for record in batch if record is not self._STOP]
+            stop = True
+        # flush() waiters ride the queue so they are released after everything logged before them
+        flushed = [record for record in batch if isinstance(record, threading.Event)]
+        if flushed:
+            batch = [record for record in batch if not isinstance(record, threading.Event)]
+        return batch, stop, flushed
+
+    def _report_dropped(self):
+        dropped = self.dropped
+        if dropped > self._dropped_reported:
+            logger.warning(f"Call log dropped {dropped - self._dropped_reported} records "
+                           f"({dropped} since start)")
+            self._dropped_reported = dropped
+
+    def _run(self):
+        self._reopen()
+        last_fsync = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                first = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                first = None
+            stop, flushed = False, []
+            if first is not None:
+                batch, stop, flushed = self._drain(first)
+                if batch:
+                    data = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+                    if self._fd is None or self._rotated_by_other():
+                        self._reopen()
+                    try:
+                        os.write(self._fd, data.encode("utf-8"))
+                        dirty = True
+                    except OSError as e:
+                        self.dropped += len(batch)
+                        logger.error(f"Call log write to {self.path} failed: {e}")
+                    try:
+                        self._maybe_rotate()
+                    except OSError as e:
+                        logger.error(f"Call log rotation of {self.path} failed: {e}")
+                    self._report_dropped()
+            now = time.monotonic()
+            if dirty and self._fd is not None and (stop or flushed or now - last_fsync >= self.fsync_interval):
+                try:
+                    os.fsync(self._fd)
+                except OSError:
+                    pass
+                last_fsync, dirty = now, False
+            for waiter in flushed:
+                waiter.set()
+            if stop:
+                self._close_fd()
+                return
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything queued so far is written and fsynced; False on timeout"""
+        if not self._thread.is_alive():
+            return True
+        waiter = threading.Event()
+        try:
+            self._queue.put(waiter, timeout=timeout)
+        except queue.Full:
+            return False
+        return waiter.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Write out everything queued so far and stop the writer thread"""
+        if self._thread.is_alive():
+            try:
+                self._queue.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_call_log() -> CallLogWriter:
+    """Returns the process-wide CallLogWriter, starting it on first use"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = CallLogWriter()
+                atexit.register(_writer.close)
+    return _writer
+
+
+def log_event(event_type: str, speaker: str, text: str, **fields):
+    get_call_log().log(event_type, speaker, text, **fields)
+
+
+async def flush_call_log(timeout: float = 5.0) -> bool:
+    """flush() the process-wide call log without blocking the event loop"""
+    if _writer is None:
+        return True
+    return await asyncio.to_thread(_writer.flush, timeout)
+
+
+def export_parquet(jsonl_paths: list, out_path: str) -> int:
+    """Convert JSONL call logs to a single Parquet file (requires pyarrow)
+
+    Returns the number of records written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+    records = []
+    for path in jsonl_paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    # Extra fields vary by event; store anything non-scalar as JSON text
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, (dict, list)):
+                record[key] = json.dumps(value)
+    pq.write_table(pa.Table.from_pylist(records), out_path)
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python call_log.py OUTPUT.parquet CALL_LOG.jsonl [CALL_LOG.jsonl ...]")
+        sys.exit(1)
+    count = export_parquet(sys.argv[2:], sys.argv[1])
+    print(f"Wrote {count} records to {sys.argv[1]}")
@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from customer_source import FIRST_DATA_ROW
+
+logger = logging.getLogger(__name__)
+
+CAMPAIGN_DB_FILE = os.getenv("CAMPAIGN_DB_FILE", "campaign_state.db")
+# Seconds between commits of buffered state changes
+CAMPAIGN_FLUSH_INTERVAL = float(os.getenv("CAMPAIGN_FLUSH_INTERVAL", "1"))
+
+# Customer statuses
+QUEUED = "queued"            # read from the sheet, not dialed yet
+DIALING = "dialing"          # an attempt is in progress
+RETRY = "retry"              # waiting for another attempt
+ANSWERED = "answered"
+FAILED = "failed"            # out of attempts, or not worth retrying
+SKIPPED = "skipped"          # invalid row or duplicate number, never dialed
+INTERRUPTED = "interrupted"  # the dispatcher stopped mid-call; not re-dialed automatically
+
+PENDING_STATUSES = (QUEUED, RETRY)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    spreadsheet_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    phone_number TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_outcome TEXT,
+    room_name TEXT,
+    reason TEXT,
+    data TEXT,
+    queued_at REAL,
+    dialed_at REAL,
+    answered_at REAL,
+    ended_at REAL,
+    retry_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (spreadsheet_id, row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS customers_status ON customers (spreadsheet_id, status, row);
+CREATE INDEX IF NOT EXISTS customers_number ON customers (spreadsheet_id, phone_number);
+
+CREATE TABLE IF NOT EXISTS calls (
+    spreadsheet_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    phone_number TEXT,
+    room_name TEXT,
+    outcome TEXT,
+    dialed_at REAL,
+    answered_at REAL,
+    ended_at REAL,
+    PRIMARY KEY (spreadsheet_id, row, attempt)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS campaigns (
+    spreadsheet_id TEXT PRIMARY KEY,
+    next_row INTEGER NOT NULL
+);
+
+-- Kept up to date by triggers so status counts never scan the customers table
+CREATE TABLE IF NOT EXISTS status_counts (
+    spreadsheet_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (spreadsheet_id, status)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS customers_count_insert AFTER INSERT ON customers BEGIN
+    INSERT INTO status_counts VALUES (NEW.spreadsheet_id, NEW.status, 1)
+        ON CONFLICT (spreadsheet_id, status) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS customers_count_update AFTER UPDATE OF status ON customers
+WHEN OLD.status != NEW.status BEGIN
+    UPDATE status_counts SET count = count - 1
+        WHERE spreadsheet_id = OLD.spreadsheet_id AND status = OLD.status;
+    INSERT INTO status_counts VALUES (NEW.spreadsheet_id, NEW.status, 1)
+        ON CONFLICT (spreadsheet_id, status) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS customers_count_delete AFTER DELETE ON customers BEGIN
+    UPDATE status_counts SET count = count - 1
+        WHERE spreadsheet_id = OLD.spreadsheet_id AND status = OLD.status;
+END;
+"""
+
+
+class CampaignStore:
+    """Durable record of every customer row and call attempt of a campaign.
+
+    Backed by SQLite and keyed by spreadsheet and sheet row, with an index on
+    the normalised number. State changes are buffered and committed together
+    every `flush_interval` seconds; `mark_dialing()` waits for its commit, so
+    a number is on disk as being dialed before the call is placed, and calls
+    starting together share one transaction. All database work runs on one
+    background thread.
+    """
+
+    def __init__(self, path: str = CAMPAIGN_DB_FILE, spreadsheet_id: str = "",
+                 flush_interval: float = CAMPAIGN_FLUSH_INTERVAL):
+        self.path = path
+        self.spreadsheet_id = spreadsheet_id or ""
+        self.flush_interval = flush_interval
+        self.next_row = FIRST_DATA_ROW
+        self._conn = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="campaign-store")
+        # (sql, list of parameter tuples), committed in order
+        self._ops: list[tuple[str, list]] = []
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    # -------- database thread --------
+
+    def _open_read_only(self) -> int:
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        found = self._conn.execute(
+            "SELECT next_row FROM campaigns WHERE spreadsheet_id = ?", (self.spreadsheet_id,)
+        ).fetchone()
+        return found[0] if found else FIRST_DATA_ROW
+
+    def _open(self) -> tuple[int, int]:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        with self._conn:
+            interrupted = self._conn.execute(
+                "UPDATE customers SET status = ?, updated_at = ? WHERE spreadsheet_id = ? AND status = ?",
+                (INTERRUPTED, time.time(), self.spreadsheet_id, DIALING),
+            ).rowcount
+            found = self._conn.execute(
+                "SELECT next_row FROM campaigns WHERE spreadsheet_id = ?", (self.spreadsheet_id,)
+            ).fetchone()
+        return (found[0] if found else FIRST_DATA_ROW), interrupted
+
+    def _commit(self, ops: list):
+        with self._conn:
+            for sql, params in ops:
+                self._conn.executemany(sql, params)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        return self._conn.execute(sql, params).fetchall()
+
+    async def _run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # -------- lifecycle --------
+
+    async def open(self, read_only: bool = False):
+        """Open (creating if needed) the database and start the background committer.
+
+        This is the dispatcher's startup: calls left DIALING by a previous run
+        are marked INTERRUPTED. With `read_only`, e.g. to look at a campaign
+        a dispatcher is running, the database is only read and nothing is
+        recovered or committed.
+        """
+        if read_only:
+            self.next_row = await self._run_db(self._open_read_only)
+            return self
+        self.next_row, interrupted = await self._run_db(self._open)
+        if interrupted:
+            logger.warning(f"{interrupted} calls were in progress when the dispatcher last stopped; "
+                           f"marked {INTERRUPTED} and not re-dialed")
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error saving campaign state: {e}")
+
+    async def flush(self):
+        """Commit every buffered change in one transaction"""
+        async with self._flush_lock:
+            ops, self._ops = self._ops, []
+            if not ops:
+                return
+            try:
+                await self._run_db(self._commit, ops)
+            except Exception:
+                # Keep the changes for the next attempt, ahead of anything queued since
+                self._ops = ops + self._ops
+                raise
+
+    async def aclose(self):
+        if self._task:
+            self._task.cancel()
+        try:
+            await self.flush()
+        finally:
+            if self._conn is not None:
+                await self._run_db(self._conn.close)
+            self._executor.shutdown(wait=False)
+
+    def _enqueue(self, sql: str, params: list):
+        if params:
+            self._ops.append((sql, params))
+
+    # -------- writes --------
+
+    def add_rows(self, valid: list = (), skipped: list = (), next_row: int = None):
+        """Record customers read from the sheet.
+
+        Args:
+            valid: customers to be dialed
+            skipped: (row number, phone number or None, reason) of rows that will not be
+            next_row: first sheet row not read yet, saved as the resume point
+        """
+        now = time.time()
+        self._enqueue(
+            "INSERT OR IGNORE INTO customers (spreadsheet_id, row, phone_number, status, data, queued_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(self.spreadsheet_id, c["row"], c.get("phone_number"), QUEUED, json.dumps(c), now, now)
+             for c in valid],
+        )
+        self._enqueue(
+            "INSERT OR IGNORE INTO customers (spreadsheet_id, row, phone_number, status, reason, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(self.spreadsheet_id, row, phone_number, SKIPPED, reason, now)
+             for row, phone_number, reason in skipped],
+        )
+        if next_row is not None and next_row > self.next_row:
+            self.next_row = next_row
+            self._enqueue(
+                "INSERT INTO campaigns VALUES (?, ?) ON CONFLICT (spreadsheet_id) DO UPDATE SET next_row = excluded.next_row",
+                [(self.spreadsheet_id, next_row)],
+            )
+
+    async def mark_dialing(self, customer: dict):
+        """Record the start of an attempt and wait until it is committed"""
+        now = time.time()
+        self._enqueue(
+            "UPDATE customers SET status = ?, attempts = ?, dialed_at = ?, updated_at = ? "
+            "WHERE spreadsheet_id = ? AND row = ?",
+            [(DIALING, customer.get("attempts", 1), now, now, self.spreadsheet_id, customer["row"])],
+        )
+        self._enqueue(
+            "INSERT OR REPLACE INTO calls (spreadsheet_id, row, attempt, phone_number, dialed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(self.spreadsheet_id, customer["row"], customer.get("attempts", 1), customer.get("phone_number"), now)],
+        )
+        await self.flush()
+
+    def record_attempt(self, customer: dict, report: dict):
+        """Record the outcome and room of the attempt started by mark_dialing()"""
+        now = time.time()
+        answered_at = now if report.get("outcome") == ANSWERED else None
+        key = (self.spreadsheet_id, customer["row"])
+        self._enqueue(
+            "UPDATE customers SET last_outcome = ?, room_name = ?, answered_at = COALESCE(?, answered_at), "
+            "updated_at = ? WHERE spreadsheet_id = ? AND row = ?",
+            [(report.get("outcome"), report.get("room_name"), answered_at, now, *key)],
+        )
+        self._enqueue(
+            "UPDATE calls SET outcome = ?, room_name = ?, answered_at = ?, ended_at = ? "
+            "WHERE spreadsheet_id = ? AND row = ? AND attempt = ?",
+            [(report.get("outcome"), report.get("room_name"), answered_at,
+              None if answered_at else now, *key, customer.get("attempts", 1))],
+        )
+
+    def mark_ended(self, customer: dict):
+        """Record that an answered call's room has closed"""
+        now = time.time()
+        key = (self.spreadsheet_id, customer["row"])
+        self._enqueue("UPDATE customers SET ended_at = ?, updated_at = ? WHERE spreadsheet_id = ? AND row = ?",
+                      [(now, now, *key)])
+        self._enqueue("UPDATE calls SET ended_at = ? WHERE spreadsheet_id = ? AND row = ? AND attempt = ?",
+                      [(now, *key, customer.get("attempts", 1))])
+
+    def set_status(self, customer: dict, status: str, retry_at: float = None):
+        now = time.time()
+        self._enqueue(
+            "UPDATE customers SET status = ?, retry_at = ?, updated_at = ?, "
+            "ended_at = COALESCE(ended_at, CASE WHEN ? THEN ? END) WHERE spreadsheet_id = ? AND row = ?",
+            [(status, retry_at, now, status != RETRY, now, self.spreadsheet_id, customer["row"])],
+        )
+
+    async def reset(self):
+        """Forget everything recorded for this spreadsheet"""
+        await self.flush()
+        await self._run_db(self._commit, [
+            ("DELETE FROM customers WHERE spreadsheet_id = ?", [(self.spreadsheet_id,)]),
+            ("DELETE FROM calls WHERE spreadsheet_id = ?", [(self.spreadsheet_id,)]),
+            ("DELETE FROM campaigns WHERE spreadsheet_id = ?", [(self.spreadsheet_id,)]),
+        ])
+        self.next_row = FIRST_DATA_ROW
+
+    # -------- reads --------
+
+    async def pending(self) -> list:
+        """Customers still to be dialed, in sheet order; each has `attempts` and, for retries, `retry_at`"""
+        placeholders = ",".join("?" * len(PENDING_STATUSES))
+        rows = await self._run_db(
+            self._query,
+            f"SELECT data, attempts, status, retry_at FROM customers "
+            f"WHERE spreadsheet_id = ? AND status IN ({placeholders}) ORDER BY row",
+            (self.spreadsheet_id, *PENDING_STATUSES),
+        )
+        customers = []
+        for data, attempts, status, retry_at in rows:
+            customer = json.loads(data)
+            if attempts:
+                customer["attempts"] = attempts
+            if status == RETRY:
+                customer["retry_at"] = retry_at or time.time()
+            customers.append(customer)
+        return customers
+
+    async def known_numbers(self, phone_numbers: list) -> dict:
+        """Maps each of `phone_numbers` already recorded to the first row that has it"""
+        found = {}
+        # Stay under SQLite's limit on bound parameters
+        for i in range(0, len(phone_numbers), 500):
+            chunk = phone_numbers[i:i + 500]
+            rows = await self._run_db(
+                self._query,
+                f"SELECT phone_number, MIN(row) FROM customers WHERE spreadsheet_id = ? "
+                f"AND phone_number IN ({','.join('?' * len(chunk))}) AND status != ? GROUP BY phone_number",
+                (self.spreadsheet_id, *chunk, SKIPPED),
+            )
+            found.update(rows)
+        return found
+
+    async def counts(self) -> dict:
+        """Number of customers in each status, plus `remaining` (queued, retrying or dialing)"""
+        await self.flush()
+        rows = await self._run_db(
+            self._query, "SELECT status, count FROM status_counts WHERE spreadsheet_id = ? AND count > 0",
+            (self.spreadsheet_id,),
+        )
+        counts = dict(rows)
+        counts["remaining"] = sum(counts.get(status, 0) for status in (*PENDING_STATUSES, DIALING))
+        return counts
+
+
+async def _print_counts(path: str):
+    from sheets_client import SPREADSHEET_ID
+
+    if not os.path.exists(path):
+        print(f"No campaign database at {path}")
+        return
+    # Read-only: a dispatcher may be running this campaign, and its calls in progress must stay DIALING
+    store = await CampaignStore(path, SPREADSHEET_ID).open(read_only=True)
+    try:
+        for status, count in sorted((await store.counts()).items()):
+            print(f"{status:<12} {count}")
+    finally:
+        await store.aclose()
+
+
+if __name__ == "__main__":
+    # python campaign_store.py [DB_FILE] -- print the status counts of the current campaign
+    asyncio.run(_print_counts(sys.argv[1] if len(sys.argv) > 1 else CAMPAIGN_DB_FILE))
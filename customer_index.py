@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from customer_source import FIRST_DATA_ROW, iter_customer_pages
+from phone_numbers import normalise_number
+from sheets_client import load_sheets_client
+
+logger = logging.getLogger(__name__)
+
+# -------- Customer Index Setup --------
+# Snapshot of the customer sheet shared by every process on the host; empty keeps one per process in memory
+CUSTOMER_INDEX_DB = os.getenv("CUSTOMER_INDEX_DB", "customer_index.db")
+# Seconds between reads of rows appended since the last refresh
+CUSTOMER_INDEX_REFRESH_INTERVAL = float(os.getenv("CUSTOMER_INDEX_REFRESH_INTERVAL", "30"))
+# Seconds between full re-reads, which pick up edits to existing rows
+CUSTOMER_INDEX_RESYNC_INTERVAL = float(os.getenv("CUSTOMER_INDEX_RESYNC_INTERVAL", "900"))
+CUSTOMER_INDEX_PAGE_SIZE = 5000
+# How often a process waiting for the first snapshot looks for it (seconds)
+CUSTOMER_INDEX_POLL_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    row INTEGER PRIMARY KEY,
+    phone_number TEXT,
+    name_key TEXT NOT NULL,
+    customer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS customers_number ON customers (phone_number, row);
+CREATE INDEX IF NOT EXISTS customers_name ON customers (name_key, row);
+CREATE TABLE IF NOT EXISTS state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    next_row INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    loaded_at REAL NOT NULL,
+    refreshed_at REAL NOT NULL,
+    resync_at REAL NOT NULL
+);
+"""
+
+
+def _name_key(name: str) -> str:
+    return " ".join(str(name).casefold().split())
+
+
+class CustomerIndex:
+    """Index of the customer sheet by phone number and by name, shared through CUSTOMER_INDEX_DB.
+
+    Job processes handle one call each, so the sheet is not read per
+    process: the snapshot lives in a SQLite database that every process on
+    the host reads, and a process running the refresher brings it up to date
+    for all of them. Only rows appended to the sheet are read every
+    CUSTOMER_INDEX_REFRESH_INTERVAL seconds, with a full re-read every
+    CUSTOMER_INDEX_RESYNC_INTERVAL seconds, or sooner once `request_resync()`
+    is called; whichever process takes the lock on the database first does
+    the read, the others skip it. Lookups are indexed reads of the local
+    database and never touch the API. `generation` goes up whenever rows are
+    (re)read.
+    """
+
+    def __init__(self, path: str = CUSTOMER_INDEX_DB, page_size: int = CUSTOMER_INDEX_PAGE_SIZE):
+        self.path = path
+        self.page_size = page_size
+        self.generation = 0
+        self._conn = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="customer-index")
+        self._ready = asyncio.Event()
+        self._resync = asyncio.Event()
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    # -------- database thread --------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path or ":memory:", timeout=30, isolation_level=None,
+                                         check_same_thread=False)
+            if self.path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _read_state(self) -> dict:
+        row = self._connect().execute(
+            "SELECT next_row, generation, loaded_at, refreshed_at, resync_at FROM state WHERE id = 1").fetchone()
+        if row is None:
+            return None
+        return dict(zip(("next_row", "generation", "loaded_at", "refreshed_at", "resync_at"), row))
+
+    def _mark_resync(self, at: float):
+        self._connect().execute("UPDATE state SET resync_at = ? WHERE id = 1", (at,))
+
+    def _store(self, customers: list, next_row: int, full: bool, started: float) -> dict:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._read_state() or {"generation": 0, "loaded_at": 0.0, "resync_at": 0.0}
+            if full:
+                conn.execute("DELETE FROM customers")
+            conn.executemany(
+                "INSERT OR REPLACE INTO customers (row, phone_number, name_key, customer) VALUES (?, ?, ?, ?)",
+                [(c["row"], c["phone_number"], _name_key(c["name"]), json.dumps(c)) for c in customers])
+            state.update(
+                next_row=next_row,
+                generation=state["generation"] + 1 if full or customers else state["generation"],
+                # A resync asked for after the read started is still owed
+                loaded_at=started if full else state["loaded_at"],
+                refreshed_at=started,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO state (id, next_row, generation, loaded_at, refreshed_at, resync_at) "
+                "VALUES (1, :next_row, :generation, :loaded_at, :refreshed_at, :resync_at)", state)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return state
+
+    def _find(self, phone_number: str, name_key: str) -> list:
+        conn = self._connect()
+        if phone_number:
+            rows = conn.execute("SELECT customer FROM customers WHERE phone_number = ? ORDER BY row LIMIT 1",
+                                (phone_number,)).fetchall()
+        else:
+            rows = conn.execute("SELECT customer FROM customers WHERE name_key = ? ORDER BY row",
+                                (name_key,)).fetchall()
+        return [json.loads(customer) for customer, in rows]
+
+    def _update(self, row: int, field: str, value: str):
+        conn = self._connect()
+        found = conn.execute("SELECT customer FROM customers WHERE row = ?", (row,)).fetchone()
+        if found is None:
+            return
+        customer = {**json.loads(found[0]), field: value}
+        conn.execute("UPDATE customers SET customer = ?, name_key = ? WHERE row = ?",
+                     (json.dumps(customer), _name_key(customer["name"]), row))
+
+    def _db(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # -------- refresh --------
+
+    def _due(self, state: dict, now: float) -> bool:
+        return (state is None or state["resync_at"] > state["loaded_at"]
+                or now - state["loaded_at"] >= CUSTOMER_INDEX_RESYNC_INTERVAL
+                or now - state["refreshed_at"] >= CUSTOMER_INDEX_REFRESH_INTERVAL)
+
+    def _try_lock(self):
+        """The refresh lock on the database, or None if another process holds it"""
+        if not self.path:
+            return open(os.devnull)
+        lock = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def _seen(self, state: dict):
+        if state is not None:
+            self.generation = state["generation"]
+            self._ready.set()
+
+    async def refresh(self):
+        """Bring the shared snapshot up to date if it is due and no other process is already at it"""
+        if self._resync.is_set():
+            self._resync.clear()
+            await self._db(self._mark_resync, time.time())
+        state = await self._db(self._read_state)
+        self._seen(state)
+        if not self._due(state, time.time()):
+            return
+        lock = self._try_lock()
+        if lock is None:
+            return
+        try:
+            # Another process may have refreshed it while we looked
+            state = await self._db(self._read_state)
+            started = time.time()
+            if not self._due(state, started):
+                self._seen(state)
+                return
+            sheets = await load_sheets_client()
+            if not sheets:
+                raise RuntimeError("Failed to initialize Google Sheets service")
+            full = state is None or state["resync_at"] > state["loaded_at"] or \
+                started - state["loaded_at"] >= CUSTOMER_INDEX_RESYNC_INTERVAL
+            next_row = FIRST_DATA_ROW if full else state["next_row"]
+            customers = []
+            async for page in iter_customer_pages(sheets, start_row=next_row, page_size=self.page_size):
+                for customer in page:
+                    try:
+                        customer["phone_number"] = normalise_number(customer["number"])
+                    except ValueError:
+                        customer["phone_number"] = None
+                    customers.append(customer)
+                    next_row = max(next_row, customer["row"] + 1)
+            state = await self._db(self._store, customers, next_row, full, started)
+            self._seen(state)
+            if full:
+                logger.info(f"Customer index loaded: {len(customers)} rows")
+            elif customers:
+                logger.info(f"Customer index added {len(customers)} new rows")
+        finally:
+            lock.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing customer index: {e}")
+            # Until there is a snapshot, look again soon in case another process is loading it
+            interval = CUSTOMER_INDEX_REFRESH_INTERVAL if self.ready else CUSTOMER_INDEX_POLL_INTERVAL
+            try:
+                await asyncio.wait_for(self._resync.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def request_resync(self):
+        """Re-read the whole sheet soon, e.g. because rows were found to have moved"""
+        if not self._resync.is_set():
+            logger.info("Customer index resync requested")
+            self._resync.set()
+        self.start()
+
+    def start(self):
+        """Keep the shared snapshot fresh from this process, loading it first if there is none"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_ready(self, timeout: float = None) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # -------- lookups --------
+
+    async def lookup(self, phone_number: str = None, name: str = None) -> list:
+        """Customers matching a phone number (any format) and/or a name"""
+        if phone_number:
+            try:
+                phone_number = normalise_number(phone_number)
+            except ValueError:
+                return []
+            matches = await self._db(self._find, phone_number, None)
+            if matches and name and _name_key(name) != _name_key(matches[0]["name"]):
+                return []
+            return matches
+        if name:
+            return await self._db(self._find, None, _name_key(name))
+        return []
+
+    async def row_of(self, phone_number: str) -> int:
+        """Row of the first customer with this (normalised) phone number, or None"""
+        matches = await self._db(self._find, phone_number, None)
+        return matches[0]["row"] if matches else None
+
+    async def update_field(self, row: int, field: str, value: str):
+        """Keep the snapshot in step with a write made by this process"""
+        await self._db(self._update, row, field, value)
+
+
+_index = None
+
+
+def get_customer_index() -> CustomerIndex:
+    """Returns the process-wide handle on the shared CustomerIndex"""
+    global _index
+    if _index is None:
+        _index = CustomerIndex()
+    return _index
@@ -0,0 +1,104 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+from sheets_quota import BULK
+
+logger = logging.getLogger(__name__)
+
+SHEET_NAME = os.getenv("SHEET_NAME", "Sheet1")
+FIRST_DATA_ROW = 2  # Row 1 holds the headers
+SHEET_PAGE_SIZE = int(os.getenv("SHEET_PAGE_SIZE", "500"))
+
+
+def row_hash(customer: dict) -> str:
+    """Short hash of a customer row's contents, to tell whether it changed since it was read"""
+    content = "\x1f".join(str(customer.get(field, "")) for field in ("index", "name", "number", "address"))
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def parse_customer_row(row: list, row_number: int):
+    """Validate and normalise one sheet row (columns A:D).
+
+    Returns the customer dict, or None if a required field is missing.
+    """
+    fields = [str(value).strip() for value in row[:4]]
+    if len(fields) < 4 or not fields[1] or not fields[2]:
+        return None
+    customer = {
+        "index": fields[0],
+        "name": " ".join(fields[1].split()),
+        "number": fields[2],
+        "address": fields[3],
+        "row": row_number,
+    }
+    customer["row_hash"] = row_hash(customer)
+    return customer
+
+
+def _parse_window(values: list, first_row: int) -> tuple[list, list]:
+    """Split the values of consecutive rows into customers and skipped row numbers"""
+    page, skipped = [], []
+    for offset, row in enumerate(values):
+        customer = parse_customer_row(row, first_row + offset)
+        if customer is None:
+            if row:
+                logger.warning(f"Skipping row {first_row + offset} due to missing fields: {row}")
+            skipped.append(first_row + offset)
+            continue
+        page.append(customer)
+    return page, skipped
+
+
+async def read_customer_window(sheets, first_row: int, page_size: int = SHEET_PAGE_SIZE, priority: str = BULK):
+    """Read the rows first_row .. first_row + page_size - 1 only.
+
+    Returns (customers, skipped row numbers), or None if the window holds no data.
+    """
+    values = await sheets.get_values(f"{SHEET_NAME}!A{first_row}:D{first_row + page_size - 1}", priority=priority)
+    if not values:
+        return None
+    return _parse_window(values, first_row)
+
+
+async def iter_customer_pages(sheets, start_row: int = FIRST_DATA_ROW,
+                              page_size: int = SHEET_PAGE_SIZE, on_skip=None, priority: str = BULK):
+    """Stream customers from the sheet one window of rows at a time.
+
+    Yields a list of customers per window. The next window is fetched while
+    the current one is being consumed, so the consumer sets the pace: when it
+    stops pulling, reading stops too. Rows that fail validation are logged
+    and passed to `on_skip(row_number)` once the window has been consumed.
+    Iteration ends at the first window with no data.
+    """
+    async def fetch(first_row):
+        return await sheets.get_values(f"{SHEET_NAME}!A{first_row}:D{first_row + page_size - 1}", priority=priority)
+
+    row_number = start_row
+    next_page = asyncio.create_task(fetch(row_number))
+    try:
+        while True:
+            values = await next_page
+            if not values:
+                return
+            next_page = asyncio.create_task(fetch(row_number + page_size))
+            page, skipped = _parse_window(values, row_number)
+            yield page
+            # Reported only after the consumer has taken the page, so progress
+            # tracking never moves past rows of this page that are still pending
+            if on_skip:
+                for skipped_row in skipped:
+                    on_skip(skipped_row)
+            row_number += page_size
+    finally:
+        next_page.cancel()
+
+
+async def iter_customers(sheets, start_row: int = FIRST_DATA_ROW,
+                         page_size: int = SHEET_PAGE_SIZE, on_skip=None):
+    """Like iter_customer_pages, but yields one customer at a time"""
+    async for page in iter_customer_pages(sheets, start_row, page_size, on_skip):
+        for customer in page:
+            yield customer
+
@@ -1,11 +1,21 @@
 import os
+import sys
+import time
+import signal
+import contextlib
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 import asyncio
 import json
+from collections import Counter
 from livekit import api
 import logging
+from sheets_client import SPREADSHEET_ID, load_sheets_client
+from customer_source import iter_customer_pages, read_customer_window
+from campaign_store import CAMPAIGN_DB_FILE, FAILED, RETRY, SKIPPED, CampaignStore
+from row_leases import DISPATCH_COORDINATOR_DB, RowLeases
+from phone_numbers import format_phone_number, normalise_customers
+from pacing import (ANSWERED, AGENT_TIMEOUT, DUPLICATE, ERROR, RETRYABLE_OUTCOMES,
+                    AdaptivePacer, CallingWindow, RetryQueue, classify_outcome)
 
 # Set up logging with more detail
 logging.basicConfig(
@@ -24,63 +34,101 @@ logger.info(f"API_KEY set: {bool(os.getenv('LIVEKIT_API_KEY'))}")
 logger.info(f"API_SECRET set: {bool(os.getenv('LIVEKIT_API_SECRET'))}")
 logger.info(f"SIP_OUTBOUND_TRUNK_ID set: {bool(os.getenv('SIP_OUTBOUND_TRUNK_ID'))}")
 
-SPREADSHEET_ID = "1QBTDOqKoPFuHFMordHVgNRt3S20zVnQgPigzk1kIzdQ"
 LIVEKIT_URL = os.getenv("LIVEKIT_URL")
 API_KEY = os.getenv("LIVEKIT_API_KEY")
 API_SECRET = os.getenv("LIVEKIT_API_SECRET")
 
-def format_phone_number(number: str) -> str:
-    """Format phone number to E.164 format"""
-    # Remove any spaces, dashes, or other characters
-    cleaned = ''.join(filter(str.isdigit, str(number)))
-    
-    # Handle empty or invalid numbers
-    if not cleaned:
-        raise ValueError("Phone number cannot be empty")
-        
-    # Remove leading zeros
-    cleaned = cleaned.lstrip('0')
-    
-    # If number starts with country code (91), use it
-    if cleaned.startswith('91') and len(cleaned) > 10:
-        base_number = cleaned
-    # If it's a 10-digit number, add country code
-    elif len(cleaned) == 10:
-        base_number = '91' + cleaned
-    else:
-        raise ValueError(f"Invalid phone number format: {number}. Must be 10 digits or include 91 prefix.")
-    
-    # Add the + prefix
-    return f"+{base_number}"
-
-def get_sheets_service():
-    """Gets Google Sheets service instance"""
+# Dispatcher tuning
+MAX_CONCURRENT_CALLS = int(os.getenv("MAX_CONCURRENT_CALLS", "10"))
+CALLS_PER_SECOND = float(os.getenv("CALLS_PER_SECOND", "1"))
+ROOM_POLL_INTERVAL = float(os.getenv("ROOM_POLL_INTERVAL", "5"))
+MAX_CALL_DURATION = float(os.getenv("MAX_CALL_DURATION", "900"))
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "30"))
+# Longest wait for the dispatched agent to join the room before the call is abandoned
+AGENT_READY_TIMEOUT = float(os.getenv("AGENT_READY_TIMEOUT", "15"))
+# After SIGTERM, how long to keep tracking calls already placed before exiting
+DISPATCH_DRAIN_TIMEOUT = float(os.getenv("DISPATCH_DRAIN_TIMEOUT", "120"))
+# Model routes and response-time budgets for this campaign's calls (JSON, see model_routing.py)
+CAMPAIGN_ROUTING = json.loads(os.getenv("CAMPAIGN_ROUTING") or "null")
+
+async def wait_for_agent(lk_api: api.LiveKitAPI, room_name: str,
+                         timeout: float = AGENT_READY_TIMEOUT) -> bool:
+    """Wait until an agent participant has joined the room. Returns False on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.05
+    while True:
+        try:
+            result = await lk_api.room.list_participants(api.ListParticipantsRequest(room=room_name))
+            if any(p.kind == api.ParticipantInfo.Kind.AGENT for p in result.participants):
+                return True
+        except Exception as e:
+            # The room may not exist until the agent or the SIP participant creates it
+            logger.debug(f"Could not list participants of {room_name}: {e}")
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+async def _delete_room(lk_api: api.LiveKitAPI, room_name: str):
     try:
-        creds = Credentials.from_authorized_user_file("token.json", ["https://www.googleapis.com/auth/spreadsheets"])
-        service = build("sheets", "v4", credentials=creds)
-        return service.spreadsheets()
+        await lk_api.room.delete_room(api.DeleteRoomRequest(room=room_name))
     except Exception as e:
-        logger.error(f"Error getting sheets service: {e}")
-        return None
+        logger.warning(f"Could not delete room {room_name}: {e}")
+
+async def dispatch_call(lk_api: api.LiveKitAPI, customer: dict, report: dict = None):
+    """Dispatch a single call using LiveKit's recommended method
+
+    The agent dispatch is created first. Dialing then starts right away and
+    runs alongside the wait for the agent to join the room, since the phone
+    rings for longer than the agent takes to join. The call only counts as
+    placed once it is answered and the agent is in the room; otherwise the
+    room is deleted so neither side is left waiting.
+
+    Args:
+        report: optional dict that receives the duration of each setup step, in ms,
+            and the call's `outcome` (see pacing.py)
+
+    Returns the room name of the answered call, or None if the call failed.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    report = report if report is not None else {}
+    report["outcome"] = ERROR
+    dispatched = False
+    room_name = None
+    agent_task = None
+
+    def mark(step):
+        report[step] = round((loop.time() - started) * 1000)
 
-async def dispatch_call(lk_api: api.LiveKitAPI, customer: dict):
-    """Dispatch a single call using LiveKit's recommended method"""
     try:
         logger.info(f"Starting dispatch for customer: {customer}")
+
+        # Get SIP trunk ID from environment
+        sip_trunk_id = os.getenv('SIP_OUTBOUND_TRUNK_ID')
+        if not sip_trunk_id:
+            logger.error("SIP_OUTBOUND_TRUNK_ID not found in environment")
+            raise ValueError("SIP_OUTBOUND_TRUNK_ID not found in environment")
         
-        # Format the phone number
-        formatted_number = format_phone_number(customer['number'])
+        # Use the number normalised before dialing, if the batch pass already did it
+        formatted_number = customer.get('phone_number') or format_phone_number(customer['number'])
         logger.info(f"Formatted phone number: {formatted_number}")
         
         # Create a unique room name
-        room_name = f"call_{formatted_number}_{int(asyncio.get_event_loop().time())}"
+        room_name = f"call_{formatted_number}_{int(loop.time())}"
+        report["room_name"] = room_name
         logger.info(f"Created room name: {room_name}")
 
         # Prepare metadata for the agent
-        metadata = json.dumps({
+        metadata = {
             "phone_number": formatted_number,
             "customer_data": customer
-        })
+        }
+        if CAMPAIGN_ROUTING:
+            metadata["routing"] = CAMPAIGN_ROUTING
+        metadata = json.dumps(metadata)
         logger.info("Prepared metadata for agent")
 
         # Create agent dispatch first
@@ -93,22 +141,22 @@ async def dispatch_call(lk_api: api.LiveKitAPI, customer: dict):
                     metadata=metadata
                 )
             )
+            dispatched = True
+            mark("dispatch_ms")
             logger.info(f"Successfully created agent dispatch: {dispatch}")
         except Exception as e:
             logger.error(f"Failed to create agent dispatch: {e}")
-            return False
+            report["outcome"] = classify_outcome(e)
+            return None
 
-        # Wait briefly for dispatch to be ready
-        await asyncio.sleep(1)
-
-        # Get SIP trunk ID from environment
-        sip_trunk_id = os.getenv('SIP_OUTBOUND_TRUNK_ID')
-        if not sip_trunk_id:
-            logger.error("SIP_OUTBOUND_TRUNK_ID not found in environment")
-            raise ValueError("SIP_OUTBOUND_TRUNK_ID not found in environment")
+        async def agent_ready():
+            ready = await wait_for_agent(lk_api, room_name)
+            mark("agent_ready_ms")
+            return ready
 
-        # Create SIP participant to initiate the call
+        # Create SIP participant to initiate the call while the agent joins
         logger.info(f"Creating SIP participant with trunk ID: {sip_trunk_id}")
+        agent_task = asyncio.create_task(agent_ready())
         try:
             participant = await lk_api.sip.create_sip_participant(api.CreateSIPParticipantRequest(
                 room_name=room_name,
@@ -117,73 +165,487 @@ async def dispatch_call(lk_api: api.LiveKitAPI, customer: dict):
                 participant_identity=formatted_number,
                 wait_until_answered=True
             ))
+            mark("answered_ms")
             logger.info(f"Successfully created SIP participant: {participant}")
         except Exception as e:
-            logger.error(f"Failed to create SIP participant: {e}")
-            return False
+            agent_task.cancel()
+            report["outcome"] = classify_outcome(e)
+            logger.error(f"Failed to create SIP participant ({report['outcome']}): {e}")
+            await _delete_room(lk_api, room_name)
+            return None
+
+        if not await agent_task:
+            logger.error(f"Agent did not join room {room_name} within {AGENT_READY_TIMEOUT}s, hanging up")
+            report["outcome"] = AGENT_TIMEOUT
+            await _delete_room(lk_api, room_name)
+            return None
 
-        logger.info(f"Successfully dispatched call to {formatted_number}")
-        return True
+        mark("total_ms")
+        report["outcome"] = ANSWERED
+        logger.info(f"Successfully dispatched call to {formatted_number} (setup: {report})")
+        return room_name
 
+    except asyncio.CancelledError:
+        if dispatched:
+            await _delete_room(lk_api, room_name)
+        raise
     except Exception as e:
         logger.error(f"Error dispatching call to {customer.get('number')}: {str(e)}")
-        return False
+        if dispatched:
+            await _delete_room(lk_api, room_name)
+        return None
+    finally:
+        # Stop waiting for the agent on every way out, including a drain or shutdown cancelling this call
+        if agent_task is not None and not agent_task.done():
+            agent_task.cancel()
+            await asyncio.gather(agent_task, return_exceptions=True)
+
+async def wait_for_room_end(lk_api: api.LiveKitAPI, room_name: str,
+                            poll_interval: float = ROOM_POLL_INTERVAL,
+                            max_duration: float = MAX_CALL_DURATION):
+    """Wait until a call's room has been closed, or max_duration has passed"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_duration
+    while loop.time() < deadline:
+        await asyncio.sleep(poll_interval)
+        try:
+            result = await lk_api.room.list_rooms(api.ListRoomsRequest(names=[room_name]))
+        except Exception as e:
+            logger.warning(f"Could not check status of room {room_name}: {e}")
+            continue
+        if not result.rooms:
+            return
+    logger.warning(f"Room {room_name} still open after {max_duration}s, releasing its slot")
+
+class CallDispatcher:
+    """Dials queued customers with a pool of workers.
+
+    A worker's slot is held until the call's room has closed, so a new call
+    starts as soon as a previous one ends. How many calls run at once (up to
+    `max_concurrent`) and how fast they start (up to `calls_per_second` for
+    each SIP outbound trunk) follow the outcomes of recent calls, see
+    pacing.AdaptivePacer. Calls are only placed inside the calling window.
+    Customers who did not answer, were busy or hit a transient error go to
+    the retry queue until they run out of attempts. The queue holds at most
+    `queue_size` customers, so a streaming source is only read as fast as
+    calls are placed. `on_call_done(customer, success)` is called once each
+    customer has been handled for good. With a `store`, every attempt and
+    its outcome are recorded there, and a customer is committed as being
+    dialed before the call is placed. With `leases`, each number is claimed
+    from the nodes' shared coordinator before it is dialed, and customers
+    whose number another node or row has claimed are skipped.
+
+    `drain()` stops the dispatcher gracefully: no new calls are placed, and
+    `run()` returns once the calls already placed have ended, or after
+    `drain_timeout` seconds. Customers not dialed yet stay queued in the
+    store for the next run.
+    """
+
+    def __init__(self, lk_api: api.LiveKitAPI,
+                 max_concurrent: int = MAX_CONCURRENT_CALLS,
+                 calls_per_second: float = CALLS_PER_SECOND,
+                 room_poll_interval: float = ROOM_POLL_INTERVAL,
+                 max_call_duration: float = MAX_CALL_DURATION,
+                 stats_interval: float = STATS_INTERVAL,
+                 queue_size: int = None,
+                 on_call_done=None,
+                 window: CallingWindow = None,
+                 retries: RetryQueue = None,
+                 store: CampaignStore = None,
+                 leases: RowLeases = None,
+                 drain_timeout: float = DISPATCH_DRAIN_TIMEOUT):
+        self.lk_api = lk_api
+        self.max_concurrent = max_concurrent
+        self.calls_per_second = calls_per_second
+        self.room_poll_interval = room_poll_interval
+        self.max_call_duration = max_call_duration
+        self.stats_interval = stats_interval
+        self.queue: asyncio.Queue = asyncio.Queue(
+            queue_size if queue_size is not None else max_concurrent * 2
+        )
+        self.on_call_done = on_call_done
+        self.window = window or CallingWindow()
+        self.retries = retries or RetryQueue(self.window)
+        self.store = store
+        self.leases = leases
+        self.drain_timeout = drain_timeout
+        self._draining = asyncio.Event()
+        # Workers past the point of no return for their current customer: dialing or in a call
+        self._committed: set[asyncio.Task] = set()
+        self._trunk_pacers: dict[str, AdaptivePacer] = {}
+        self._slot_freed = asyncio.Condition()
+        # Customers submitted but not yet handled for good, including pending retries
+        self._unfinished = 0
+        self._all_done = asyncio.Event()
+        self._all_done.set()
+
+        self.in_flight = 0
+        self.dialed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.outcomes = Counter()
+        self._started_at = None
+
+    async def submit(self, customer: dict, retry_in: float = None):
+        """Add a customer to the dial queue, waiting while it is full
+
+        Args:
+            retry_in: put the customer in the retry queue instead, due in this many seconds
+        """
+        self._unfinished += 1
+        self._all_done.clear()
+        if retry_in is not None and self.retries.schedule(customer, retry_in) is not None:
+            return
+        await self.queue.put(customer)
+
+    @property
+    def draining(self) -> bool:
+        return self._draining.is_set()
+
+    def drain(self):
+        """Stop placing calls; run() returns once the calls in progress have ended"""
+        if not self._draining.is_set():
+            logger.info("Draining: no new calls will be placed")
+            self._draining.set()
 
-async def dispatch_calls():
-    """Main function to dispatch calls"""
+    def _trunk_pacer(self) -> AdaptivePacer:
+        trunk_id = os.getenv('SIP_OUTBOUND_TRUNK_ID') or ""
+        pacer = self._trunk_pacers.get(trunk_id)
+        if pacer is None:
+            pacer = self._trunk_pacers[trunk_id] = AdaptivePacer(self.calls_per_second, self.max_concurrent)
+        return pacer
+
+    def stats(self) -> dict:
+        """Snapshot of dispatcher progress"""
+        elapsed = asyncio.get_running_loop().time() - self._started_at if self._started_at else 0.0
+        pacer = self._trunk_pacer()
+        return {
+            "queued": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "dialed": self.dialed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "awaiting_retry": len(self.retries),
+            "outcomes": dict(self.outcomes),
+            "calls_per_second_limit": pacer.rate,
+            "concurrency_limit": pacer.concurrency,
+            "calls_per_minute": self.dialed * 60 / elapsed if elapsed > 0 else 0.0,
+        }
+
+    async def _report_stats(self):
+        last_dialed = 0
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.stats()
+            recent = (stats["dialed"] - last_dialed) * 60 / self.stats_interval
+            last_dialed = stats["dialed"]
+            logger.info(
+                f"Dispatcher: {stats['queued']} queued, {stats['in_flight']} in flight, "
+                f"{stats['succeeded']} answered, {stats['failed']} failed, "
+                f"{stats['awaiting_retry']} awaiting retry, "
+                f"{recent:.1f} calls/min now, {stats['calls_per_minute']:.1f} calls/min overall, "
+                f"limits {stats['calls_per_second_limit']:.2f} calls/sec and {stats['concurrency_limit']} concurrent"
+            )
+
+    async def _acquire_slot(self, pacer: AdaptivePacer):
+        async with self._slot_freed:
+            await self._slot_freed.wait_for(lambda: self.in_flight < pacer.concurrency)
+            self.in_flight += 1
+
+    async def _release_slot(self):
+        async with self._slot_freed:
+            self.in_flight -= 1
+            self._slot_freed.notify_all()
+
+    async def _handle(self, customer: dict) -> str:
+        """Place one call attempt; returns its outcome"""
+        await self.window.wait_until_open()
+        pacer = self._trunk_pacer()
+        await self._acquire_slot(pacer)
+        try:
+            await pacer.acquire()
+            # From here on the attempt is seen through, even when draining
+            self._committed.add(asyncio.current_task())
+            # Claimed as late as possible, so a node that dies leaves few claimed but undialed numbers
+            if self.leases and not await self.leases.claim_number(customer):
+                return DUPLICATE
+            self.dialed += 1
+            customer["attempts"] = customer.get("attempts", 0) + 1
+            if self.store:
+                await self.store.mark_dialing(customer)
+            if self.leases:
+                await self.leases.mark_dialed(customer)
+            report = {}
+            room_name = await dispatch_call(self.lk_api, customer, report)
+            outcome = report["outcome"]
+            if self.store:
+                self.store.record_attempt(customer, report)
+            pacer.record(outcome)
+            self.outcomes[outcome] += 1
+            if not room_name:
+                self.failed += 1
+                return outcome
+            self.succeeded += 1
+            await wait_for_room_end(self.lk_api, room_name,
+                                    self.room_poll_interval, self.max_call_duration)
+            if self.store:
+                self.store.mark_ended(customer)
+            return outcome
+        finally:
+            await self._release_slot()
+
+    async def _finish(self, customer: dict, outcome: str):
+        if self.store:
+            self.store.set_status(customer, {ANSWERED: ANSWERED, DUPLICATE: SKIPPED}.get(outcome, FAILED))
+        if self.leases:
+            await self.leases.row_done(customer["row"])
+        if self.on_call_done:
+            self.on_call_done(customer, outcome == ANSWERED)
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._all_done.set()
+
+    async def _process(self, customer: dict):
+        outcome = ERROR
+        try:
+            outcome = await self._handle(customer)
+        except Exception as e:
+            logger.error(f"Unexpected error handling customer {customer.get('name')}: {e}")
+        finally:
+            self.queue.task_done()
+        retry_in = self.retries.schedule(customer) if outcome in RETRYABLE_OUTCOMES else None
+        if retry_in is not None:
+            self.retried += 1
+            if self.store:
+                self.store.set_status(customer, RETRY, retry_at=time.time() + retry_in)
+            logger.info(f"Call to {customer.get('name')} ended with {outcome}, "
+                        f"will retry (attempt {customer.get('attempts', 1) + 1} of {self.retries.max_attempts})")
+            return
+        if outcome not in (ANSWERED, DUPLICATE):
+            logger.warning(f"Call failed for customer {customer.get('name')} ({outcome}), giving up")
+        await self._finish(customer, outcome)
+
+    async def _worker(self):
+        while not self._draining.is_set():
+            customer = await self.queue.get()
+            try:
+                await self._process(customer)
+            finally:
+                self._committed.discard(asyncio.current_task())
+
+    async def _requeue_retries(self):
+        while True:
+            customer = await self.retries.next_due()
+            await self.queue.put(customer)
+
+    async def _feed(self, customers):
+        async for customer in customers:
+            # Customers resumed from the campaign store may still be waiting for a retry
+            retry_at = customer.pop("retry_at", None)
+            await self.submit(customer, None if retry_at is None else max(0.0, retry_at - time.time()))
+
+    async def _complete(self, customers):
+        if customers is not None:
+            await self._feed(customers)
+        await self._all_done.wait()
+
+    async def _drain_calls(self, workers: list):
+        # Workers still waiting for the calling window, a slot or the pacer place no call
+        committed = [task for task in workers if task in self._committed]
+        for task in workers:
+            if task not in self._committed:
+                task.cancel()
+        logger.info(f"Draining: waiting up to {self.drain_timeout:.0f}s for {len(committed)} calls in progress")
+        if committed:
+            _, pending = await asyncio.wait(committed, timeout=self.drain_timeout)
+            if pending:
+                logger.warning(f"{len(pending)} calls still in progress after {self.drain_timeout:.0f}s, "
+                               f"no longer tracking them")
+
+    async def run(self, customers=None):
+        """Dial every queued customer and return once all calls and retries have ended, or once drained
+
+        Args:
+            customers: optional async iterable of customers to feed into the queue
+        """
+        self._started_at = asyncio.get_running_loop().time()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)]
+        helpers = [asyncio.create_task(self._report_stats()), asyncio.create_task(self._requeue_retries())]
+        complete = asyncio.create_task(self._complete(customers))
+        draining = asyncio.create_task(self._draining.wait())
+        try:
+            await asyncio.wait({complete, draining}, return_when=asyncio.FIRST_COMPLETED)
+            if complete.done():
+                complete.result()
+            else:
+                complete.cancel()
+                await self._drain_calls(workers)
+        finally:
+            for task in workers + helpers + [complete, draining]:
+                task.cancel()
+            await asyncio.gather(*workers, *helpers, complete, draining, return_exceptions=True)
+        stats = self.stats()
+        logger.info(f"Dispatcher finished: {stats['succeeded']} answered, {stats['failed']} failed attempts, "
+                    f"{stats['retried']} retries, outcomes {stats['outcomes']}")
+
+def _skipped_rows(batch, known: dict) -> tuple[list, list]:
+    """Split a normalised batch into customers to dial and (row, number, reason) of rows that will not be"""
+    valid, skipped = [], []
+    for customer in batch.valid:
+        first_row = known.get(customer["phone_number"], customer["row"])
+        if first_row != customer["row"]:
+            logger.warning(f"Skipping row {customer['row']}: number already dialed for row {first_row}")
+            skipped.append((customer["row"], customer["phone_number"], f"duplicate of row {first_row}"))
+            continue
+        valid.append(customer)
+    for customer, reason in batch.invalid:
+        logger.warning(f"Skipping row {customer['row']}: {reason}")
+        skipped.append((customer["row"], None, reason))
+    for customer, first_row in batch.duplicates:
+        logger.warning(f"Skipping row {customer['row']}: number already dialed for row {first_row}")
+        skipped.append((customer["row"], None, f"duplicate of row {first_row}"))
+    return valid, skipped
+
+async def sheet_customers(sheet, store: CampaignStore, pending: list):
+    """Customers left over from the previous run, then the sheet from where that run stopped"""
+    # Normalised number -> sheet rows, across the whole run
+    number_index: dict[str, list] = {}
+    for customer in pending:
+        number_index.setdefault(customer["phone_number"], []).append(customer["row"])
+        yield customer
+
+    # Rows without a name or number, recorded along with the next page
+    unrecorded = []
+
+    def on_skip(row_number):
+        unrecorded.append((row_number, None, "missing name or number"))
+
+    async for page in iter_customer_pages(sheet, start_row=store.next_row, on_skip=on_skip):
+        batch = normalise_customers(page, number_index)
+        # Numbers dialed by earlier runs are not in number_index
+        known = await store.known_numbers([c["phone_number"] for c in batch.valid])
+        valid, skipped = _skipped_rows(batch, known)
+        skipped, unrecorded[:] = unrecorded + skipped, []
+        rows = [c["row"] for c in page] + [row for row, _, _ in skipped]
+        store.add_rows(valid, skipped, next_row=max(rows) + 1 if rows else None)
+        for customer in valid:
+            yield customer
+    store.add_rows(skipped=unrecorded)
+
+async def leased_customers(sheet, store: CampaignStore, leases: RowLeases):
+    """Customers from chunks of rows leased from the coordinator, shared with other dispatcher nodes
+
+    Ends once every chunk of the sheet is done, including chunks held by
+    other nodes, so a node that outlives the others takes over their rows
+    if they die. Rows left over from this node's previous run are not
+    resumed from the local store: their chunks go back to the coordinator's
+    pool and are read again by whichever node leases them.
+    """
+    while True:
+        chunk = await leases.acquire_chunk()
+        if chunk is None:
+            if await leases.finished():
+                return
+            await asyncio.sleep(min(ROOM_POLL_INTERVAL, leases.lease_ttl / 3))
+            continue
+        window = await read_customer_window(sheet, chunk.first_row, chunk.size)
+        if window is None:
+            await leases.mark_end(chunk.first_row)
+            await leases.complete_chunk(chunk.first_row)
+            continue
+        page, missing = window
+        batch = normalise_customers(page)
+        unclaimed, skipped = _skipped_rows(batch, {})
+        skipped += [(row, None, "missing name or number") for row in missing]
+        # Leave out numbers already claimed for another row or by another node, e.g. by the node
+        # that held this chunk before it died, and numbers already dialed, even by this node before a restart
+        claimed = await leases.claimed_numbers([c["phone_number"] for c in unclaimed])
+        valid = []
+        for customer in unclaimed:
+            claim = claimed.get(customer["phone_number"])
+            if claim and claim != (customer["row"], leases.node_id, False):
+                row, node, dialed = claim
+                skipped.append((customer["row"], customer["phone_number"],
+                                f"{'dialed' if dialed else 'claimed'} for row {row} by node {node}"))
+                continue
+            valid.append(customer)
+        store.add_rows(valid, skipped)
+        await leases.track(chunk, [c["row"] for c in valid])
+        for customer in valid:
+            yield customer
+
+async def dispatch_calls(restart: bool = False, sheet=None, lk_api: api.LiveKitAPI = None):
+    """Main function to dispatch calls
+
+    Args:
+        restart: forget the recorded campaign state and start again from the first row
+        sheet: Sheets client to read customers from (defaults to the shared client)
+        lk_api: LiveKit API client to dial with (defaults to a new LiveKitAPI)
+    """
     try:
         # Get sheets service
         logger.info("Getting Google Sheets service...")
-        sheet = get_sheets_service()
+        if sheet is None:
+            sheet = await load_sheets_client()
         if not sheet:
             logger.error("Could not access Google Sheets")
             return
 
-        # Read customer data
-        logger.info(f"Reading customer data from sheet ID: {SPREADSHEET_ID}")
-        result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range="Sheet1!A2:D"  # Assuming data starts from row 2
-        ).execute()
-        
-        values = result.get("values", [])
-        if not values:
-            logger.info("No customer data found in sheet")
-            return
-        
-        logger.info(f"Found {len(values)} customers in sheet")
+        store = await CampaignStore(CAMPAIGN_DB_FILE, SPREADSHEET_ID).open()
+        if restart:
+            await store.reset()
+
+        leases = None
+        if DISPATCH_COORDINATOR_DB:
+            leases = await RowLeases(DISPATCH_COORDINATOR_DB, SPREADSHEET_ID).open()
+            customers = leased_customers(sheet, store, leases)
+        else:
+            # Customers read by an earlier run and not finished yet
+            pending = await store.pending()
+            if pending:
+                logger.info(f"Resuming {len(pending)} customers not finished by the previous run")
+            customers = sheet_customers(sheet, store, pending)
 
         # Create LiveKit API instance
-        logger.info("Creating LiveKit API instance...")
-        lk_api = api.LiveKitAPI()
+        if lk_api is None:
+            logger.info("Creating LiveKit API instance...")
+            lk_api = api.LiveKitAPI()
 
         try:
-            # Process customers one by one
-            for row in values:
-                if len(row) >= 4:  # Ensure row has all required fields
-                    customer = {
-                        "index": row[0],
-                        "name": row[1],
-                        "number": row[2],
-                        "address": row[3]
-                    }
-
-                    logger.info(f"Processing customer: {customer}")
-                    
-                    # Dispatch the call
-                    success = await dispatch_call(lk_api, customer)
-                    
-                    if success:
-                        # Wait between calls (60 seconds)
-                        logger.info("Call successful. Waiting 60 seconds before next call...")
-                        await asyncio.sleep(60)
-                    else:
-                        logger.warning(f"Call failed for customer {customer['name']}. Skipping to next customer...")
-                        await asyncio.sleep(5)  # Short delay before next attempt
+            dispatcher = CallDispatcher(lk_api, store=store, leases=leases)
+
+            if leases:
+                logger.info(f"Reading customer data from sheet ID: {SPREADSHEET_ID} in leased chunks "
+                            f"of {leases.chunk_size} rows")
+            else:
+                logger.info(f"Reading customer data from sheet ID: {SPREADSHEET_ID}, starting at row {store.next_row}")
+            logger.info(f"Dialing with up to {dispatcher.max_concurrent} concurrent calls, "
+                        f"{dispatcher.calls_per_second} calls/sec per trunk, "
+                        f"up to {dispatcher.retries.max_attempts} attempts per customer")
+
+            # First SIGTERM/SIGINT drains (e.g. for a deploy), a second one exits at once
+            main_task = asyncio.current_task()
+
+            def on_stop_signal():
+                if dispatcher.draining:
+                    logger.warning("Stopping without waiting for calls in progress")
+                    main_task.cancel()
                 else:
-                    logger.warning(f"Skipping row due to missing fields: {row}")
+                    dispatcher.drain()
+
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                with contextlib.suppress(NotImplementedError, RuntimeError):
+                    loop.add_signal_handler(sig, on_stop_signal)
+            await dispatcher.run(customers)
 
         finally:
+            logger.info(f"Campaign status: {await store.counts()}")
+            await store.aclose()
+            if leases:
+                await leases.aclose()
             # Properly close the API client
             logger.info("Closing LiveKit API client...")
             await lk_api.aclose()
@@ -193,4 +655,7 @@ async def dispatch_calls():
 
 if __name__ == "__main__":
     logger.info("Starting dispatch script...")
-    asyncio.run(dispatch_calls()) 
\ No newline at end of file
+    try:
+        asyncio.run(dispatch_calls(restart="--restart" in sys.argv[1:]))
+    except asyncio.CancelledError:
+        logger.warning("Dispatch stopped before the calls in progress ended")
@@ -7,6 +7,8 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from sheets_quota import READ, WRITE, execute
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]  # Full access to Sheets w-r-d
 
@@ -58,10 +60,11 @@ def read_sheet(sheet, spreadsheet_id, range_name):
         List of rows containing the values
     """
     try:
-        result = (
+        # Counts against the quota shared with the dispatcher and agents, waits out 429s
+        result = execute(
             sheet.values()
-            .get(spreadsheetId=spreadsheet_id, range=range_name)
-            .execute()
+            .get(spreadsheetId=spreadsheet_id, range=range_name),
+            READ,
         )
 
         values = result.get("values", [])
@@ -89,12 +92,12 @@ def update_sheet(sheet, spreadsheet_id, range_name, values):
         Number of cells updated
     """
     try:
-        request = sheet.values().update(
+        request = execute(sheet.values().update(
             spreadsheetId=spreadsheet_id,
             range=range_name,
             valueInputOption="USER_ENTERED",
             body={"values": values}
-        ).execute()
+        ), WRITE)
 
         return request.get("updatedCells")
     
@@ -114,10 +117,10 @@ def delete_rows(sheet, spreadsheet_id, range_name):
         Range that was cleared
     """
     try:
-        request = sheet.values().clear(
+        request = execute(sheet.values().clear(
             spreadsheetId=spreadsheet_id,
             range=range_name
-        ).execute()
+        ), WRITE)
         return request.get("clearedRange")
     except HttpError as err:
         print(f"Error deleting data: {err}")
@@ -0,0 +1,189 @@
+import os
+import asyncio
+import hashlib
+import logging
+import struct
+
+from livekit import rtc
+
+logger = logging.getLogger(__name__)
+
+# Synthesised audio of the fixed greeting parts is kept here across worker restarts
+GREETING_CACHE_DIR = os.getenv("GREETING_CACHE_DIR", "greeting_cache")
+# Bump when the TTS voice or greeting wording changes to invalidate cached audio
+GREETING_CACHE_VERSION = os.getenv("GREETING_CACHE_VERSION", "1")
+# Longest wait for the callee to pick up before the greeting is abandoned
+ANSWER_TIMEOUT = float(os.getenv("ANSWER_TIMEOUT", "60"))
+# How long after answer to wait for greeting audio before falling back to the LLM
+GREETING_READY_TIMEOUT = float(os.getenv("GREETING_READY_TIMEOUT", "1.5"))
+
+# The greeting is split so the parts shared by every call can be cached
+GREETING_INTRO = "Hello, this is an AI assistant calling to confirm your details."
+GREETING_DETAILS = "According to our records, your name is {name} and your address is {address}."
+GREETING_QUESTION = "Are these details correct?"
+
+_FRAME_MS = 20
+_HEADER = struct.Struct("<IH")  # sample rate, channels
+
+
+def render_greeting(customer_data: dict) -> list:
+    """Returns the greeting as (text, cacheable) segments for this customer"""
+    details = GREETING_DETAILS.format(
+        name=customer_data.get('name') or 'not on file',
+        address=customer_data.get('address') or 'not on file',
+    )
+    return [(GREETING_INTRO, True), (details, False), (GREETING_QUESTION, True)]
+
+
+class AudioCache:
+    """Content-addressed cache of synthesised speech.
+
+    Keys hash the text together with the TTS identity, so the same text
+    spoken by another voice or model is a separate entry. Entries live in
+    memory for the life of the process and, for shared segments, on disk as
+    raw 16-bit PCM so new worker processes start warm.
+    """
+
+    def __init__(self, cache_dir: str = GREETING_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._frames: dict[str, list] = {}
+        self._pending: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def key(tts, text: str) -> str:
+        identity = f"{GREETING_CACHE_VERSION}|{tts.label}|{getattr(tts, 'model', '')}|{tts.sample_rate}|{tts.num_channels}|{text}"
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def _load(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                sample_rate, channels = _HEADER.unpack(f.read(_HEADER.size))
+                data = f.read()
+        except (FileNotFoundError, struct.error):
+            return None
+        samples_per_frame = sample_rate * _FRAME_MS // 1000
+        frame_bytes = samples_per_frame * channels * 2
+        return [
+            rtc.AudioFrame(data[i:i + frame_bytes], sample_rate, channels,
+                           len(data[i:i + frame_bytes]) // (channels * 2))
+            for i in range(0, len(data), frame_bytes)
+        ]
+
+    def _store(self, key: str, frames: list):
+        if not frames:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_file = f"{self._path(key)}.tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(_HEADER.pack(frames[0].sample_rate, frames[0].num_channels))
+            for frame in frames:
+                f.write(bytes(frame.data))
+        os.replace(tmp_file, self._path(key))
+
+    async def _synthesize(self, tts, text: str, key: str, persist: bool) -> list:
+        loop = asyncio.get_running_loop()
+        if persist:
+            frames = await loop.run_in_executor(None, self._load, key)
+            if frames:
+                return frames
+        frames = await synthesize(tts, text)
+        if persist:
+            await loop.run_in_executor(None, self._store, key, frames)
+        return frames
+
+    async def get(self, tts, text: str, persist: bool = True) -> list:
+        """Returns the audio frames for `text`, synthesising them on a miss"""
+        key = self.key(tts, text)
+        if key in self._frames:
+            return self._frames[key]
+        # Calls starting at the same time share one synthesis
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.create_task(self._synthesize(tts, text, key, persist))
+        try:
+            frames = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._pending.pop(key, None)
+        if persist:
+            self._frames[key] = frames
+        return frames
+
+
+_cache = AudioCache()
+
+
+async def synthesize(tts, text: str) -> list:
+    """Synthesises `text` into a list of audio frames"""
+    frames = []
+    async with tts.synthesize(text) as stream:
+        async for audio in stream:
+            frames.append(audio.frame)
+    return frames
+
+
+class PreparedGreeting:
+    """Greeting audio synthesised in the background while the phone rings"""
+
+    def __init__(self, tts, customer_data: dict, cache: AudioCache = None):
+        cache = cache or _cache
+        segments = render_greeting(customer_data)
+        self.text = " ".join(text for text, _ in segments)
+        # Only shared segments are kept; per-customer audio is used once
+        self._tasks = [
+            asyncio.create_task(cache.get(tts, text, persist=cacheable))
+            for text, cacheable in segments
+        ]
+
+    async def wait(self, timeout: float = None) -> bool:
+        """Wait for all segments; returns False if synthesis failed or timed out"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*[asyncio.shield(t) for t in self._tasks]), timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"Greeting audio not ready: {e!r}")
+            return False
+
+    async def frames(self):
+        for task in self._tasks:
+            for frame in await task:
+                yield frame
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+async def wait_for_answer(room: rtc.Room, participant: rtc.RemoteParticipant,
+                          timeout: float = ANSWER_TIMEOUT) -> bool:
+    """Wait until an outbound SIP participant has picked up.
+
+    Returns False if they leave the room or do not answer within `timeout`.
+    Participants without a SIP call status (e.g. web callers) count as answered.
+    """
+    if participant.attributes.get("sip.callStatus", "active") == "active":
+        return True
+
+    answered = asyncio.get_running_loop().create_future()
+
+    def on_attributes_changed(changed: dict, p: rtc.Participant):
+        if p.identity == participant.identity and p.attributes.get("sip.callStatus") == "active":
+            if not answered.done():
+                answered.set_result(True)
+
+    def on_disconnected(p: rtc.RemoteParticipant):
+        if p.identity == participant.identity and not answered.done():
+            answered.set_result(False)
+
+    room.on("participant_attributes_changed", on_attributes_changed)
+    room.on("participant_disconnected", on_disconnected)
+    try:
+        return await asyncio.wait_for(answered, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        room.off("participant_attributes_changed", on_attributes_changed)
+        room.off("participant_disconnected", on_disconnected)
@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import datetime
+import threading
+import traceback
+from collections import Counter
+
+from call_log import current_call, log_event
+from voice_metrics import LOOP_BLOCKED, LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+# -------- Loop Watchdog Setup --------
+# Report the event loop being held up for longer than this (seconds); 0 disables the watchdog
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+# How often the loop checks in with the watchdog (seconds)
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.05"))
+# Innermost frames kept of a blocking stack
+LOOP_BLOCK_STACK_DEPTH = 25
+
+# -------- Profiler Setup --------
+# Profile every job from its start; SIGUSR2 starts and stops the profiler in a running job process
+AGENT_PROFILE = os.getenv("AGENT_PROFILE", "0") != "0"
+AGENT_PROFILE_DIR = os.getenv("AGENT_PROFILE_DIR", "profiles")
+# Seconds between stack samples
+AGENT_PROFILE_INTERVAL = float(os.getenv("AGENT_PROFILE_INTERVAL", "0.005"))
+PROFILE_SIGNAL = signal.SIGUSR2
+
+
+class LoopWatchdog:
+    """Reports the event loop being blocked, with the code that blocked it.
+
+    A task on the loop checks in every `interval`. A daemon thread looks in
+    as often; once a check-in is more than `threshold` late it takes the
+    loop thread's stack, which is whatever is holding the loop at that
+    moment. When the loop gets back to the task, the stall is logged with
+    that stack, to the call log of the job the watchdog was started in and
+    to `agent_loop_blocked_seconds`. Every check-in's lateness goes to
+    `agent_loop_lag_seconds`.
+    """
+
+    def __init__(self, threshold: float = LOOP_BLOCK_THRESHOLD, interval: float = LOOP_WATCHDOG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.blocks = 0
+        self._beat = 0.0
+        self._loop_thread = None
+        # (beat it was taken for, stack) of the stall in progress
+        self._stack = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+
+    def start(self):
+        """Start watching the running loop"""
+        if self._task is not None or self.threshold <= 0:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._check_in())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _check_in(self):
+        while True:
+            self._beat = start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            late = max(0.0, time.monotonic() - start - self.interval)
+            LOOP_LAG.observe(late)
+            if late > self.threshold:
+                stack = self._stack[1] if self._stack and self._stack[0] == start else None
+                self._report(late, stack)
+            self._stack = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval <= self.threshold:
+                continue
+            if self._stack is not None and self._stack[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stack = traceback.extract_stack(frame)[-LOOP_BLOCK_STACK_DEPTH:]
+                self._stack = (beat, "".join(traceback.format_list(stack)))
+            del frame
+
+    def _report(self, late: float, stack: str):
+        self.blocks += 1
+        LOOP_BLOCKED.observe(late)
+        room = current_call().get("room", "-")
+        stack = stack or "(not captured: the loop was back before the watchdog looked)\n"
+        logger.warning(f"Event loop blocked for {late * 1000:.0f}ms (room {room}) in:\n{stack}")
+        log_event('loop_blocked', 'system', f"Event loop blocked for {late * 1000:.0f}ms",
+                  blocked_ms=round(late * 1000), stack=stack)
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in this process while running.
+
+    A daemon thread takes a sample every `interval`. On stop() the samples
+    are written in the collapsed format (one "thread;outer;...;inner count"
+    line per distinct stack) read by flamegraph.pl, inferno and speedscope,
+    to `directory`/agent-<label>-<pid>-<time>.folded.
+    """
+
+    def __init__(self, directory: str = AGENT_PROFILE_DIR, interval: float = AGENT_PROFILE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        # Names the job in the file name, e.g. its room
+        self.label = ""
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Each run has its own stop event, so a run being stopped never sees a later start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="sampling-profiler",
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started (every {self.interval * 1000:g}ms)")
+
+    def stop(self):
+        """Stop sampling; the profiler thread writes the profile on its way out"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread = None
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _run(self, stop: threading.Event):
+        samples = Counter()
+        own = threading.get_ident()
+        started = time.time()
+        while not stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                samples[";".join(reversed(stack))] += 1
+        self._write(samples, started)
+
+    def _write(self, samples: Counter, started: float):
+        stamp = datetime.datetime.fromtimestamp(started).strftime("%Y%m%d-%H%M%S")
+        label = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.label) or "worker"
+        path = os.path.join(self.directory, f"agent-{label}-{os.getpid()}-{stamp}.folded")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+        except OSError as e:
+            logger.error(f"Could not write profile {path}: {e}")
+            return
+        logger.info(f"Wrote {sum(samples.values())} profile samples to {path}")
+
+
+_profiler = None
+
+
+def get_profiler() -> SamplingProfiler:
+    """Returns the process-wide SamplingProfiler"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler()
+    return _profiler
+
+
+def install_profile_signal():
+    """Toggle the process's profiler on PROFILE_SIGNAL. Call from the main thread."""
+    try:
+        signal.signal(PROFILE_SIGNAL, lambda signum, frame: get_profiler().toggle())
+    except ValueError as e:
+        logger.warning(f"Profiler signal not installed: {e}")
@@ -0,0 +1,359 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+from livekit.agents import llm, stt, tts
+from livekit.agents import metrics as lk_metrics
+from livekit.plugins import cartesia, deepgram, openai
+
+from call_log import log_event
+from prompts import PROMPT_CACHE_KEY
+
+logger = logging.getLogger(__name__)
+
+# -------- Model Routing Setup --------
+# Route chains, best first, as comma-separated "provider:model" (the model may be left out).
+# A campaign can replace any of them, and the budgets, with "routing" in its dispatch metadata
+ROUTE_STT = os.getenv("ROUTE_STT", "deepgram:nova-3")
+ROUTE_LLM = os.getenv("ROUTE_LLM", "openai:gpt-4o,openai:gpt-4o-mini")
+ROUTE_TTS = os.getenv("ROUTE_TTS", "cartesia")
+# Response-time budgets in seconds. A route whose recent latency is over its stage's budget is
+# tried after the routes within budget
+STT_DELAY_BUDGET = float(os.getenv("STT_DELAY_BUDGET", "1.0"))
+LLM_TTFT_BUDGET = float(os.getenv("LLM_TTFT_BUDGET", "1.0"))
+TTS_TTFB_BUDGET = float(os.getenv("TTS_TTFB_BUDGET", "0.5"))
+# Recent latency of a route: the 75th percentile of its last samples no older than the max age.
+# Once a demoted route's samples have aged out it is tried again
+ROUTE_LATENCY_WINDOW = int(os.getenv("ROUTE_LATENCY_WINDOW", "20"))
+ROUTE_LATENCY_MAX_AGE = float(os.getenv("ROUTE_LATENCY_MAX_AGE", "300"))
+# Every call runs in its own process; they share latency samples through this database so a call
+# starts from what the others measured. Empty keeps samples within the call
+ROUTE_LATENCY_DB = os.getenv("ROUTE_LATENCY_DB", "route_latency.db")
+ROUTE_LATENCY_SYNC_INTERVAL = float(os.getenv("ROUTE_LATENCY_SYNC_INTERVAL", "5"))
+
+STAGES = ("stt", "llm", "tts")
+LATENCY_PERCENTILE = 0.75
+# A route that failed counts as this slow until the sample ages out
+FAILED_ROUTE_SECONDS = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    stage TEXT NOT NULL,
+    route TEXT NOT NULL,
+    at REAL NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_route ON samples (stage, route, at);
+CREATE INDEX IF NOT EXISTS samples_at ON samples (at);
+"""
+
+
+def _stt(provider: str, model: str) -> stt.STT:
+    if provider == "deepgram":
+        return deepgram.STT(model=model or "nova-3", language="en")
+    if provider == "openai":
+        return openai.STT(model=model or "gpt-4o-transcribe", language="en")
+    raise ValueError(f"Unknown STT provider: {provider}")
+
+
+def _llm(provider: str, model: str) -> llm.LLM:
+    if provider == "openai":
+        return openai.LLM(model=model or "gpt-4o", prompt_cache_key=PROMPT_CACHE_KEY)
+    # OpenAI-compatible providers the plugin knows (openrouter, together, cerebras, fireworks, ...)
+    factory = getattr(openai.LLM, f"with_{provider}", None)
+    if factory is None:
+        raise ValueError(f"Unknown LLM provider: {provider}")
+    return factory(model=model) if model else factory()
+
+
+def _tts(provider: str, model: str) -> tts.TTS:
+    if provider == "cartesia":
+        return cartesia.TTS(model=model) if model else cartesia.TTS()
+    if provider == "deepgram":
+        return deepgram.TTS(model=model) if model else deepgram.TTS()
+    if provider == "openai":
+        return openai.TTS(model=model) if model else openai.TTS()
+    raise ValueError(f"Unknown TTS provider: {provider}")
+
+
+FACTORIES = {"stt": _stt, "llm": _llm, "tts": _tts}
+
+
+def _chain(value) -> list:
+    if isinstance(value, str):
+        value = value.split(",")
+    return [route.strip() for route in value or () if route and route.strip()]
+
+
+@dataclass
+class RoutingConfig:
+    """Route chains and response-time budgets for one call"""
+    stt: list = field(default_factory=lambda: _chain(ROUTE_STT))
+    llm: list = field(default_factory=lambda: _chain(ROUTE_LLM))
+    tts: list = field(default_factory=lambda: _chain(ROUTE_TTS))
+    budgets: dict = field(default_factory=lambda: {"stt": STT_DELAY_BUDGET, "llm": LLM_TTFT_BUDGET,
+                                                   "tts": TTS_TTFB_BUDGET})
+
+    @classmethod
+    def from_metadata(cls, routing: dict = None) -> "RoutingConfig":
+        """The defaults, with what the campaign's dispatch metadata overrides, e.g.
+        {"llm": ["openai:gpt-4o", "openai:gpt-4o-mini"], "budgets": {"llm": 0.8}}"""
+        config = cls()
+        for stage in STAGES:
+            chain = _chain((routing or {}).get(stage))
+            if chain:
+                setattr(config, stage, chain)
+        for stage, budget in ((routing or {}).get("budgets") or {}).items():
+            if stage in config.budgets:
+                config.budgets[stage] = float(budget)
+        return config
+
+
+class RouteLatency:
+    """Recent latency samples per (stage, route), shared with the worker's other job
+    processes through ROUTE_LATENCY_DB.
+
+    Samples are recorded in memory and written out every ROUTE_LATENCY_SYNC_INTERVAL
+    seconds, which also reads back what other calls recorded.
+    """
+
+    def __init__(self, path: str = ROUTE_LATENCY_DB, window: int = ROUTE_LATENCY_WINDOW,
+                 max_age: float = ROUTE_LATENCY_MAX_AGE, clock=time.time):
+        self.path = path
+        self.window = window
+        self.max_age = max_age
+        self.clock = clock
+        # (stage, route) -> (at, seconds), oldest first
+        self._samples: dict[tuple, deque] = defaultdict(lambda: deque(maxlen=self.window))
+        self._pending: list[tuple] = []
+        self._conn = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="route-latency")
+        self._task = None
+
+    def record(self, stage: str, route: str, seconds: float):
+        now = self.clock()
+        self._samples[(stage, route)].append((now, seconds))
+        self._pending.append((stage, route, now, seconds))
+
+    def latency(self, stage: str, route: str) -> float:
+        """Recent latency of a route, or None if it has no recent samples"""
+        cutoff = self.clock() - self.max_age
+        values = sorted(seconds for at, seconds in self._samples.get((stage, route), ()) if at >= cutoff)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * LATENCY_PERCENTILE))]
+
+    # -------- database thread --------
+
+    def _sync(self, pending: list) -> list:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        cutoff = self.clock() - self.max_age
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany("INSERT INTO samples (stage, route, at, seconds) VALUES (?, ?, ?, ?)", pending)
+            self._conn.execute("DELETE FROM samples WHERE at < ?", (cutoff,))
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return self._conn.execute(
+            "SELECT stage, route, at, seconds FROM ("
+            "  SELECT *, ROW_NUMBER() OVER (PARTITION BY stage, route ORDER BY at DESC) AS n"
+            "  FROM samples WHERE at >= ?"
+            ") WHERE n <= ? ORDER BY at", (cutoff, self.window)).fetchall()
+
+    # -------- lifecycle --------
+
+    async def sync(self):
+        """Write out this process's new samples and read everyone's recent ones"""
+        if not self.path:
+            self._pending.clear()
+            return
+        pending, self._pending = self._pending, []
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(self._executor, self._sync, pending)
+        except Exception as e:
+            # Keep the samples for the next attempt
+            self._pending[:0] = pending
+            logger.warning(f"Could not sync route latencies with {self.path}: {e}")
+            return
+        samples = defaultdict(lambda: deque(maxlen=self.window))
+        for stage, route, at, seconds in rows:
+            samples[(stage, route)].append((at, seconds))
+        # Samples recorded while the database was busy are not in it yet
+        for stage, route, at, seconds in self._pending:
+            samples[(stage, route)].append((at, seconds))
+        self._samples = samples
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(ROUTE_LATENCY_SYNC_INTERVAL)
+            await self.sync()
+
+    async def start(self, timeout: float = 1.0):
+        """Read the shared samples (waiting at most `timeout`) and keep syncing in the background"""
+        if self._task is None or self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self.sync()), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Route latencies not read within {timeout}s, starting without them")
+            self._task = asyncio.create_task(self._run())
+
+
+_latency = None
+
+
+def get_route_latency() -> RouteLatency:
+    """Returns the process-wide RouteLatency"""
+    global _latency
+    if _latency is None:
+        _latency = RouteLatency()
+    return _latency
+
+
+class _RoutedLLM(llm.FallbackAdapter):
+    """FallbackAdapter that orders its routes by latency budget before every request"""
+
+    def __init__(self, instances: list, order):
+        super().__init__(instances)
+        self._order = order
+
+    def _llm_order(self) -> list[int]:
+        return self._order()
+
+
+class ModelRouter:
+    """Builds a call's STT, LLM and TTS from its route chains and keeps them within budget.
+
+    Routes within their stage's budget (or with no recent samples) are used in
+    chain order, then the ones over budget, fastest first. The LLM is re-routed
+    before every request; STT and TTS stream for the whole call, so their route
+    is picked when the session starts. A route that errors is skipped by the
+    FallbackAdapter as before. The route that served each turn goes to
+    `call_metrics`.
+    """
+
+    def __init__(self, config: RoutingConfig, latency: RouteLatency = None, call_metrics=None):
+        self.config = config
+        self.latency = latency or get_route_latency()
+        self.call_metrics = call_metrics
+        # stage -> [(route, instance)], in chain order
+        self.routes: dict[str, list] = {}
+        # stage -> route last put first
+        self._preferred: dict[str, str] = {}
+        self._stt_route = None
+
+    def _build(self, stage: str) -> list:
+        routes = []
+        for spec in getattr(self.config, stage):
+            provider, _, model = spec.partition(":")
+            try:
+                instance = FACTORIES[stage](provider.strip(), model.strip())
+            except Exception as e:
+                logger.error(f"Skipping {stage} route {spec}: {e}")
+                continue
+            routes.append((f"{provider.strip()}:{instance.model}", instance))
+        if not routes:
+            default = getattr(RoutingConfig(), stage)[0]
+            logger.error(f"No usable {stage} route in {getattr(self.config, stage)}, using {default}")
+            provider, _, model = default.partition(":")
+            instance = FACTORIES[stage](provider, model)
+            routes.append((f"{provider}:{instance.model}", instance))
+        self.routes[stage] = routes
+        return routes
+
+    def order(self, stage: str) -> list[int]:
+        """Indexes of the stage's routes, in the order they should be tried now"""
+        routes = self.routes[stage]
+        budget = self.config.budgets[stage]
+        latencies = [self.latency.latency(stage, route) for route, _ in routes]
+        within = [i for i, seconds in enumerate(latencies) if seconds is None or seconds <= budget]
+        over = sorted((i for i, seconds in enumerate(latencies) if seconds is not None and seconds > budget),
+                      key=lambda i: latencies[i])
+        order = within + over
+        first = routes[order[0]][0]
+        if self._preferred.get(stage, routes[0][0]) != first:
+            slow = {route: round(seconds * 1000) for (route, _), seconds in zip(routes, latencies)
+                    if seconds is not None}
+            logger.info(f"Routing {stage} to {first} (budget {budget * 1000:.0f}ms, recent ms {slow})")
+            log_event('event', 'system', 'model route switched', stage=stage, route=first,
+                      budget_ms=round(budget * 1000), recent_ms=slow)
+        self._preferred[stage] = first
+        return order
+
+    def _adapter_events(self, adapter, stage: str):
+        def on_availability_changed(ev):
+            instance = getattr(ev, stage)
+            route = self._route_of(stage, instance.model, instance.provider)
+            if route and not ev.available:
+                # Failed over: make the route look slow to the other calls too
+                self.latency.record(stage, route, FAILED_ROUTE_SECONDS)
+        adapter.on(f"{stage}_availability_changed", on_availability_changed)
+
+    def build_stt(self, vad=None) -> stt.STT:
+        routes = self._build("stt")
+        instances = [routes[i][1] for i in self.order("stt")]
+        if len(instances) == 1:
+            return instances[0]
+        adapter = stt.FallbackAdapter(instances, vad=vad)
+        self._adapter_events(adapter, "stt")
+        return adapter
+
+    def build_llm(self) -> llm.LLM:
+        routes = self._build("llm")
+        if len(routes) == 1:
+            return routes[0][1]
+        adapter = _RoutedLLM([instance for _, instance in routes], lambda: self.order("llm"))
+        self._adapter_events(adapter, "llm")
+        return adapter
+
+    def build_tts(self) -> tts.TTS:
+        routes = self._build("tts")
+        instances = [routes[i][1] for i in self.order("tts")]
+        if len(instances) == 1:
+            return instances[0]
+        adapter = tts.FallbackAdapter(instances)
+        self._adapter_events(adapter, "tts")
+        return adapter
+
+    def _route_of(self, stage: str, model: str, provider: str) -> str:
+        for route, instance in self.routes.get(stage, ()):
+            if instance.model == model and instance.provider == provider:
+                return route
+        return None
+
+    def attach(self, session):
+        """Start recording latencies and routes from an AgentSession's metrics"""
+        session.on("metrics_collected", self._on_metrics_collected)
+
+    def _on_metrics_collected(self, ev):
+        m = ev.metrics
+        metadata = getattr(m, "metadata", None)
+        if isinstance(m, lk_metrics.STTMetrics) and metadata:
+            # Transcription delay arrives with the end-of-utterance metrics, which do not name the STT
+            self._stt_route = self._route_of("stt", metadata.model_name, metadata.model_provider)
+        elif isinstance(m, lk_metrics.EOUMetrics):
+            route = self._stt_route or self.routes["stt"][0][0]
+            self.latency.record("stt", route, m.transcription_delay)
+            self._record_turn(m.speech_id, "stt", route)
+        elif isinstance(m, (lk_metrics.LLMMetrics, lk_metrics.TTSMetrics)) and metadata:
+            stage = "llm" if isinstance(m, lk_metrics.LLMMetrics) else "tts"
+            route = self._route_of(stage, metadata.model_name, metadata.model_provider)
+            if route is None:
+                return
+            seconds = m.ttft if stage == "llm" else m.ttfb
+            if seconds >= 0:
+                self.latency.record(stage, route, seconds)
+            self._record_turn(m.speech_id, stage, route)
+
+    def _record_turn(self, speech_id, stage: str, route: str):
+        if self.call_metrics is not None:
+            self.call_metrics.record_route(speech_id, stage, route)
@@ -0,0 +1,216 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import datetime
+import logging
+from collections import deque
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# -------- Pacing Setup --------
+MAX_CALL_ATTEMPTS = int(os.getenv("MAX_CALL_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "600"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "7200"))
+# Local hours in which customers may be called, e.g. "09:00-20:00"; empty means any time
+CALLING_HOURS = os.getenv("CALLING_HOURS", "")
+CALLING_TIMEZONE = os.getenv("CALLING_TIMEZONE", "Asia/Kolkata")
+
+MIN_CALLS_PER_SECOND = float(os.getenv("MIN_CALLS_PER_SECOND", "0.1"))
+# Fraction of recent calls hitting trunk/agent errors above which pacing backs off
+PACING_ERROR_THRESHOLD = float(os.getenv("PACING_ERROR_THRESHOLD", "0.2"))
+PACING_WINDOW = 50           # outcomes considered when adjusting
+PACING_ADJUST_INTERVAL = 10  # seconds between adjustments
+
+# Call outcomes
+ANSWERED = "answered"
+NO_ANSWER = "no_answer"
+BUSY = "busy"
+REJECTED = "rejected"          # trunk refused the call: over capacity or rate limited
+AGENT_TIMEOUT = "agent_timeout"  # no agent worker picked up the dispatch in time
+INVALID = "invalid"            # number does not exist
+DUPLICATE = "duplicate"        # number already claimed by another row or dispatcher node
+ERROR = "error"
+
+RETRYABLE_OUTCOMES = {NO_ANSWER, BUSY, REJECTED, AGENT_TIMEOUT, ERROR}
+# Outcomes that mean the trunk or the agent workers are saturated
+SATURATION_OUTCOMES = {REJECTED, AGENT_TIMEOUT, ERROR}
+
+
+def classify_outcome(error: Exception) -> str:
+    """Map a LiveKit dial error to a call outcome using its SIP status code"""
+    metadata = getattr(error, "metadata", None) or {}
+    try:
+        sip_status = int(metadata.get("sip_status_code", 0))
+    except (TypeError, ValueError):
+        sip_status = 0
+    if sip_status in (408, 480, 487):
+        return NO_ANSWER
+    if sip_status in (486, 600, 603):
+        return BUSY
+    if sip_status in (404, 410, 484, 604):
+        return INVALID
+    if sip_status in (403, 429, 503) or getattr(error, "status", None) in (429, 503):
+        return REJECTED
+    return ERROR
+
+
+class CallingWindow:
+    """Daily local-time window in which calls may be placed.
+
+    A window whose end is before its start, e.g. "20:00-02:00", runs past midnight.
+    """
+
+    def __init__(self, hours: str = CALLING_HOURS, timezone: str = CALLING_TIMEZONE):
+        self.tz = ZoneInfo(timezone)
+        self.start = self.end = None
+        if hours:
+            start, end = hours.split("-")
+            self.start = datetime.time.fromisoformat(start.strip())
+            self.end = datetime.time.fromisoformat(end.strip())
+            if self.start == self.end:
+                raise ValueError(f"CALLING_HOURS {hours!r} is empty; leave it unset to call at any time")
+
+    def is_open(self, at: datetime.time) -> bool:
+        if self.start < self.end:
+            return self.start <= at < self.end
+        return at >= self.start or at < self.end
+
+    def seconds_until_open(self, now: datetime.datetime = None) -> float:
+        """0 if calls may be placed now, else seconds until the window next opens"""
+        if self.start is None:
+            return 0.0
+        now = (now or datetime.datetime.now(self.tz)).astimezone(self.tz)
+        if self.is_open(now.time()):
+            return 0.0
+        opens = now.replace(hour=self.start.hour, minute=self.start.minute, second=0, microsecond=0)
+        # Closed at or after the start time only happens once a same-day window has ended
+        if now.time() >= self.start:
+            opens += datetime.timedelta(days=1)
+        return (opens - now).total_seconds()
+
+    async def wait_until_open(self):
+        delay = self.seconds_until_open()
+        if delay > 0:
+            logger.info(f"Outside calling hours {CALLING_HOURS}, waiting {delay / 60:.0f} minutes")
+            await asyncio.sleep(delay)
+
+
+class AdaptivePacer:
+    """Dial rate and concurrency limit that follow observed call outcomes.
+
+    Starts at the configured maximum. Every PACING_ADJUST_INTERVAL seconds,
+    if more than PACING_ERROR_THRESHOLD of the last PACING_WINDOW calls were
+    rejected by the trunk, timed out waiting for an agent or errored, both
+    limits are halved (down to a floor); otherwise they grow back additively
+    towards the maximum.
+    """
+
+    def __init__(self, max_rate: float, max_concurrent: int,
+                 min_rate: float = MIN_CALLS_PER_SECOND):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate) if max_rate > 0 else 0.0
+        self.max_concurrent = max_concurrent
+        self.rate = max_rate
+        self.concurrency = max_concurrent
+        self._outcomes = deque(maxlen=PACING_WINDOW)
+        self._next_slot = 0.0
+        self._last_adjust = time.monotonic()
+
+    @property
+    def answer_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(o == ANSWERED for o in self._outcomes) / len(self._outcomes)
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(o in SATURATION_OUTCOMES for o in self._outcomes) / len(self._outcomes)
+
+    def record(self, outcome: str):
+        self._outcomes.append(outcome)
+        now = time.monotonic()
+        if now - self._last_adjust >= PACING_ADJUST_INTERVAL:
+            self._last_adjust = now
+            self._adjust()
+
+    def _adjust(self):
+        old = (self.rate, self.concurrency)
+        if self.error_rate > PACING_ERROR_THRESHOLD:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.concurrency = max(1, self.concurrency // 2)
+        else:
+            self.rate = min(self.max_rate, self.rate + max(self.max_rate / 10, self.min_rate))
+            self.concurrency = min(self.max_concurrent, self.concurrency + max(1, self.max_concurrent // 10))
+        if (self.rate, self.concurrency) != old:
+            logger.info(f"Pacing now {self.rate:.2f} calls/sec, {self.concurrency} concurrent "
+                        f"(error rate {self.error_rate:.0%}, answer rate {self.answer_rate:.0%})")
+
+    async def acquire(self):
+        """Wait for the next dial slot at the current rate"""
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class RetryQueue:
+    """Customers waiting to be dialed again, ordered by when they are due.
+
+    The delay before attempt n+1 is RETRY_BASE_DELAY * 2**(n-1), capped at
+    RETRY_MAX_DELAY, with +/-50% jitter, pushed forward into the calling
+    window if needed.
+    """
+
+    def __init__(self, window: CallingWindow = None, max_attempts: int = MAX_CALL_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        self.window = window or CallingWindow()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap: list = []
+        self._seq = 0
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, customer: dict, delay: float = None):
+        """Queue another attempt for `customer`, after `delay` seconds or the backoff delay.
+
+        Returns the delay, or None if the customer has used all its attempts.
+        """
+        attempts = customer.get("attempts", 1)
+        if attempts >= self.max_attempts:
+            return None
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            delay *= random.uniform(0.5, 1.5)
+        due = datetime.datetime.now(self.window.tz) + datetime.timedelta(seconds=delay)
+        delay += self.window.seconds_until_open(due)
+        self._seq += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, customer))
+        self._changed.set()
+        return delay
+
+    async def next_due(self) -> dict:
+        """Wait for and return the next customer whose retry is due"""
+        while True:
+            self._changed.clear()
+            timeout = None
+            if self._heap:
+                timeout = self._heap[0][0] - time.monotonic()
+                if timeout <= 0:
+                    return heapq.heappop(self._heap)[2]
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,102 @@
+import os
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Country calling code used for numbers written without one
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "91")
+
+# Country calling code -> allowed lengths of the national significant number.
+# Extend this table to dial more countries.
+COUNTRY_RULES = {
+    "1": (10,),       # US, Canada (NANP)
+    "44": (10,),      # United Kingdom
+    "61": (9,),       # Australia
+    "65": (8,),       # Singapore
+    "91": (10,),      # India
+    "971": (8, 9),    # United Arab Emirates
+}
+_CODE_LENGTHS = sorted({len(code) for code in COUNTRY_RULES}, reverse=True)
+
+
+def _split_country_code(digits: str):
+    """Split digits that start with a known country code into (code, national number)"""
+    for length in _CODE_LENGTHS:
+        code, national = digits[:length], digits[length:]
+        if code in COUNTRY_RULES and len(national) in COUNTRY_RULES[code]:
+            return code, national
+    return None
+
+
+def normalise_number(number, default_country_code: str = DEFAULT_COUNTRY_CODE) -> str:
+    """Normalise a phone number to E.164 using COUNTRY_RULES.
+
+    Numbers starting with '+' or '00' must carry a known country code.
+    Otherwise leading trunk zeros are dropped and the number is taken as
+    national to `default_country_code` if its length fits, or as already
+    carrying a country code if it does not.
+
+    Raises:
+        ValueError: if the number cannot be matched to any rule
+    """
+    raw = str(number).strip()
+    digits = ''.join(filter(str.isdigit, raw))
+    if not digits:
+        raise ValueError("Phone number cannot be empty")
+
+    if raw.startswith('+') or digits.startswith('00'):
+        split = _split_country_code(digits.lstrip('0'))
+    else:
+        national = digits.lstrip('0')
+        if len(national) in COUNTRY_RULES.get(default_country_code, ()):
+            split = default_country_code, national
+        else:
+            split = _split_country_code(national)
+
+    if split is None:
+        raise ValueError(f"Invalid phone number format: {number}. No dialing rule matches it.")
+    code, national = split
+    return f"+{code}{national}"
+
+
+def format_phone_number(number: str) -> str:
+    """Format phone number to E.164 format"""
+    return normalise_number(number)
+
+
+@dataclass
+class NormalisedBatch:
+    valid: list = field(default_factory=list)
+    # (customer, row number of the first customer with the same number)
+    duplicates: list = field(default_factory=list)
+    # (customer, reason)
+    invalid: list = field(default_factory=list)
+
+
+def normalise_customers(customers: list, index: dict = None,
+                        default_country_code: str = DEFAULT_COUNTRY_CODE) -> NormalisedBatch:
+    """Normalise the numbers of a batch of customers before any of them is dialed.
+
+    Each valid customer gets a `phone_number` key holding its E.164 number.
+    `index` maps E.164 numbers to the sheet rows that carry them; it is
+    updated in place, so passing the same dict for every batch of a campaign
+    catches duplicates across batches. Only the first row with a given
+    number is returned as valid.
+    """
+    if index is None:
+        index = {}
+    batch = NormalisedBatch()
+    for customer in customers:
+        try:
+            phone_number = normalise_number(customer.get("number", ""), default_country_code)
+        except ValueError as e:
+            batch.invalid.append((customer, str(e)))
+            continue
+        rows = index.setdefault(phone_number, [])
+        rows.append(customer.get("row"))
+        if len(rows) > 1:
+            batch.duplicates.append((customer, rows[0]))
+            continue
+        batch.valid.append({**customer, "phone_number": phone_number})
+    return batch
@@ -0,0 +1,56 @@
+import hashlib
+
+# Providers cache prompts by their exact prefix, and every request starts with
+# the tool schemas and AGENT_INSTRUCTIONS. Keep these texts free of per-call
+# values (names, numbers, times): one changed byte near the top makes every call
+# pay for the whole prompt again. Per-customer data only ever goes at the end of
+# a request, in customer_block().
+
+AGENT_INSTRUCTIONS = """\
+You are a professional call agent. Your task is to:
+1. Confirm the customer details I provide
+2. If the user says ANY information is incorrect:
+   - Ask them for the correct information
+   - Use the update_customer_details function to update it
+   - Confirm the update was successful
+   - Read back the updated information to verify
+3. Be polite and professional
+4. Keep responses brief and to the point
+5. End the call if the user requests
+6. Detect and handle voicemail systems appropriately
+7. If the user says anything like "goodbye", "hang up", "bye", or "end the call", you MUST call the `end_call` function tool.
+8. If you have no customer details yet, ask for their phone number and name and use the `lookup_customer` function tool to find their record
+
+When updating details:
+- For name updates, use field="name"
+- For address updates, use field="address"
+- Always confirm the update was successful before proceeding"""
+
+OUTBOUND_GREETING_INSTRUCTIONS = """\
+Greet the person warmly, introduce yourself as an AI assistant.
+Say you're calling to confirm their details.
+Read them the name and address from the customer record below and ask if these details are correct.
+If they say any detail is incorrect, use the update_customer_details function to update it.
+Keep it brief and professional."""
+
+INBOUND_GREETING_INSTRUCTIONS = ("Greet the user warmly, introduce yourself as an AI assistant, "
+                                 "and ask for their name and phone number to look up their details.")
+
+VOICEMAIL_INSTRUCTIONS = "Leave a voicemail message letting the user know you'll call back later."
+
+# Sent with every request so the provider routes calls sharing the prefix to the same cache
+PROMPT_CACHE_KEY = "outbound-caller-" + hashlib.sha256(AGENT_INSTRUCTIONS.encode("utf-8")).hexdigest()[:16]
+
+
+def customer_block(customer_data: dict) -> str:
+    """The customer record as a short block for the end of a request"""
+    if not customer_data:
+        return ""
+    return (f"Customer record:\n"
+            f"name: {customer_data.get('name') or 'not on file'}\n"
+            f"address: {customer_data.get('address') or 'not on file'}")
+
+
+def outbound_greeting_instructions(customer_data: dict) -> str:
+    """Instructions for the LLM-generated greeting, with the customer record last"""
+    return f"{OUTBOUND_GREETING_INSTRUCTIONS}\n\n{customer_block(customer_data)}"
@@ -0,0 +1,279 @@
+import os
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from customer_source import FIRST_DATA_ROW, SHEET_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# -------- Coordination Setup --------
+# Database shared by every dispatcher node of a campaign; empty means a single node
+DISPATCH_COORDINATOR_DB = os.getenv("DISPATCH_COORDINATOR_DB", "")
+# Keep this stable across restarts so a node can finish retries for numbers it claimed
+DISPATCH_NODE_ID = os.getenv("DISPATCH_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# A node that has not renewed its leases for this long is considered dead
+DISPATCH_LEASE_TTL = float(os.getenv("DISPATCH_LEASE_TTL", "60"))
+DISPATCH_CHUNK_SIZE = int(os.getenv("DISPATCH_CHUNK_SIZE", str(SHEET_PAGE_SIZE)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursors (
+    spreadsheet_id TEXT PRIMARY KEY,
+    next_row INTEGER NOT NULL,
+    end_row INTEGER
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    spreadsheet_id TEXT NOT NULL,
+    first_row INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    lease_expires REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (spreadsheet_id, first_row)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_open ON chunks (spreadsheet_id, done, lease_expires);
+CREATE TABLE IF NOT EXISTS numbers (
+    spreadsheet_id TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    claimed_at REAL NOT NULL,
+    dialed INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (spreadsheet_id, phone_number)
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class Chunk:
+    first_row: int
+    size: int
+    previous_owner: str = None
+
+
+class RowLeases:
+    """Shares one campaign's sheet rows between several dispatcher nodes.
+
+    Rows are handed out in chunks of `chunk_size`. A node holds a lease on
+    each chunk it is working on and renews it every `lease_ttl / 3`
+    seconds; a chunk whose lease has expired (its node died) is handed to
+    the next node that asks, ahead of new rows. Before dialing, a node
+    claims the number: the first claim wins and is never released, so a
+    number is dialed by one node only, even when a chunk changes hands or
+    appears on several rows. Once the call is placed the claim is marked
+    dialed, and from then on it is never taken again, not even by the same
+    node and row after a restart; only a claim that was never dialed is. Coordination state lives in a SQLite database
+    on storage every node can reach.
+    """
+
+    def __init__(self, path: str = DISPATCH_COORDINATOR_DB, spreadsheet_id: str = "",
+                 node_id: str = DISPATCH_NODE_ID, lease_ttl: float = DISPATCH_LEASE_TTL,
+                 chunk_size: int = DISPATCH_CHUNK_SIZE):
+        self.path = path
+        self.spreadsheet_id = spreadsheet_id or ""
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.chunk_size = chunk_size
+        self._conn = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="row-leases")
+        # first row of each chunk held -> rows in it not finished yet
+        self._open_rows: dict[int, set] = {}
+        self._row_chunk: dict[int, int] = {}
+        self._heartbeat = None
+        # Numbers this run has claimed, so its retries keep their claim
+        self._claims: set[str] = set()
+
+    # -------- database thread --------
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = [column[1] for column in self._conn.execute("PRAGMA table_info(numbers)")]
+        if "dialed" not in columns:
+            # Claims made before dialing was recorded are taken as dialed
+            self._conn.execute("ALTER TABLE numbers ADD COLUMN dialed INTEGER NOT NULL DEFAULT 1")
+        self._conn.execute("INSERT OR IGNORE INTO cursors (spreadsheet_id, next_row) VALUES (?, ?)",
+                           (self.spreadsheet_id, FIRST_DATA_ROW))
+        # Chunks left unfinished by an earlier run of this node go back to the pool
+        self._conn.execute("UPDATE chunks SET owner = '', lease_expires = 0 "
+                           "WHERE spreadsheet_id = ? AND owner = ? AND done = 0",
+                           (self.spreadsheet_id, self.node_id))
+
+    def _transaction(self, fn, *args):
+        # IMMEDIATE takes the write lock up front, so concurrent nodes queue instead of deadlocking
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(*args)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return result
+
+    def _acquire(self, now: float):
+        conn, sid = self._conn, self.spreadsheet_id
+        expired = conn.execute(
+            "SELECT first_row, size, owner FROM chunks WHERE spreadsheet_id = ? AND done = 0 "
+            "AND lease_expires < ? AND owner != ? ORDER BY first_row LIMIT 1", (sid, now, self.node_id),
+        ).fetchone()
+        if expired:
+            conn.execute("UPDATE chunks SET owner = ?, lease_expires = ? WHERE spreadsheet_id = ? AND first_row = ?",
+                         (self.node_id, now + self.lease_ttl, sid, expired[0]))
+            return Chunk(expired[0], expired[1], previous_owner=expired[2])
+        next_row, end_row = conn.execute(
+            "SELECT next_row, end_row FROM cursors WHERE spreadsheet_id = ?", (sid,)
+        ).fetchone()
+        if end_row is not None and next_row >= end_row:
+            return None
+        conn.execute("INSERT INTO chunks (spreadsheet_id, first_row, size, owner, lease_expires) VALUES (?, ?, ?, ?, ?)",
+                     (sid, next_row, self.chunk_size, self.node_id, now + self.lease_ttl))
+        conn.execute("UPDATE cursors SET next_row = ? WHERE spreadsheet_id = ?", (next_row + self.chunk_size, sid))
+        return Chunk(next_row, self.chunk_size)
+
+    def _claim(self, phone_number: str, row: int, now: float) -> tuple:
+        """Claim the number; returns the claim's (row, owner, dialed) and whether it is ours to dial"""
+        inserted = self._conn.execute(
+            "INSERT OR IGNORE INTO numbers (spreadsheet_id, phone_number, row, owner, claimed_at, dialed) "
+            "VALUES (?, ?, ?, ?, ?, 0)", (self.spreadsheet_id, phone_number, row, self.node_id, now)).rowcount
+        claim = self._conn.execute("SELECT row, owner, dialed FROM numbers WHERE spreadsheet_id = ? AND phone_number = ?",
+                                   (self.spreadsheet_id, phone_number)).fetchone()
+        # An earlier run of this node claimed it for the same row but never placed the call
+        return claim, bool(inserted) or claim == (row, self.node_id, 0)
+
+    def _claimed(self, phone_numbers: list) -> dict:
+        found = {}
+        # Stay under SQLite's limit on bound parameters
+        for i in range(0, len(phone_numbers), 500):
+            chunk = phone_numbers[i:i + 500]
+            rows = self._conn.execute(
+                f"SELECT phone_number, row, owner, dialed FROM numbers WHERE spreadsheet_id = ? "
+                f"AND phone_number IN ({','.join('?' * len(chunk))})",
+                (self.spreadsheet_id, *chunk),
+            ).fetchall()
+            found.update((number, (row, owner, bool(dialed))) for number, row, owner, dialed in rows)
+        return found
+
+    def _finished(self) -> bool:
+        next_row, end_row = self._conn.execute(
+            "SELECT next_row, end_row FROM cursors WHERE spreadsheet_id = ?", (self.spreadsheet_id,)
+        ).fetchone()
+        if end_row is None or next_row < end_row:
+            return False
+        return not self._conn.execute("SELECT 1 FROM chunks WHERE spreadsheet_id = ? AND done = 0 LIMIT 1",
+                                      (self.spreadsheet_id,)).fetchone()
+
+    def _execute(self, sql: str, params: tuple):
+        self._conn.execute(sql, params)
+
+    async def _run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # -------- lifecycle --------
+
+    async def open(self):
+        await self._run_db(self._open)
+        self._heartbeat = asyncio.create_task(self._renew_loop())
+        logger.info(f"Dispatcher node {self.node_id} coordinating through {self.path}")
+        return self
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._run_db(self._execute,
+                                   "UPDATE chunks SET lease_expires = ? WHERE spreadsheet_id = ? AND owner = ? AND done = 0",
+                                   (time.time() + self.lease_ttl, self.spreadsheet_id, self.node_id))
+            except Exception as e:
+                logger.error(f"Could not renew row leases: {e}")
+
+    async def aclose(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        if self._conn is not None:
+            # Hand unfinished chunks (e.g. after a drain) to the other nodes now, not after the lease expires
+            await self._run_db(self._execute,
+                               "UPDATE chunks SET owner = '', lease_expires = 0 "
+                               "WHERE spreadsheet_id = ? AND owner = ? AND done = 0",
+                               (self.spreadsheet_id, self.node_id))
+            await self._run_db(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    # -------- chunks --------
+
+    async def acquire_chunk(self):
+        """Lease the next chunk to work on, or None if none is available right now"""
+        chunk = await self._run_db(self._transaction, self._acquire, time.time())
+        if chunk and chunk.previous_owner:
+            logger.warning(f"Took over rows {chunk.first_row}-{chunk.first_row + chunk.size - 1} "
+                           f"from node {chunk.previous_owner}, whose lease expired")
+        return chunk
+
+    async def mark_end(self, first_row: int):
+        """Record that the sheet has no data from `first_row` on"""
+        await self._run_db(self._execute,
+                           "UPDATE cursors SET end_row = MIN(COALESCE(end_row, ?), ?) WHERE spreadsheet_id = ?",
+                           (first_row, first_row, self.spreadsheet_id))
+
+    async def finished(self) -> bool:
+        """True once the end of the sheet is known and every chunk up to it is done"""
+        return await self._run_db(self._finished)
+
+    async def complete_chunk(self, first_row: int):
+        self._open_rows.pop(first_row, None)
+        await self._run_db(self._execute,
+                           "UPDATE chunks SET done = 1 WHERE spreadsheet_id = ? AND first_row = ? AND owner = ?",
+                           (self.spreadsheet_id, first_row, self.node_id))
+
+    async def track(self, chunk: Chunk, rows: list):
+        """Hold the chunk until every one of `rows` is finished; completes it at once if there are none"""
+        if not rows:
+            await self.complete_chunk(chunk.first_row)
+            return
+        self._open_rows[chunk.first_row] = set(rows)
+        for row in rows:
+            self._row_chunk[row] = chunk.first_row
+
+    async def row_done(self, row: int):
+        first_row = self._row_chunk.pop(row, None)
+        rows = self._open_rows.get(first_row)
+        if rows is None:
+            return
+        rows.discard(row)
+        if not rows:
+            await self.complete_chunk(first_row)
+
+    # -------- numbers --------
+
+    async def claimed_numbers(self, phone_numbers: list) -> dict:
+        """Maps each of `phone_numbers` that has been claimed to its (row, node, dialed)"""
+        return await self._run_db(self._claimed, phone_numbers)
+
+    async def claim_number(self, customer: dict) -> bool:
+        """Claim the customer's number for this node and row.
+
+        False if another node or row has it, or if it has been dialed before,
+        e.g. by this node before a restart. Retries within this run keep the claim.
+        """
+        phone_number = customer["phone_number"]
+        if phone_number in self._claims:
+            return True
+        (row, owner, dialed), ours = await self._run_db(self._transaction, self._claim,
+                                                        phone_number, customer["row"], time.time())
+        if ours:
+            self._claims.add(phone_number)
+            return True
+        state = "dialed" if dialed else "claimed"
+        logger.warning(f"Skipping row {customer['row']}: {phone_number} already {state} "
+                       f"for row {row} by node {owner}")
+        return False
+
+    async def mark_dialed(self, customer: dict):
+        """Record that the call to the customer's claimed number is being placed"""
+        await self._run_db(self._execute,
+                           "UPDATE numbers SET dialed = 1 WHERE spreadsheet_id = ? AND phone_number = ? AND dialed = 0",
+                           (self.spreadsheet_id, customer["phone_number"]))
@@ -0,0 +1,127 @@
+import os
+import re
+import logging
+from dataclasses import dataclass, asdict
+
+from customer_source import SHEET_NAME, parse_customer_row, row_hash
+from phone_numbers import normalise_number
+from sheets_quota import INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# -------- Row Verification Setup --------
+# Check that each write still targets its customer's row before sending it
+SHEET_VERIFY_WRITES = os.getenv("SHEET_VERIFY_WRITES", "1") != "0"
+# Attempts to find a customer whose row has moved before their update is dropped
+SHEET_CONFLICT_MAX_TRIES = int(os.getenv("SHEET_CONFLICT_MAX_TRIES", "5"))
+
+_CELL_RANGE = re.compile(r"^(?P<prefix>.*![A-Z]+|[A-Z]+)(?P<row>\d+)$")
+
+
+def range_row(range_name: str):
+    """Row number of a single-cell range like "Sheet1!B12", or None for other ranges"""
+    match = _CELL_RANGE.match(range_name)
+    return int(match["row"]) if match else None
+
+
+def move_range(range_name: str, row: int) -> str:
+    """The same single-cell range on another row"""
+    return _CELL_RANGE.sub(lambda m: f"{m['prefix']}{row}", range_name)
+
+
+@dataclass
+class RowSnapshot:
+    """A sheet row as it was when read: its number, its customer's normalised phone number and a hash of its values"""
+    row: int
+    phone_number: str
+    row_hash: str = ""
+
+    @classmethod
+    def from_customer(cls, customer: dict):
+        """Snapshot of a parsed customer row, or None if it has no usable phone number"""
+        phone_number = customer.get("phone_number")
+        if not phone_number:
+            try:
+                phone_number = normalise_number(customer["number"])
+            except (KeyError, ValueError):
+                return None
+        return cls(int(customer["row"]), phone_number, customer.get("row_hash") or row_hash(customer))
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _owner(customer) -> str:
+    if customer is None:
+        return None
+    try:
+        return normalise_number(customer["number"])
+    except ValueError:
+        return None
+
+
+class RowVerifier:
+    """Makes sure writes land on the row of the customer they were meant for.
+
+    Operators may insert, delete or sort rows while calls are in progress,
+    so the row a customer was dispatched from may since hold someone else.
+    Before a batch of writes is sent, `locate()` reads back every target row
+    in a single values.batchGet and checks that it still holds the same
+    phone number. A customer who has moved is found again through the
+    customer index, and confirmed with one more batched read; if
+    the index is out of date, it is asked to re-read the sheet. Where each
+    customer was last confirmed is cached per spreadsheet, so later writes
+    go straight to the right row.
+    """
+
+    def __init__(self, index=None):
+        self.index = index
+        # (spreadsheet_id, phone_number) -> snapshot of the row it was last confirmed on
+        self.locations: dict[tuple[str, str], RowSnapshot] = {}
+        self.reads = 0
+
+    def current_row(self, spreadsheet_id: str, snapshot: RowSnapshot) -> int:
+        known = self.locations.get((spreadsheet_id, snapshot.phone_number))
+        return known.row if known else snapshot.row
+
+    async def _read_rows(self, sheets, spreadsheet_id: str, rows: list) -> dict:
+        # Checked before in-call updates go out, so these reads go ahead of bulk ones
+        value_ranges = await sheets.batch_get_values([f"{SHEET_NAME}!A{row}:D{row}" for row in rows],
+                                                     spreadsheet_id=spreadsheet_id, priority=INTERACTIVE)
+        self.reads += 1
+        return {row: parse_customer_row(values[0], row) if values else None
+                for row, values in zip(rows, value_ranges)}
+
+    async def locate(self, sheets, spreadsheet_id: str, snapshots: list) -> dict:
+        """Maps the phone number of each snapshot to the row its customer is on now, or None if not found"""
+        expected = {s.phone_number: self.current_row(spreadsheet_id, s) for s in snapshots}
+        rows = await self._read_rows(sheets, spreadsheet_id, sorted(set(expected.values())))
+        found = {phone: rows[row] for phone, row in expected.items() if _owner(rows[row]) == phone}
+
+        candidates = {}
+        if self.index is not None:
+            for phone, row in expected.items():
+                moved_to = await self.index.row_of(phone)
+                if phone not in found and moved_to is not None and moved_to != row:
+                    candidates[phone] = moved_to
+        if candidates:
+            rows = await self._read_rows(sheets, spreadsheet_id, sorted(set(candidates.values())))
+            found.update((phone, rows[row]) for phone, row in candidates.items() if _owner(rows[row]) == phone)
+
+        located = {}
+        for snapshot in snapshots:
+            customer = found.get(snapshot.phone_number)
+            if customer is None:
+                located[snapshot.phone_number] = None
+                continue
+            if customer["row"] != expected[snapshot.phone_number]:
+                logger.info(f"Customer {snapshot.phone_number} moved from row "
+                            f"{expected[snapshot.phone_number]} to {customer['row']}")
+            elif customer["row_hash"] != snapshot.row_hash:
+                logger.info(f"Row {snapshot.row} was edited since it was read, still {snapshot.phone_number}")
+            self.locations[(spreadsheet_id, snapshot.phone_number)] = RowSnapshot.from_customer(customer)
+            located[snapshot.phone_number] = customer["row"]
+
+        if self.index is not None and None in located.values():
+            self.index.request_resync()
+        return located
@@ -0,0 +1,361 @@
+import os
+import asyncio
+import json
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+from sheets_client import SPREADSHEET_ID, load_sheets_client
+from customer_index import get_customer_index
+from sheets_quota import is_rate_limited
+from row_snapshots import (SHEET_CONFLICT_MAX_TRIES, SHEET_VERIFY_WRITES, RowSnapshot, RowVerifier,
+                           move_range, range_row)
+
+logger = logging.getLogger(__name__)
+
+SHEET_SPOOL_DIR = os.getenv("SHEET_SPOOL_DIR", "sheet_spool")
+SHEET_FLUSH_INTERVAL = float(os.getenv("SHEET_FLUSH_INTERVAL", "2"))
+SHEET_FLUSH_BATCH_SIZE = int(os.getenv("SHEET_FLUSH_BATCH_SIZE", "50"))
+SHEET_RETRY_MAX_DELAY = 60.0
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _rejected(error) -> bool:
+    """True for a 4xx the same request would get again, e.g. a bad range or a protected cell"""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return 400 <= status < 500 and status not in (401, 408, 429) and not is_rate_limited(error)
+
+
+class SheetWriteBehind:
+    """Coalesces cell updates from every session in the process.
+
+    `record()` appends the update to a local spool file and returns; a
+    background flusher sends all pending updates as one values.batchUpdate
+    request every `flush_interval` seconds, or sooner once `batch_size`
+    ranges are pending. A later write to the same range replaces an earlier
+    unflushed one. Flushes that fail on a rate limit, a server error or the
+    network are retried with exponential backoff; a batch the API rejects
+    outright (any other 4xx) is split until the updates it rejects are found,
+    and those are logged and dropped. Spool files left behind by crashed
+    processes are replayed on start.
+
+    A write recorded with the `identity` of the customer row it is meant for
+    is checked by the `verifier` before it is sent, and moved if that
+    customer's row has moved (see row_snapshots.RowVerifier). A write whose
+    customer cannot be found is held back until the customer index has been
+    re-read, and dropped after SHEET_CONFLICT_MAX_TRIES attempts.
+    """
+
+    def __init__(self, spool_dir: str = SHEET_SPOOL_DIR,
+                 flush_interval: float = SHEET_FLUSH_INTERVAL,
+                 batch_size: int = SHEET_FLUSH_BATCH_SIZE,
+                 verifier: RowVerifier = None):
+        self.spool_dir = spool_dir
+        self.spool_file = os.path.join(spool_dir, f"{os.getpid()}.jsonl")
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.verifier = verifier
+        # (spreadsheet_id, range) -> 2D values
+        self._pending: dict[tuple[str, str], list] = {}
+        # (spreadsheet_id, range) -> row the write is meant for, for pending writes that have one
+        self._identity: dict[tuple[str, str], RowSnapshot] = {}
+        # (spreadsheet_id, range) -> (failed attempts to find the row, index generation at the last one)
+        self._held: dict[tuple[str, str], tuple[int, int]] = {}
+        # Single thread so spool appends and rewrites happen in submission order
+        self._spool_executor = ThreadPoolExecutor(1, thread_name_prefix="sheet-spool")
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    # -------- spool file --------
+
+    def _append_spool(self, entry: dict):
+        with open(self.spool_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_spool(self, entries: list):
+        if not entries:
+            if os.path.exists(self.spool_file):
+                os.remove(self.spool_file)
+            return
+        tmp_file = f"{self.spool_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.spool_file)
+
+    def _adopt_spools(self) -> tuple[list, list]:
+        """Claim and read spool files of processes that are no longer running.
+
+        Each file is first renamed to one named after this process, which only
+        one process can do, so two workers starting together never replay the
+        same updates; a file claimed but not yet replayed by a process that then
+        died is picked up again the same way. Returns the entries and the
+        claimed files, to be removed once the entries are in our own spool.
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        entries, claimed = [], []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            try:
+                # "<pid>.jsonl", or "<pid>.<name it was claimed from>" once claimed
+                pid = int(name.split(".", 1)[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            if path != self.spool_file:
+                claim = os.path.join(self.spool_dir, f"{os.getpid()}.{name}")
+                try:
+                    os.rename(path, claim)
+                except FileNotFoundError:
+                    # Another process claimed it first
+                    continue
+                path = claim
+                claimed.append(claim)
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn final line from a crash mid-write
+                        logger.warning(f"Skipping corrupt spool entry in {path}")
+        return entries, claimed
+
+    def _remove_files(self, paths: list):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _spool(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._spool_executor, fn, *args)
+
+    def _spool_entry(self, key: tuple, values: list) -> dict:
+        entry = {"spreadsheet_id": key[0], "range": key[1], "values": values}
+        if key in self._identity:
+            entry["identity"] = self._identity[key].to_dict()
+        return entry
+
+    def _spool_entries(self) -> list:
+        return [self._spool_entry(key, values) for key, values in self._pending.items()]
+
+    # -------- public API --------
+
+    async def start(self):
+        """Replay leftover spool files and start the background flusher"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        entries, claimed = await self._spool(self._adopt_spools)
+        for entry in entries:
+            key = (entry["spreadsheet_id"], entry["range"])
+            if key not in self._pending:
+                self._pending[key] = entry["values"]
+                if entry.get("identity"):
+                    self._identity[key] = RowSnapshot(**entry["identity"])
+        if entries:
+            logger.info(f"Recovered {len(entries)} unflushed sheet updates from spool")
+            await self._spool(self._rewrite_spool, self._spool_entries())
+            self._flush_now.set()
+        await self._spool(self._remove_files, claimed)
+
+    async def record(self, range_name: str, values: list, spreadsheet_id: str = SPREADSHEET_ID,
+                     identity: RowSnapshot = None):
+        """Queue a write of `values` to `range_name`; returns once it is durable locally
+
+        Args:
+            identity: the customer row the write is meant for; checked before sending
+        """
+        await self.start()
+        key = (spreadsheet_id, range_name)
+        self._pending[key] = values
+        self._held.pop(key, None)
+        if identity is not None:
+            self._identity[key] = identity
+        else:
+            self._identity.pop(key, None)
+        await self._spool(self._append_spool, self._spool_entry(key, values))
+        if len(self._pending) >= self.batch_size:
+            self._flush_now.set()
+
+    # -------- row verification --------
+
+    def _index_generation(self) -> int:
+        index = self.verifier.index if self.verifier else None
+        return index.generation if index is not None else 0
+
+    def _move(self, moves: dict) -> list:
+        """Re-target pending writes at other rows; returns their new keys"""
+        # Take them all out first: after an insert, one write moves onto the row another is leaving
+        moved = [(key, row, self._pending.pop(key), self._identity.pop(key)) for key, row in moves.items()]
+        new_keys = []
+        for key, row, values, identity in moved:
+            new_key = (key[0], move_range(key[1], row))
+            # Anything else aimed at that row is for the same customer, and was recorded later
+            if new_key not in self._pending:
+                self._pending[new_key] = values
+                self._identity[new_key] = RowSnapshot(row, identity.phone_number, identity.row_hash)
+            new_keys.append(new_key)
+        return new_keys
+
+    def _hold(self, key: tuple):
+        tries = self._held.get(key, (0, 0))[0] + 1
+        if tries < SHEET_CONFLICT_MAX_TRIES:
+            self._held[key] = (tries, self._index_generation())
+            logger.warning(f"Holding update of {key[1]}: row of {self._identity[key].phone_number} not found")
+            return
+        logger.error(f"Dropping update of {key[1]} to {self._pending[key]}: row of "
+                     f"{self._identity[key].phone_number} not found after {tries} attempts")
+        del self._pending[key], self._identity[key], self._held[key]
+
+    async def _verified_batch(self, sheets) -> dict:
+        """The pending writes that can be sent now, moved to wherever their customer's row is"""
+        batch, checks = {}, {}
+        generation = self._index_generation()
+        for key, values in self._pending.items():
+            identity = self._identity.get(key)
+            if identity is None or self.verifier is None or range_row(key[1]) is None:
+                batch[key] = values
+            elif key not in self._held or self._held[key][1] != generation:
+                checks.setdefault(key[0], []).append(key)
+            # Otherwise wait for the customer index to be re-read before looking again
+
+        for sid, keys in checks.items():
+            try:
+                rows = await self.verifier.locate(sheets, sid, [self._identity[key] for key in keys])
+            except Exception as e:
+                logger.error(f"Could not check rows before writing, keeping {len(keys)} updates: {e}")
+                continue
+            moves = {}
+            for key in keys:
+                row = rows.get(self._identity[key].phone_number)
+                if row is None:
+                    self._hold(key)
+                    continue
+                self._held.pop(key, None)
+                if row != range_row(key[1]):
+                    moves[key] = row
+                else:
+                    batch[key] = self._pending[key]
+            for key in self._move(moves):
+                batch[key] = self._pending[key]
+        return batch
+
+    async def _send(self, sheets, sid: str, data: list) -> tuple[list, list]:
+        """Write `data`, splitting it to find the updates the API rejects outright.
+
+        Returns the entries written and the entries rejected; raises if a
+        request fails in a way worth retrying.
+        """
+        try:
+            result = await sheets.batch_update_values(data, spreadsheet_id=sid)
+        except Exception as e:
+            if not _rejected(e):
+                raise
+            if len(data) == 1:
+                logger.error(f"Dropping update of {data[0]['range']} to {data[0]['values']}: "
+                             f"rejected with HTTP {e.resp.status}: {e}")
+                return [], data
+            middle = len(data) // 2
+            sent, rejected = await self._send(sheets, sid, data[:middle])
+            more_sent, more_rejected = await self._send(sheets, sid, data[middle:])
+            return sent + more_sent, rejected + more_rejected
+        logger.info(f"Flushed {len(data)} sheet updates, {result.get('totalUpdatedCells', 0)} cells")
+        return data, []
+
+    async def flush(self) -> bool:
+        """Send all pending updates now. Returns False if the request failed."""
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            sheets = await load_sheets_client()
+            if not sheets:
+                logger.error("Failed to initialize Google Sheets service, keeping updates spooled")
+                return False
+            batch = await self._verified_batch(sheets)
+
+            by_spreadsheet: dict[str, list] = {}
+            for (sid, rng), values in batch.items():
+                by_spreadsheet.setdefault(sid, []).append({"range": rng, "values": values})
+
+            ok = True
+            for sid, data in by_spreadsheet.items():
+                try:
+                    sent, rejected = await self._send(sheets, sid, data)
+                except Exception as e:
+                    logger.error(f"Error flushing {len(data)} sheet updates: {e}")
+                    ok = False
+                    continue
+                for entry in sent + rejected:
+                    key = (sid, entry["range"])
+                    # Leave it pending if a newer value arrived while we were sending
+                    if self._pending.get(key) is batch[key]:
+                        del self._pending[key]
+                        self._identity.pop(key, None)
+                        self._held.pop(key, None)
+
+            await self._spool(self._rewrite_spool, self._spool_entries())
+            return ok
+
+    async def _run(self):
+        failures = 0
+        while True:
+            delay = self.flush_interval
+            if failures:
+                delay = min(SHEET_RETRY_MAX_DELAY, self.flush_interval * 2 ** failures)
+                delay *= random.uniform(0.5, 1.0)
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            try:
+                failures = 0 if await self.flush() else failures + 1
+            except Exception as e:
+                logger.error(f"Unexpected error in sheet flusher: {e}")
+                failures += 1
+
+    async def aclose(self):
+        """Flush what is pending and stop the flusher"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+
+_writer = None
+
+
+def get_sheet_writer() -> SheetWriteBehind:
+    """Returns the process-wide SheetWriteBehind"""
+    global _writer
+    if _writer is None:
+        _writer = SheetWriteBehind(verifier=RowVerifier(get_customer_index()) if SHEET_VERIFY_WRITES else None)
+    return _writer
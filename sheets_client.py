@@ -0,0 +1,235 @@
+import os
+import random
+import asyncio
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from dotenv import load_dotenv
+import google_auth_httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+# Before sheets_quota, which reads its SHEETS_* settings at import
+load_dotenv()
+
+from sheets_quota import (BACKGROUND, INTERACTIVE, READ, SHEETS_RATE_LIMIT_RETRIES, WRITE,  # noqa: E402
+                          get_sheets_quota, is_rate_limited)
+
+logger = logging.getLogger(__name__)
+
+# -------- Google Sheets Setup --------
+# An empty SPREADSHEET_ID (as in example.env) also means the default sheet
+SPREADSHEET_ID = os.getenv("SPREADSHEET_ID") or "1QBTDOqKoPFuHFMordHVgNRt3S20zVnQgPigzk1kIzdQ"
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+TOKEN_FILE = os.getenv("GOOGLE_TOKEN_FILE", "token.json")
+
+SHEETS_MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", "4"))
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT", "30"))
+# Retries of a request that failed with a server or connection error (429s: see sheets_quota.py)
+SHEETS_NUM_RETRIES = int(os.getenv("SHEETS_NUM_RETRIES", "2"))
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
+
+_resource = None
+
+
+def spreadsheets_resource():
+    """The spreadsheets resource of the Sheets API, built on first use.
+
+    Building it costs a few hundred ms of CPU (the discovery client renders
+    docs for every method), so it is built once per process image: agent.py
+    builds it at import, which a preloading forkserver does once for all job
+    processes. Requests always pass their own authorized http to execute(),
+    so the placeholder http it is built with is never used.
+    """
+    global _resource
+    if _resource is None:
+        service = build("sheets", "v4", http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT),
+                        static_discovery=True, cache_discovery=False)
+        _resource = service.spreadsheets()
+    return _resource
+
+
+class SheetsClient:
+    """Google Sheets client shared by every session in a process.
+
+    The spreadsheets resource is built from the discovery document bundled
+    with google-api-python-client, so no network fetch is needed, and is
+    shared by every client in the process (see spreadsheets_resource()). Requests run
+    on a small thread pool where each thread keeps its own authorized HTTP
+    connection, and the access token is refreshed in the background before it
+    expires. Every request first takes a token from the host's shared Sheets
+    quota (see sheets_quota.py) and is retried after the shared backoff on a
+    429. All public methods are coroutines and never block the event loop.
+    """
+
+    def __init__(self, token_file: str = TOKEN_FILE, max_workers: int = SHEETS_MAX_WORKERS):
+        self.token_file = token_file
+        self.creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="sheets")
+        self._refresh_task = None
+        self.spreadsheets = spreadsheets_resource()
+        self.quota = get_sheets_quota()
+
+    def _http(self):
+        """HTTP connection owned by the calling thread (httplib2 is not thread-safe)"""
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.creds, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT)
+            )
+            self._local.http = http
+        return http
+
+    def _execute(self, make_request):
+        request = make_request(self.spreadsheets)
+        # Retries are done in run(), so each one takes a token and 429s wait for the shared backoff
+        return request.execute(http=self._http(), num_retries=0)
+
+    def _refresh_credentials(self):
+        with self._refresh_lock:
+            self.creds.refresh(Request())
+            tmp_file = f"{self.token_file}.tmp"
+            with open(tmp_file, "w") as token:
+                token.write(self.creds.to_json())
+            os.replace(tmp_file, self.token_file)
+        logger.info(f"Refreshed Google credentials, valid until {self.creds.expiry}")
+
+    async def _refresh_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = 0.0
+            if self.creds.expiry:
+                # google-auth stores expiry as a naive UTC datetime
+                remaining = self.creds.expiry - datetime.datetime.utcnow()
+                delay = max(0.0, remaining.total_seconds() - TOKEN_REFRESH_MARGIN)
+            elif self.creds.valid:
+                return
+            await asyncio.sleep(delay)
+            try:
+                await loop.run_in_executor(self._executor, self._refresh_credentials)
+            except Exception as e:
+                logger.error(f"Error refreshing Google credentials: {e}")
+                await asyncio.sleep(30)
+
+    def _ensure_refresher(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def run(self, make_request, kind: str = READ, priority: str = BACKGROUND):
+        """Build a request from the spreadsheets resource and execute it off the event loop.
+
+        Args:
+            make_request: callable taking the spreadsheets resource and returning
+                an unexecuted request, e.g. ``lambda s: s.values().get(...)``
+            kind: READ or WRITE, the quota the request counts against
+            priority: INTERACTIVE, BACKGROUND or BULK (see sheets_quota.py)
+        """
+        self._ensure_refresher()
+        loop = asyncio.get_running_loop()
+        rate_limited = failed = 0
+        while True:
+            await self.quota.acquire(kind, priority)
+            try:
+                result = await loop.run_in_executor(self._executor, self._execute, make_request)
+            except HttpError as e:
+                if is_rate_limited(e) and rate_limited < SHEETS_RATE_LIMIT_RETRIES:
+                    rate_limited += 1
+                    delay = await self.quota.athrottled(kind)
+                    logger.warning(f"Sheets {kind} quota exceeded ({priority}), backing off {delay:.1f}s")
+                    continue
+                if e.resp.status < 500 or failed >= SHEETS_NUM_RETRIES:
+                    raise
+                failed += 1
+                logger.warning(f"Sheets {kind} request failed with HTTP {e.resp.status}, retrying")
+            except (OSError, httplib2.HttpLib2Error) as e:
+                if failed >= SHEETS_NUM_RETRIES:
+                    raise
+                failed += 1
+                logger.warning(f"Sheets {kind} request failed ({e}), retrying")
+            else:
+                self.quota.succeeded(kind)
+                return result
+            await asyncio.sleep(random.random() * 2 ** failed)
+
+    async def get_values(self, range_name: str, spreadsheet_id: str = SPREADSHEET_ID,
+                         priority: str = BACKGROUND) -> list:
+        """Read a range and return its rows"""
+        result = await self.run(
+            lambda s: s.values().get(spreadsheetId=spreadsheet_id, range=range_name), READ, priority
+        )
+        return result.get("values", [])
+
+    async def batch_get_values(self, ranges: list, spreadsheet_id: str = SPREADSHEET_ID,
+                               priority: str = BACKGROUND) -> list:
+        """Read several ranges in one request; returns the rows of each range, in order"""
+        result = await self.run(
+            lambda s: s.values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges), READ, priority
+        )
+        return [value_range.get("values", []) for value_range in result.get("valueRanges", [])]
+
+    async def update_values(self, range_name: str, values: list, spreadsheet_id: str = SPREADSHEET_ID,
+                            priority: str = INTERACTIVE) -> dict:
+        """Write a 2D array of values to a range"""
+        return await self.run(
+            lambda s: s.values().update(
+                spreadsheetId=spreadsheet_id,
+                range=range_name,
+                valueInputOption="USER_ENTERED",
+                body={"values": values},
+            ),
+            WRITE, priority,
+        )
+
+    async def batch_update_values(self, data: list, spreadsheet_id: str = SPREADSHEET_ID,
+                                  priority: str = INTERACTIVE) -> dict:
+        """Write several ranges in one request.
+
+        Args:
+            data: list of {"range": ..., "values": [[...]]} entries
+        """
+        return await self.run(
+            lambda s: s.values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={"valueInputOption": "USER_ENTERED", "data": data},
+            ),
+            WRITE, priority,
+        )
+
+    def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        self._executor.shutdown(wait=False)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_sheets_client():
+    """Returns the process-wide SheetsClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                try:
+                    _client = SheetsClient()
+                except Exception as e:
+                    logger.error(f"Error getting sheets service: {e}")
+                    return None
+    return _client
+
+
+async def load_sheets_client():
+    """Like get_sheets_client, but builds the client off the event loop on first use"""
+    if _client is not None:
+        return _client
+    return await asyncio.get_running_loop().run_in_executor(None, get_sheets_client)
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import fcntl
+import random
+import asyncio
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# -------- Sheets Quota Setup --------
+# Requests the project may make per minute. The Sheets API defaults are 60 reads and 60 writes
+# per minute per user, and every process here uses the same user's token
+SHEETS_READ_QUOTA = float(os.getenv("SHEETS_READ_QUOTA", "60"))
+SHEETS_WRITE_QUOTA = float(os.getenv("SHEETS_WRITE_QUOTA", "60"))
+# Requests that may go out at once after a quiet spell; the refill rate is lowered to match,
+# so no minute ever sees more than the quota
+SHEETS_QUOTA_BURST = float(os.getenv("SHEETS_QUOTA_BURST", "5"))
+# Share of each bucket kept for in-call requests
+SHEETS_QUOTA_RESERVE = float(os.getenv("SHEETS_QUOTA_RESERVE", "0.4"))
+# Shared by every process on this host (dispatcher, agent jobs, scripts); empty limits each
+# process on its own
+SHEETS_QUOTA_FILE = os.getenv("SHEETS_QUOTA_FILE", os.path.join(tempfile.gettempdir(), "sheets_quota.json"))
+# Backoff after a 429 doubles from the base up to the max (seconds), shared by every process
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "64"))
+# 429s a single request is retried through before it fails
+SHEETS_RATE_LIMIT_RETRIES = int(os.getenv("SHEETS_RATE_LIMIT_RETRIES", "8"))
+
+READ, WRITE = "read", "write"
+# Priority classes, highest first: in-call requests, other agent-side requests, bulk reads
+INTERACTIVE, BACKGROUND, BULK = "interactive", "background", "bulk"
+PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+# Longest sleep between attempts to take a token
+POLL_INTERVAL = 1.0
+
+
+def is_rate_limited(error) -> bool:
+    """True for the errors the Sheets API returns when a quota is used up"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status == 429:
+        return True
+    if status == 403:
+        reason = getattr(error, "reason", "") or str(error)
+        return "rateLimitExceeded" in reason or "RATE_LIMIT_EXCEEDED" in reason or "Quota exceeded" in reason
+    return False
+
+
+class SheetsQuota:
+    """Token buckets for Sheets API reads and writes, shared by the processes on a host.
+
+    A request takes a token from its kind's bucket before it is sent. Bulk
+    and background requests leave SHEETS_QUOTA_RESERVE of each bucket to
+    in-call (interactive) ones, and hold back while a higher class is waiting
+    for a token. After a 429 no process sends that kind of request until the
+    backoff has passed; the backoff doubles with each 429 in a row. Bucket
+    state lives in a small JSON file under an exclusive lock.
+    """
+
+    def __init__(self, path: str = SHEETS_QUOTA_FILE, read_quota: float = SHEETS_READ_QUOTA,
+                 write_quota: float = SHEETS_WRITE_QUOTA, burst: float = SHEETS_QUOTA_BURST,
+                 reserve: float = SHEETS_QUOTA_RESERVE, period: float = 60.0):
+        self.path = path
+        self.burst = burst
+        self.reserve = reserve
+        self.capacity = {READ: min(burst, read_quota), WRITE: min(burst, write_quota)}
+        # Tokens per second, so burst + one period's refill stays within the quota
+        self.rate = {kind: max(quota - self.capacity[kind], 1) / period
+                     for kind, quota in ((READ, read_quota), (WRITE, write_quota))}
+        self._memory: dict = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sheets-quota")
+        # kind -> 429s in a row this process has seen, so successes only touch the file after one
+        self._strikes: dict[str, int] = {}
+
+    @contextmanager
+    def _state(self):
+        """The shared state, locked against other threads and processes; changes are saved"""
+        with self._lock:
+            if not self.path:
+                yield self._memory
+                return
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = b""
+                while chunk := os.read(fd, 65536):
+                    raw += chunk
+                try:
+                    state = json.loads(raw) if raw else {}
+                except ValueError:
+                    state = {}
+                yield state
+                data = json.dumps(state).encode()
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def _bucket(self, state: dict, kind: str, now: float) -> dict:
+        bucket = state.setdefault(kind, {})
+        capacity = self.capacity[kind]
+        tokens = bucket.get("tokens", capacity)
+        at = bucket.get("at", now)
+        bucket["tokens"] = min(capacity, tokens + max(0.0, now - at) * self.rate[kind])
+        bucket["at"] = now
+        return bucket
+
+    def take(self, kind: str, priority: str = BACKGROUND) -> float:
+        """Take a token if this request may go now. Returns 0 if it did, otherwise how
+        long to wait before asking again."""
+        now = time.time()
+        with self._state() as state:
+            bucket = self._bucket(state, kind, now)
+            backoff = bucket.get("backoff_until", 0) - now
+            if backoff > 0:
+                return backoff
+            waiting = bucket.setdefault("waiting", {})
+            rank = PRIORITIES.index(priority)
+            higher_waiting = any(waiting.get(p, 0) > now for p in PRIORITIES[:rank])
+            floor = 0 if priority == INTERACTIVE else self.capacity[kind] * self.reserve
+            if not higher_waiting and bucket["tokens"] - 1 >= floor:
+                bucket["tokens"] -= 1
+                return 0.0
+            wait = min(POLL_INTERVAL, max(0.01, (floor + 1 - bucket["tokens"]) / self.rate[kind]))
+            # Lower classes hold back until this request has had its next try
+            waiting[priority] = max(waiting.get(priority, 0), now + wait + 0.25)
+            return wait
+
+    def throttled(self, kind: str) -> float:
+        """Record a 429 for this kind of request; returns how long every process now waits"""
+        now = time.time()
+        with self._state() as state:
+            bucket = self._bucket(state, kind, now)
+            if bucket.get("backoff_until", 0) > now:
+                # Another request already backed off for this burst of 429s
+                return bucket["backoff_until"] - now
+            strikes = bucket.get("strikes", 0) + 1
+            delay = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** (strikes - 1)) * random.uniform(1, 1.25)
+            bucket.update(strikes=strikes, backoff_until=now + delay, tokens=0.0)
+        self._strikes[kind] = strikes
+        return delay
+
+    def succeeded(self, kind: str):
+        """Record a request that went through, ending the run of 429s if there was one"""
+        if not self._strikes.get(kind):
+            return
+        self._strikes[kind] = 0
+        with self._state() as state:
+            state.setdefault(kind, {})["strikes"] = 0
+
+    def acquire_blocking(self, kind: str, priority: str = BACKGROUND) -> float:
+        """Wait for a token, for scripts without an event loop. Returns seconds waited."""
+        start = time.monotonic()
+        while (wait := self.take(kind, priority)) > 0:
+            time.sleep(wait)
+        return time.monotonic() - start
+
+    async def acquire(self, kind: str, priority: str = BACKGROUND) -> float:
+        """Wait for a token without blocking the event loop. Returns seconds waited."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while (wait := await loop.run_in_executor(self._executor, self.take, kind, priority)) > 0:
+            await asyncio.sleep(wait)
+        return loop.time() - start
+
+    async def athrottled(self, kind: str) -> float:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.throttled, kind)
+
+
+def execute(request, kind: str, priority: str = BACKGROUND, quota: "SheetsQuota" = None, **kwargs):
+    """request.execute() within the shared quota, retrying 429s after the shared backoff.
+
+    For synchronous code; SheetsClient does the same without blocking the event loop.
+    """
+    quota = quota or get_sheets_quota()
+    for attempt in range(SHEETS_RATE_LIMIT_RETRIES + 1):
+        quota.acquire_blocking(kind, priority)
+        try:
+            result = request.execute(**kwargs)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == SHEETS_RATE_LIMIT_RETRIES:
+                raise
+            delay = quota.throttled(kind)
+            logger.warning(f"Sheets {kind} quota exceeded, backing off {delay:.1f}s")
+            continue
+        quota.succeeded(kind)
+        return result
+
+
+_quota = None
+_quota_lock = threading.Lock()
+
+
+def get_sheets_quota() -> SheetsQuota:
+    """Returns the process-wide SheetsQuota"""
+    global _quota
+    if _quota is None:
+        with _quota_lock:
+            if _quota is None:
+                _quota = SheetsQuota()
+    return _quota
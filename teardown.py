@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# -------- Teardown Setup --------
+# Longest wait for the agent to finish what it is saying before hanging up
+CALL_WRAPUP_TIMEOUT = float(os.getenv("CALL_WRAPUP_TIMEOUT", "10"))
+# Total time a job's teardown stages may take once its call has ended
+JOB_TEARDOWN_TIMEOUT = float(os.getenv("JOB_TEARDOWN_TIMEOUT", "10"))
+# How long a worker told to stop lets its calls run before ending them (keep above MAX_CALL_DURATION)
+WORKER_DRAIN_TIMEOUT = int(os.getenv("WORKER_DRAIN_TIMEOUT", "1200"))
+
+
+class Teardown:
+    """Shutdown steps run in order, each with its own deadline.
+
+    A stage that fails or overruns its deadline is logged and the next one
+    runs anyway, so one stuck flush cannot hold up the rest or keep the
+    process alive. No stage is given more than what is left of `budget`.
+    `run()` may be called more than once; later calls wait for the first.
+    """
+
+    def __init__(self, name: str, budget: float = JOB_TEARDOWN_TIMEOUT):
+        self.name = name
+        self.budget = budget
+        self._stages: list[tuple] = []
+        self._run_task = None
+
+    def add(self, name: str, fn, timeout: float):
+        """Add a stage; `fn` is called with no arguments and may return an awaitable"""
+        self._stages.append((name, fn, timeout))
+
+    async def run(self, reason: str = "") -> dict:
+        """Run the stages; returns each stage's result ("ok", "timeout" or the error)"""
+        if self._run_task is None:
+            self._run_task = asyncio.ensure_future(self._run(reason))
+        return await asyncio.shield(self._run_task)
+
+    async def _run(self, reason: str) -> dict:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = {}
+        for name, fn, timeout in self._stages:
+            left = self.budget - (loop.time() - start)
+            if left <= 0:
+                results[name] = "skipped"
+                continue
+            stage_start = time.monotonic()
+            try:
+                result = fn()
+                if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                    await asyncio.wait_for(result, min(timeout, left))
+                results[name] = "ok"
+            except asyncio.TimeoutError:
+                results[name] = "timeout"
+            except Exception as e:
+                results[name] = f"error: {e}"
+            elapsed_ms = (time.monotonic() - stage_start) * 1000
+            if results[name] != "ok":
+                logger.warning(f"{self.name} teardown: {name} {results[name]} after {elapsed_ms:.0f}ms")
+            else:
+                logger.debug(f"{self.name} teardown: {name} done in {elapsed_ms:.0f}ms")
+        logger.info(f"{self.name} torn down in {(loop.time() - start) * 1000:.0f}ms"
+                    f"{f' ({reason})' if reason else ''}: {results}")
+        return results
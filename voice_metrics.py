@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import tempfile
+import functools
+from collections import defaultdict
+
+from livekit.agents import metrics as lk_metrics
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# -------- Metrics Setup --------
+# The worker serves the metrics of all its job processes on this port (on the worker's host); empty disables it
+METRICS_PORT = os.getenv("METRICS_PORT", "9464")
+# Where job processes leave their samples for the worker to add up (prometheus_client multiprocess
+# mode). The worker empties it on start, so each worker on a host needs its own
+METRICS_MULTIPROC_DIR = (os.getenv("METRICS_MULTIPROC_DIR")
+                         or os.path.join(tempfile.gettempdir(), f"agent-metrics-{METRICS_PORT or 'off'}"))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+STT_LATENCY = Histogram("agent_stt_latency_seconds", "End of user speech to final transcript",
+                        buckets=LATENCY_BUCKETS)
+EOU_DELAY = Histogram("agent_eou_delay_seconds", "End of user speech to end-of-turn decision",
+                      buckets=LATENCY_BUCKETS)
+LLM_TTFT = Histogram("agent_llm_ttft_seconds", "LLM time to first token", ("prompt_cache",),
+                     buckets=LATENCY_BUCKETS)
+TTS_TTFB = Histogram("agent_tts_ttfb_seconds", "TTS time to first audio byte", buckets=LATENCY_BUCKETS)
+RESPONSE_LATENCY = Histogram("agent_response_latency_seconds",
+                             "End of user speech to first agent audio (EOU delay + LLM TTFT + TTS TTFB)",
+                             buckets=LATENCY_BUCKETS)
+TIME_TO_FIRST_AUDIO = Histogram("agent_time_to_first_audio_seconds",
+                                "Callee answering to first agent audio", ("greeting",), buckets=LATENCY_BUCKETS)
+TOOL_DURATION = Histogram("agent_tool_duration_seconds", "Function tool execution time", ("tool",),
+                          buckets=LATENCY_BUCKETS)
+AMD_DECISION = Histogram("agent_amd_decision_seconds",
+                         "Callee answering to the human/answering machine decision", ("result",),
+                         buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("agent_llm_tokens", "LLM tokens by kind: prompt (including cached), cached prompt, completion",
+                     ("kind",))
+ROUTE_TURNS = Counter("agent_route_turns", "Turns served by each model route", ("stage", "route"))
+LOOP_LAG = Histogram("agent_loop_lag_seconds", "How late the event loop ran the loop watchdog's check-ins",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_BLOCKED = Histogram("agent_loop_blocked_seconds", "Event loop stalls over LOOP_BLOCK_THRESHOLD",
+                         buckets=LATENCY_BUCKETS)
+
+
+def worker_metrics_options() -> dict:
+    """WorkerOptions that serve the job processes' metrics from one endpoint on the worker"""
+    if not METRICS_PORT:
+        return {}
+    return {"prometheus_port": int(METRICS_PORT), "prometheus_multiproc_dir": METRICS_MULTIPROC_DIR}
+
+
+class CallMetrics:
+    """Per-call view of the voice pipeline metrics.
+
+    Every sample also goes into the histograms above; the call
+    keeps its own copy so a summary can be written to the call log when the
+    call ends.
+    """
+
+    def __init__(self):
+        self.samples: dict[str, list] = defaultdict(list)
+        # Token counts of each LLM request made for this call, in order
+        self.llm_turns: list[dict] = []
+        # speech_id -> stage -> model route that served it, in turn order
+        self.turn_routes: dict[str, dict] = {}
+        # speech_id -> stage -> seconds, until all parts of a response are in
+        self._turns: dict[str, dict] = {}
+
+    def attach(self, session):
+        """Start collecting from an AgentSession"""
+        session.call_metrics = self
+        session.on("metrics_collected", self._on_metrics_collected)
+
+    def _observe(self, hist: Histogram, key: str, value: float, **labels):
+        (hist.labels(**labels) if labels else hist).observe(value)
+        self.samples[key].append(value)
+
+    def _on_metrics_collected(self, ev):
+        m = ev.metrics
+        if isinstance(m, lk_metrics.EOUMetrics):
+            self._observe(STT_LATENCY, "stt_latency", m.transcription_delay)
+            self._observe(EOU_DELAY, "eou_delay", m.end_of_utterance_delay)
+            self._add_turn_part(m.speech_id, "eou_delay", m.end_of_utterance_delay)
+        elif isinstance(m, lk_metrics.LLMMetrics):
+            self._record_llm_tokens(m)
+            if m.ttft >= 0:
+                prompt_cache = "hit" if m.prompt_cached_tokens else "miss"
+                self._observe(LLM_TTFT, "llm_ttft", m.ttft, prompt_cache=prompt_cache)
+                self._add_turn_part(m.speech_id, "llm_ttft", m.ttft)
+        elif isinstance(m, lk_metrics.TTSMetrics):
+            self._observe(TTS_TTFB, "tts_ttfb", m.ttfb)
+            self._add_turn_part(m.speech_id, "tts_ttfb", m.ttfb)
+
+    def _add_turn_part(self, speech_id, stage: str, value: float):
+        if not speech_id:
+            return
+        turn = self._turns.setdefault(speech_id, {})
+        # A response may be synthesised in several TTS segments; the first one counts
+        turn.setdefault(stage, value)
+        if len(turn) == 3:
+            self._observe(RESPONSE_LATENCY, "response_latency", sum(turn.values()))
+            del self._turns[speech_id]
+
+    def _record_llm_tokens(self, m):
+        self.llm_turns.append({
+            "prompt": m.prompt_tokens,
+            "cached": m.prompt_cached_tokens,
+            "completion": m.completion_tokens,
+            "ttft_ms": round(m.ttft * 1000) if m.ttft >= 0 else None,
+        })
+        LLM_TOKENS.labels(kind="prompt").inc(m.prompt_tokens)
+        LLM_TOKENS.labels(kind="cached").inc(m.prompt_cached_tokens)
+        LLM_TOKENS.labels(kind="completion").inc(m.completion_tokens)
+
+    def llm_tokens(self) -> dict:
+        """Token totals over the call's LLM requests, and the share of prompt tokens served from cache"""
+        totals = {kind: sum(turn[kind] for turn in self.llm_turns) for kind in ("prompt", "cached", "completion")}
+        totals["requests"] = len(self.llm_turns)
+        totals["cache_hit_ratio"] = round(totals["cached"] / totals["prompt"], 3) if totals["prompt"] else 0.0
+        return totals
+
+    def record_route(self, speech_id, stage: str, route: str):
+        """The model route (see model_routing) that served a stage of a turn"""
+        turn = self.turn_routes.setdefault(speech_id, {}) if speech_id else {}
+        # A response may be synthesised in several TTS segments; count the turn once
+        if turn.get(stage) != route:
+            turn[stage] = route
+            ROUTE_TURNS.labels(stage=stage, route=route).inc()
+
+    def record_first_audio(self, seconds: float, greeting: str):
+        """Time from answer to first agent audio; `greeting` says which path produced it"""
+        self._observe(TIME_TO_FIRST_AUDIO, "time_to_first_audio", seconds, greeting=greeting)
+
+    def record_amd_decision(self, seconds: float, result: str):
+        self._observe(AMD_DECISION, "amd_decision", seconds, result=result)
+
+    def record_tool(self, tool: str, seconds: float):
+        self._observe(TOOL_DURATION, f"tool.{tool}", seconds, tool=tool)
+
+    def summary(self) -> dict:
+        """Count, mean, p50 and max (in ms) of each stage for this call, its LLM token use and routes"""
+        result = {}
+        for key, values in self.samples.items():
+            ordered = sorted(values)
+            result[key] = {
+                "count": len(ordered),
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000),
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000),
+                "max_ms": round(ordered[-1] * 1000),
+            }
+        if self.llm_turns:
+            result["llm_tokens"] = self.llm_tokens()
+            result["llm_turns"] = self.llm_turns
+        if self.turn_routes:
+            result["turn_routes"] = [{"speech_id": speech_id, **routes}
+                                     for speech_id, routes in self.turn_routes.items()]
+        return result
+
+
+def timed_tool(fn):
+    """Records a function tool's execution time. Apply below @agents.function_tool."""
+    @functools.wraps(fn)
+    async def wrapper(self, ctx, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(self, ctx, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            call_metrics = getattr(ctx.session, "call_metrics", None)
+            if call_metrics is not None:
+                call_metrics.record_tool(fn.__name__, elapsed)
+            else:
+                TOOL_DURATION.labels(tool=fn.__name__).observe(elapsed)
+    return wrapper